@@ -1,77 +1,255 @@
 # app.py
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import timedelta
 import os
 from models import db
+from services.database import engine_options, install_sqlite_pragmas
+from services.metrics import init_metrics
+from services.profiler import init_profiler
+from services.query_stats import init_query_stats
+
+
+def load_config(app):
+    """Reads the default configuration, mostly from environment variables"""
+    # Configure SQLite database
+    # app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///nourish_net.db"
+    database_url = os.getenv("DATABASE_URL")
+
+    if database_url:
+        app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    else:
+        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///nourish_net.db"
+
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+    # app.config["SECRET_KEY"] = "2898db2a80a4f110e39490e2de8425c8c2523045587c08f1"
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+
+
+    # Configure session cookie
+    app.config["SESSION_COOKIE_NAME"] = "nourish_net_session"
+    app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=1)
+    app.config["SESSION_COOKIE_SECURE"] = os.getenv("SESSION_COOKIE_SECURE", "true").lower() in ("1", "true", "yes")
+    app.config["SESSION_COOKIE_HTTPONLY"] = True
+    app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+    # Logged-in users' public profiles are cached per worker (LRU of SIZE entries,
+    # 0 to disable) for TTL seconds, so session checks need no database query
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", 1024))
+    app.config["USER_CACHE_TTL"] = float(os.getenv("USER_CACHE_TTL", 60))
+    # Password hashing: werkzeug METHOD for new hashes (older hashes are upgraded on
+    # login), run in WORKERS processes per worker (0 for inline). At most MAX_PENDING
+    # hashes are in flight per worker (default 4 per hashing process); further logins
+    # wait up to QUEUE_TIMEOUT seconds for a slot, and those still waiting, or whose
+    # hash takes longer than TIMEOUT seconds, get a 503. Keep MAX_PENDING below
+    # GUNICORN_THREADS so logins never hold every thread
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 1))
+    app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 0)) or None
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(os.getenv("PASSWORD_HASH_TIMEOUT", 10))
+    app.config["PASSWORD_HASH_QUEUE_TIMEOUT"] = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 2))
+
+    # M-Pesa configuration
+    app.config["MPESA_BASE_URL"] = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+    app.config["MPESA_ACCESS_TOKEN_URL"] = (
+        "/oauth/v1/generate?grant_type=client_credentials"
+    )
+    app.config["MPESA_STK_PUSH_URL"] = "/mpesa/stkpush/v1/processrequest"
+    app.config["MPESA_STK_QUERY_URL"] = "/mpesa/stkpushquery/v1/query"
+    # app.config["MPESA_CONSUMER_KEY"] = "sB2Gdv6pqxdDD62uxZhsWS3f0hM01EPGdpw6cDwgdypAOZOw"
+    # app.config["MPESA_CONSUMER_SECRET"] = (
+    #     "ETPTjx8zZZKl7Mce4QsGJkMLWLJX8TYx8HxrY5qadqQFVAXy5GAEovL5tsbCCGtN"
+    # )
+    # app.config["MPESA_PASSKEY"] = (
+    #     "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
+    # )
+    app.config["MPESA_TILL_NUMBER"] = "174379"
+    app.config["MPESA_BUSINESS_SHORT_CODE"] = "174379"
+    # app.config["MPESA_CALLBACK_URL"] = "https://d864-41-90-172-126.ngrok-free.app/callback"
+
+    """Alternative"""
+    app.config["MPESA_CONSUMER_KEY"] = os.getenv("MPESA_CONSUMER_KEY")
+    app.config["MPESA_CONSUMER_SECRET"] = os.getenv("MPESA_CONSUMER_SECRET")
+    app.config["MPESA_PASSKEY"] = os.getenv("MPESA_PASSKEY")
+    app.config["MPESA_CALLBACK_URL"] = os.getenv("MPESA_CALLBACK_URL")
+
+    # M-Pesa token cache: tokens are reused until MARGIN seconds before expiry and
+    # refreshed in the background REFRESH_AHEAD seconds before that. Setting
+    # CACHE_PATH shares one token between all workers on the host.
+    app.config["MPESA_TOKEN_EXPIRY_MARGIN"] = int(os.getenv("MPESA_TOKEN_EXPIRY_MARGIN", 60))
+    app.config["MPESA_TOKEN_REFRESH_AHEAD"] = int(os.getenv("MPESA_TOKEN_REFRESH_AHEAD", 300))
+    app.config["MPESA_TOKEN_CACHE_PATH"] = os.getenv("MPESA_TOKEN_CACHE_PATH")
+
+    # M-Pesa HTTP client: pooled keep-alive connections per worker, per-operation
+    # "connect,read" timeouts in seconds, and jittered retries for idempotent calls
+    app.config["MPESA_POOL_CONNECTIONS"] = int(os.getenv("MPESA_POOL_CONNECTIONS", 4))
+    app.config["MPESA_POOL_MAXSIZE"] = int(os.getenv("MPESA_POOL_MAXSIZE", 10))
+    app.config["MPESA_TIMEOUT_TOKEN"] = os.getenv("MPESA_TIMEOUT_TOKEN", "3.05,10")
+    app.config["MPESA_TIMEOUT_STKPUSH"] = os.getenv("MPESA_TIMEOUT_STKPUSH", "3.05,15")
+    app.config["MPESA_TIMEOUT_STKQUERY"] = os.getenv("MPESA_TIMEOUT_STKQUERY", "3.05,10")
+    app.config["MPESA_MAX_RETRIES"] = int(os.getenv("MPESA_MAX_RETRIES", 2))
+    app.config["MPESA_RETRY_BACKOFF"] = float(os.getenv("MPESA_RETRY_BACKOFF", 0.2))
+    # Daraja circuit breakers (one per operation and worker): trip when FAILURE_RATE
+    # of the last WINDOW calls failed, or SLOW_RATE took at least SLOW_CALL
+    # seconds, then refuse calls for OPEN_SECONDS before a single probe.
+    # REQUEST_BUDGET caps the total time one request spends on Daraja calls.
+    app.config["MPESA_BREAKER_WINDOW"] = int(os.getenv("MPESA_BREAKER_WINDOW", 20))
+    app.config["MPESA_BREAKER_MIN_CALLS"] = int(os.getenv("MPESA_BREAKER_MIN_CALLS", 10))
+    app.config["MPESA_BREAKER_FAILURE_RATE"] = float(os.getenv("MPESA_BREAKER_FAILURE_RATE", 0.5))
+    app.config["MPESA_BREAKER_SLOW_CALL"] = float(os.getenv("MPESA_BREAKER_SLOW_CALL", 5))
+    app.config["MPESA_BREAKER_SLOW_RATE"] = float(os.getenv("MPESA_BREAKER_SLOW_RATE", 0.5))
+    app.config["MPESA_BREAKER_OPEN_SECONDS"] = float(os.getenv("MPESA_BREAKER_OPEN_SECONDS", 30))
+    app.config["MPESA_REQUEST_BUDGET"] = float(os.getenv("MPESA_REQUEST_BUDGET", 20))
+    # Payment reconciliation (flask --app app reconcile-payments): pending payments
+    # older than MIN_AGE seconds are resolved with STK queries, WORKERS at a time,
+    # at most RATE per second, BATCH_SIZE per transaction
+    app.config["MPESA_RECONCILE_MIN_AGE"] = float(os.getenv("MPESA_RECONCILE_MIN_AGE", 300))
+    app.config["MPESA_RECONCILE_WORKERS"] = int(os.getenv("MPESA_RECONCILE_WORKERS", 4))
+    app.config["MPESA_RECONCILE_RATE"] = float(os.getenv("MPESA_RECONCILE_RATE", 5))
+    app.config["MPESA_RECONCILE_BATCH_SIZE"] = int(os.getenv("MPESA_RECONCILE_BATCH_SIZE", 50))
+    # Idempotency-Key support on order creation and make-payment: stored responses
+    # are replayed for TTL seconds; a claim unfinished after LOCK_TIMEOUT seconds
+    # is taken over. A second make-payment for an order whose push is younger
+    # than COALESCE_WINDOW seconds and still pending returns that push instead.
+    app.config["IDEMPOTENCY_TTL"] = int(os.getenv("IDEMPOTENCY_TTL", 86400))
+    app.config["IDEMPOTENCY_LOCK_TIMEOUT"] = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 60))
+    app.config["MPESA_PUSH_COALESCE_WINDOW"] = int(os.getenv("MPESA_PUSH_COALESCE_WINDOW", 120))
+    # Threads per worker that fetch an access token while a payment request is
+    # being prepared (greenlets under the gevent worker class)
+    app.config["MPESA_IO_THREADS"] = int(os.getenv("MPESA_IO_THREADS", 4))
+
+    # Payment status events: how long one SSE/long-poll request waits, how often
+    # it checks for results recorded by other workers, and when (seconds after
+    # the STK push) it may fall back to querying Safaricom
+    app.config["MPESA_EVENTS_MAX_WAIT"] = float(os.getenv("MPESA_EVENTS_MAX_WAIT", 25))
+    app.config["MPESA_EVENTS_POLL_INTERVAL"] = float(os.getenv("MPESA_EVENTS_POLL_INTERVAL", 1))
+    app.config["MPESA_STATUS_QUERY_AFTER"] = float(os.getenv("MPESA_STATUS_QUERY_AFTER", 45))
+    app.config["MPESA_STATUS_QUERY_INTERVAL"] = float(os.getenv("MPESA_STATUS_QUERY_INTERVAL", 10))
+
+    # Callback inbox: background threads per worker, rows applied per transaction,
+    # and seconds between sweeps for rows stored by other workers
+    app.config["MPESA_CALLBACK_WORKERS"] = int(os.getenv("MPESA_CALLBACK_WORKERS", 2))
+    app.config["MPESA_CALLBACK_BATCH_SIZE"] = int(os.getenv("MPESA_CALLBACK_BATCH_SIZE", 50))
+    app.config["MPESA_CALLBACK_SWEEP_INTERVAL"] = float(os.getenv("MPESA_CALLBACK_SWEEP_INTERVAL", 5))
+
+    # Catalog cache: serialized menu/category responses are reused until a
+    # MenuItem/Category write commits. The version file tells other workers about
+    # the change; MAX_AGE bounds staleness for writes made outside the ORM, and at
+    # most SIZE responses are kept per worker.
+    app.config["CATALOG_VERSION_PATH"] = os.getenv(
+        "CATALOG_VERSION_PATH", os.path.join(app.instance_path, "catalog.version")
+    )
+    app.config["CATALOG_CHECK_INTERVAL"] = float(os.getenv("CATALOG_CHECK_INTERVAL", 1))
+    app.config["CATALOG_MAX_AGE"] = float(os.getenv("CATALOG_MAX_AGE", 300))
+    app.config["CATALOG_CACHE_SIZE"] = int(os.getenv("CATALOG_CACHE_SIZE", 1024))
+
+    # SQL statements per request: X-SQL-* response headers (on by default in
+    # debug mode) and a warning when one statement shape repeats this often
+    app.config["SQL_DEBUG_HEADERS"] = os.getenv("SQL_DEBUG_HEADERS", str(app.debug)).lower() in ("1", "true", "yes")
+    app.config["N_PLUS_ONE_THRESHOLD"] = int(os.getenv("N_PLUS_ONE_THRESHOLD", 5))
+
+    # Metrics: each worker flushes its counters to METRICS_DIR every
+    # METRICS_FLUSH_INTERVAL seconds and /metrics merges them. Scrapes must send
+    # "Authorization: Bearer <METRICS_TOKEN>"; without a token /metrics answers
+    # 404 unless METRICS_PUBLIC opts in to serving it to anyone.
+    app.config["METRICS_DIR"] = os.getenv("METRICS_DIR", os.path.join(app.instance_path, "metrics"))
+    app.config["METRICS_FLUSH_INTERVAL"] = float(os.getenv("METRICS_FLUSH_INTERVAL", 1))
+    app.config["METRICS_TOKEN"] = os.getenv("METRICS_TOKEN")
+    app.config["METRICS_PUBLIC"] = os.getenv("METRICS_PUBLIC", "false").lower() in ("1", "true", "yes")
+
+    # Sampling profiler: requests sent with "X-Profile: <PROFILER_TOKEN>" (and a
+    # PROFILE_SAMPLE_RATE fraction of all requests) are profiled into PROFILE_DIR,
+    # keeping the newest PROFILE_KEEP. Disabled without a token or rate.
+    app.config["PROFILER_TOKEN"] = os.getenv("PROFILER_TOKEN")
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    app.config["PROFILE_INTERVAL"] = float(os.getenv("PROFILE_INTERVAL", 0.005))
+    app.config["PROFILE_DIR"] = os.getenv("PROFILE_DIR", os.path.join(app.instance_path, "profiles"))
+    app.config["PROFILE_KEEP"] = int(os.getenv("PROFILE_KEEP", 50))
+
+    # Admin endpoints (sales analytics, exports) need "Authorization: Bearer <ADMIN_TOKEN>";
+    # they answer 404 while no token is set
+    app.config["ADMIN_TOKEN"] = os.getenv("ADMIN_TOKEN")
+    # Rows fetched per round trip by the streaming exports
+    app.config["EXPORT_BATCH_SIZE"] = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+
+def create_app(config=None):
+    """
+    Builds a configured Flask app
+
+    Args:
+        config (dict): Settings applied over the environment defaults, e.g.
+            {"SQLALCHEMY_DATABASE_URI": "sqlite://", "TESTING": True}
+
+    Returns:
+        Flask: App with extensions, blueprints and CLI commands registered
+    """
+    app = Flask(__name__)
+    CORS(app, expose_headers=["X-Next-Cursor"])
+
+    load_config(app)
+    if config:
+        app.config.update(config)
+
+    # Connection pooling and SQLite pragmas (WAL, busy_timeout, ...) are driven
+    # by DB_POOL_* and SQLITE_* environment variables; see services/database.py
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS", engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+    )
+    install_sqlite_pragmas()
+
+    # Initialize db with app
+    db.init_app(app)
+    init_query_stats(app)
+    init_metrics(app)
+    init_profiler(app)
+
+    # Every model must be imported before db.create_all()
+    from models import cart, category, idempotency, menu, order, payment, sales, user  # noqa: F401
+
+    from routes import register_blueprints
+    from commands import register_commands
+
+    register_blueprints(app)
+    register_commands(app)
+    return app
+
+
+def warm_caches(app):
+    """Builds the catalog responses and price index ahead of the first request"""
+    from routes.menu import warm_catalog
+    from routes.orders import get_price_index
+
+    with app.app_context():
+        warm_catalog()
+        get_price_index()
+        db.session.remove()
+
+
+def init_worker(app):
+    """
+    Per-process setup after a fork (see gunicorn.conf.py)
+
+    Connections inherited from the parent are dropped without being closed,
+    so the parent's sockets are left alone, caches not inherited from a
+    preloaded parent are warmed, and the callback inbox threads are started
+    so callbacks stored before a restart are applied without waiting for a
+    new one to arrive.
+    """
+    from routes.payments import get_callback_processor
+
+    with app.app_context():
+        db.engine.dispose(close=False)
+        get_callback_processor().start()
+    warm_caches(app)
 
-# Initialize Flask app
-app = Flask(__name__)
-CORS(app)
-
-# Configure SQLite database
-# app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///nourish_net.db"
-database_url = os.getenv("DATABASE_URL")
-
-if database_url:
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-else:
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///nourish_net.db"
-
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-# app.config["SECRET_KEY"] = "2898db2a80a4f110e39490e2de8425c8c2523045587c08f1"
-app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
-
-
-# Configure session cookie
-app.config["SESSION_COOKIE_NAME"] = "nourish_net_session"
-app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(days=1)
-app.config["SESSION_COOKIE_SECURE"] = True
-app.config["SESSION_COOKIE_HTTPONLY"] = True
-app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
-
-# M-Pesa configuration
-app.config["MPESA_BASE_URL"] = "https://sandbox.safaricom.co.ke"
-app.config["MPESA_ACCESS_TOKEN_URL"] = (
-    "/oauth/v1/generate?grant_type=client_credentials"
-)
-app.config["MPESA_STK_PUSH_URL"] = "/mpesa/stkpush/v1/processrequest"
-app.config["MPESA_STK_QUERY_URL"] = "/mpesa/stkpushquery/v1/query"
-# app.config["MPESA_CONSUMER_KEY"] = "sB2Gdv6pqxdDD62uxZhsWS3f0hM01EPGdpw6cDwgdypAOZOw"
-# app.config["MPESA_CONSUMER_SECRET"] = (
-#     "ETPTjx8zZZKl7Mce4QsGJkMLWLJX8TYx8HxrY5qadqQFVAXy5GAEovL5tsbCCGtN"
-# )
-# app.config["MPESA_PASSKEY"] = (
-#     "bfb279f9aa9bdbcf158e97dd71a467cd2e0c893059b10f78e6b72ada1ed2c919"
-# )
-app.config["MPESA_TILL_NUMBER"] = "174379"
-app.config["MPESA_BUSINESS_SHORT_CODE"] = "174379"
-# app.config["MPESA_CALLBACK_URL"] = "https://d864-41-90-172-126.ngrok-free.app/callback"
-
-"""Alternative"""
-app.config["MPESA_CONSUMER_KEY"] = os.getenv("MPESA_CONSUMER_KEY")
-app.config["MPESA_CONSUMER_SECRET"] = os.getenv("MPESA_CONSUMER_SECRET")
-app.config["MPESA_PASSKEY"] = os.getenv("MPESA_PASSKEY")
-app.config["MPESA_CALLBACK_URL"] = os.getenv("MPESA_CALLBACK_URL")
-
-# Initialize db with app
-db.init_app(app)
-
-# Import models after db initialization
-with app.app_context():
-    from models.user import User
-    from models.category import Category
-    from models.menu import MenuItem
-    from models.order import Order, OrderItem, OrderStatusHistory
-    from models.payment import Payment, PushRequest
-    from models.cart import CartItem
-
-# Import routes after models are defined
-from routes import *
 
 if __name__ == "__main__":
+    import migrations
+
+    app = create_app()
     with app.app_context():
         db.create_all()
+        migrations.upgrade(db.engine)
 
     app.run(debug=True, use_reloader=False)
@@ -0,0 +1,133 @@
+"""
+bench/callback_load.py - Duplicate-callback load test for mpesa_callback
+
+Seeds orders with pending payments, fires every callback several times from
+concurrent threads (as Safaricom's retries would), waits for the inbox to
+drain and checks that each payment was applied exactly once.
+
+Usage:
+    python bench/callback_load.py --payments 1000 --duplicates 3 --threads 16
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def callback_body(checkout_request_id, result_code):
+    callback = {
+        "MerchantRequestID": "bench",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully."
+        if result_code == 0 else "Request cancelled by user",
+    }
+    if result_code == 0:
+        callback["CallbackMetadata"] = {"Item": [
+            {"Name": "Amount", "Value": 1},
+            {"Name": "MpesaReceiptNumber", "Value": f"R{checkout_request_id[-8:]}"},
+            {"Name": "TransactionDate", "Value": 20250101120000},
+            {"Name": "PhoneNumber", "Value": 254700000000},
+        ]}
+    return json.dumps({"Body": {"stkCallback": callback}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payments", type=int, default=1000)
+    parser.add_argument("--duplicates", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--database-url", help="Defaults to a temporary SQLite file")
+    args = parser.parse_args()
+
+    if not args.database_url:
+        args.database_url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("SECRET_KEY", "bench")
+
+    from app import create_app
+    from models import db
+    from models.order import Order, OrderStatusHistory
+    from models.payment import Payment, PushRequest, CallbackInbox
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        orders = [
+            Order(user_id=1, total_amount=100, customer_phone="254700000000")
+            for _ in range(args.payments)
+        ]
+        db.session.add_all(orders)
+        db.session.flush()
+        for i, order in enumerate(orders):
+            payment = Payment(order_id=order.id, amount=100, payment_method="mpesa", status="pending")
+            db.session.add(payment)
+            db.session.add(PushRequest(payment=payment, checkout_request_id=f"ws_CO_bench_{i:08d}"))
+        db.session.commit()
+
+    bodies = [
+        callback_body(f"ws_CO_bench_{i:08d}", 0 if i % 10 else 1032)
+        for i in range(args.payments)
+    ] * args.duplicates
+
+    client = app.test_client()
+    latencies = []
+    lock = threading.Lock()
+
+    def fire(body):
+        start = time.perf_counter()
+        response = client.post("/api/mpesa-callback", data=body, content_type="application/json")
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+        return response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.threads) as pool:
+        statuses = list(pool.map(fire, bodies))
+    ingest_time = time.perf_counter() - start
+
+    with app.app_context():
+        while CallbackInbox.query.filter(CallbackInbox.status.in_(["pending", "processing"])).count():
+            time.sleep(0.1)
+            db.session.remove()
+        drained = time.perf_counter() - start
+
+        successes = sum(1 for i in range(args.payments) if i % 10)
+        history_rows = OrderStatusHistory.query.count()
+        completed = Payment.query.filter_by(status="completed").count()
+        failed = Payment.query.filter_by(status="failed").count()
+        inbox_rows = CallbackInbox.query.count()
+
+    print(f"callbacks sent:      {len(bodies)} ({args.duplicates}x {args.payments})")
+    print(f"non-200 responses:   {sum(1 for s in statuses if s != 200)}")
+    print(f"ingest throughput:   {len(bodies) / ingest_time:.0f} req/s")
+    print(f"ingest latency ms:   p50={percentile(latencies, 50) * 1000:.2f} "
+          f"p95={percentile(latencies, 95) * 1000:.2f} p99={percentile(latencies, 99) * 1000:.2f}")
+    print(f"drained after:       {drained:.2f}s")
+    print(f"inbox rows:          {inbox_rows} (expected {args.payments})")
+    print(f"payments completed:  {completed} (expected {successes})")
+    print(f"payments failed:     {failed} (expected {args.payments - successes})")
+    print(f"history rows:        {history_rows} (expected {successes * 2})")
+
+    ok = (inbox_rows == args.payments and history_rows == successes * 2
+          and completed == successes and failed == args.payments - successes)
+    print("exactly-once:        " + ("OK" if ok else "FAILED"))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+bench/daraja_simulator.py - Local stand-in for the Daraja (M-Pesa) API
+
+Implements the three endpoints the app calls:
+
+- GET  /oauth/v1/generate               (Basic auth -> access token)
+- POST /mpesa/stkpush/v1/processrequest (accepts the push, schedules a callback)
+- POST /mpesa/stkpushquery/v1/query     (result once the "customer" answered)
+
+Every request waits a configurable latency and fails with HTTP 500/503 at a
+configurable rate. Each accepted push is resolved with a result code drawn
+from --result-codes, and an stkCallback payload shaped like Safaricom's is
+POSTed to the push's CallBackURL (or --callback-url) after --callback-delay.
+
+Usage:
+    python bench/daraja_simulator.py --port 18999 --latency-ms 120 \\
+        --error-rate 0.01 --result-codes 0:0.9,1032:0.07,1037:0.03
+    MPESA_BASE_URL=http://127.0.0.1:18999 flask --app app run
+"""
+
+import argparse
+import base64
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+RESULT_DESCRIPTIONS = {
+    0: "The service request is processed successfully.",
+    1032: "Request cancelled by user",
+    1037: "DS timeout user cannot be reached",
+}
+
+
+def parse_weights(value):
+    """Parses "0:0.9,1032:0.07" into ([0, 1032], [0.9, 0.07])"""
+    codes, weights = [], []
+    for part in value.split(","):
+        code, _, weight = part.partition(":")
+        codes.append(int(code))
+        weights.append(float(weight or 1))
+    return codes, weights
+
+
+def parse_range(value):
+    """Parses "2,5" (or "3") into a (min, max) pair of floats"""
+    parts = [float(p) for p in str(value).split(",")]
+    return parts[0], parts[-1]
+
+
+class Simulator:
+    """
+    Simulated Daraja state: issued tokens, pushes and pending callbacks
+
+    Args:
+        latency (tuple): (min, max) seconds added to every response
+        error_rate (float): Fraction of requests answered with HTTP 500/503
+        result_codes (tuple): (codes, weights) for push outcomes
+        callback_delay (tuple): (min, max) seconds before the callback
+        callback_url (str): Overrides the CallBackURL sent with each push
+        token_ttl (int): expires_in of issued tokens
+    """
+
+    def __init__(self, latency=(0, 0), error_rate=0.0, result_codes=([0], [1.0]),
+                 callback_delay=(1, 3), callback_url=None, token_ttl=3599):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.result_codes = result_codes
+        self.callback_delay = callback_delay
+        self.callback_url = callback_url
+        self.token_ttl = token_ttl
+
+        self.tokens = set()
+        self.pushes = {}
+        self.stats = {"token": 0, "stkpush": 0, "stkquery": 0, "errors": 0,
+                      "callbacks_sent": 0, "callbacks_failed": 0}
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = threading.Condition(self._lock)
+        self._http = requests.Session()
+        self._senders = ThreadPoolExecutor(16, thread_name_prefix="callback")
+        threading.Thread(target=self._deliver_loop, name="callback-scheduler", daemon=True).start()
+
+    # ------------------------------------------------------------------
+    # Endpoint behaviour
+    # ------------------------------------------------------------------
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens.add(token)
+            self.stats["token"] += 1
+        return {"access_token": token, "expires_in": str(self.token_ttl)}
+
+    def valid_token(self, authorization):
+        token = (authorization or "").removeprefix("Bearer ")
+        with self._lock:
+            return token in self.tokens
+
+    def stk_push(self, payload):
+        now = datetime.now()
+        checkout_request_id = f"ws_CO_{now:%d%m%Y%H%M%S}{random.randint(0, 10**9):09d}"
+        merchant_request_id = f"{random.randint(10000, 99999)}-{random.randint(10**7, 10**8 - 1)}-1"
+        codes, weights = self.result_codes
+        push = {
+            "merchant_request_id": merchant_request_id,
+            "checkout_request_id": checkout_request_id,
+            "result_code": random.choices(codes, weights)[0],
+            "amount": payload.get("Amount"),
+            "phone": payload.get("PhoneNumber"),
+            "callback_url": self.callback_url or payload.get("CallBackURL"),
+            "resolved": False,
+        }
+        due = time.monotonic() + random.uniform(*self.callback_delay)
+        with self._wakeup:
+            self.pushes[checkout_request_id] = push
+            self.stats["stkpush"] += 1
+            heapq.heappush(self._queue, (due, next(self._seq), checkout_request_id))
+            self._wakeup.notify()
+        return {
+            "MerchantRequestID": merchant_request_id,
+            "CheckoutRequestID": checkout_request_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }
+
+    def stk_query(self, payload):
+        """
+        Returns:
+            tuple: (http_status, body)
+        """
+        with self._lock:
+            self.stats["stkquery"] += 1
+            push = self.pushes.get(payload.get("CheckoutRequestID"))
+        if push is None:
+            return 400, {"requestId": uuid.uuid4().hex, "errorCode": "400.002.02",
+                         "errorMessage": "Bad Request - Invalid CheckoutRequestID"}
+        if not push["resolved"]:
+            return 500, {"requestId": uuid.uuid4().hex, "errorCode": "500.001.1001",
+                         "errorMessage": "The transaction is being processed"}
+        return 200, {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": push["merchant_request_id"],
+            "CheckoutRequestID": push["checkout_request_id"],
+            "ResultCode": str(push["result_code"]),
+            "ResultDesc": RESULT_DESCRIPTIONS.get(push["result_code"], "Transaction failed"),
+        }
+
+    # ------------------------------------------------------------------
+    # Callbacks
+    # ------------------------------------------------------------------
+
+    def callback_payload(self, push):
+        callback = {
+            "MerchantRequestID": push["merchant_request_id"],
+            "CheckoutRequestID": push["checkout_request_id"],
+            "ResultCode": push["result_code"],
+            "ResultDesc": RESULT_DESCRIPTIONS.get(push["result_code"], "Transaction failed"),
+        }
+        if push["result_code"] == 0:
+            callback["CallbackMetadata"] = {"Item": [
+                {"Name": "Amount", "Value": push["amount"]},
+                {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+                {"Name": "TransactionDate", "Value": int(datetime.now().strftime("%Y%m%d%H%M%S"))},
+                {"Name": "PhoneNumber", "Value": int(push["phone"] or 0)},
+            ]}
+        return {"Body": {"stkCallback": callback}}
+
+    def _deliver_loop(self):
+        while True:
+            with self._wakeup:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._wakeup.wait(timeout)
+                _, _, checkout_request_id = heapq.heappop(self._queue)
+                push = self.pushes[checkout_request_id]
+                push["resolved"] = True
+            if push["callback_url"]:
+                self._senders.submit(self._send_callback, push)
+
+    def _send_callback(self, push):
+        try:
+            response = self._http.post(push["callback_url"], json=self.callback_payload(push), timeout=10)
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            ok = False
+        with self._lock:
+            self.stats["callbacks_sent" if ok else "callbacks_failed"] += 1
+
+
+def make_handler(sim):
+    class DarajaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def begin(self):
+            """Applies latency and error injection; returns False if the request failed"""
+            low, high = sim.latency
+            if high > 0:
+                time.sleep(random.uniform(low, high))
+            if sim.should_fail():
+                with sim._lock:
+                    sim.stats["errors"] += 1
+                self.send_json(random.choice((500, 503)), {
+                    "requestId": uuid.uuid4().hex, "errorCode": "500.003.02",
+                    "errorMessage": "System is busy. Please try again in few minutes.",
+                })
+                return False
+            return True
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/stats":
+                with sim._lock:
+                    return self.send_json(200, dict(sim.stats))
+            if path != "/oauth/v1/generate":
+                return self.send_json(404, {"errorMessage": "Not found"})
+            if not self.begin():
+                return
+            auth = self.headers.get("Authorization", "")
+            try:
+                key, _, secret = base64.b64decode(auth.removeprefix("Basic ")).decode().partition(":")
+            except ValueError:
+                key = secret = ""
+            if not auth.startswith("Basic ") or not key or not secret:
+                return self.send_json(400, {"errorCode": "400.008.01", "errorMessage": "Invalid Authentication passed"})
+            self.send_json(200, sim.issue_token())
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                payload = None
+            if path not in ("/mpesa/stkpush/v1/processrequest", "/mpesa/stkpushquery/v1/query"):
+                return self.send_json(404, {"errorMessage": "Not found"})
+            if not self.begin():
+                return
+            if not sim.valid_token(self.headers.get("Authorization")):
+                return self.send_json(401, {"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+            if not isinstance(payload, dict):
+                return self.send_json(400, {"errorCode": "400.002.02", "errorMessage": "Bad Request"})
+            if path == "/mpesa/stkpush/v1/processrequest":
+                self.send_json(200, sim.stk_push(payload))
+            else:
+                self.send_json(*sim.stk_query(payload))
+
+        def log_message(self, format, *args):
+            pass
+
+    return DarajaHandler
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under concurrent load
+    request_queue_size = 256
+
+
+def start(sim, host="127.0.0.1", port=18999):
+    """Serves the simulator from a background thread and returns the server"""
+    server = SimulatorServer((host, port), make_handler(sim))
+    threading.Thread(target=server.serve_forever, name="daraja-simulator", daemon=True).start()
+    return server
+
+
+def add_arguments(parser):
+    parser.add_argument("--latency-ms", default="50,150", help="min,max added latency (default 50,150)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of HTTP 500/503 answers")
+    parser.add_argument("--result-codes", default="0:0.9,1032:0.07,1037:0.03",
+                        help="code:weight list of push outcomes")
+    parser.add_argument("--callback-delay", default="1,3", help="min,max seconds before the callback")
+    parser.add_argument("--callback-url", help="Send callbacks here instead of each push's CallBackURL")
+
+
+def simulator_from_args(args):
+    low, high = parse_range(args.latency_ms)
+    return Simulator(
+        latency=(low / 1000, high / 1000),
+        error_rate=args.error_rate,
+        result_codes=parse_weights(args.result_codes),
+        callback_delay=parse_range(args.callback_delay),
+        callback_url=args.callback_url,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18999)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start(simulator_from_args(args), args.host, args.port)
+    print(f"Daraja simulator on http://{args.host}:{args.port} (GET /stats for counters)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
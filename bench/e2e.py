@@ -0,0 +1,271 @@
+"""
+bench/e2e.py - End-to-end load benchmark of the ordering and payment flow
+
+Each virtual user runs: register -> login -> browse menu -> create order ->
+pay (STK push) -> await the payment result (long-poll on
+/api/payments/<id>/events until the callback lands). Reports throughput and
+p50/p95/p99 per step; --save writes the numbers as JSON and --baseline
+compares a run against a saved one.
+
+By default the app is served in-process (threaded werkzeug, temporary SQLite
+database seeded with a menu) against an in-process Daraja simulator. Use
+--base-url to target a running deployment instead; it must be started with
+MPESA_BASE_URL pointing at bench/daraja_simulator.py and
+SESSION_COOKIE_SECURE=0 when served over plain HTTP.
+
+Usage:
+    python bench/e2e.py --users 200 --concurrency 20 --save baseline.json
+    python bench/e2e.py --users 200 --concurrency 20 --baseline baseline.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import daraja_simulator  # noqa: E402
+
+STEPS = ("register", "login", "menu", "create_order", "pay", "await_result", "flow")
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Results:
+    """Thread-safe latencies and error counts per step"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.retries = {step: 0 for step in STEPS}
+        self.outcomes = {}
+
+    def record(self, step, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self.latencies[step].append(seconds)
+            else:
+                self.errors[step] += 1
+
+    def retried(self, step):
+        with self._lock:
+            self.retries[step] += 1
+
+    def outcome(self, status):
+        with self._lock:
+            self.outcomes[status] = self.outcomes.get(status, 0) + 1
+
+    def summary(self, wall_time):
+        summary = {"wall_time": wall_time, "outcomes": self.outcomes, "steps": {}}
+        for step in STEPS:
+            values = self.latencies[step]
+            summary["steps"][step] = {
+                "count": len(values),
+                "errors": self.errors[step],
+                "retries": self.retries[step],
+                "throughput": len(values) / wall_time if wall_time else 0.0,
+                "p50": percentile(values, 50) if values else None,
+                "p95": percentile(values, 95) if values else None,
+                "p99": percentile(values, 99) if values else None,
+            }
+        return summary
+
+
+class StepFailed(Exception):
+    pass
+
+
+def timed(results, step, call, expected=(200, 201), retries=5):
+    """
+    Runs one step, retrying a 503 after its Retry-After like a client would
+
+    The latency recorded includes the retries and the waits between them.
+    """
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            response = call()
+        except requests.exceptions.RequestException as e:
+            results.record(step, 0, ok=False)
+            raise StepFailed(f"{step}: {e}") from e
+        if response.status_code != 503 or "Retry-After" not in response.headers or attempt == retries:
+            break
+        results.retried(step)
+        time.sleep(float(response.headers["Retry-After"]))
+    elapsed = time.perf_counter() - start
+    if response.status_code not in expected:
+        results.record(step, elapsed, ok=False)
+        raise StepFailed(f"{step}: HTTP {response.status_code} {response.text[:200]}")
+    results.record(step, elapsed)
+    return response
+
+
+def run_user(base_url, run_id, index, results, result_timeout):
+    http = requests.Session()
+    contact = f"07{(int(run_id, 16) + index) % 10**8:08d}"
+    user = {
+        "fullname": f"Bench User {index}",
+        "email": f"bench-{run_id}-{index}@example.com",
+        "contact": contact,
+        "password": "bench-password",
+    }
+    flow_start = time.perf_counter()
+    try:
+        timed(results, "register", lambda: http.post(f"{base_url}/api/register", json=user))
+        timed(results, "login", lambda: http.post(
+            f"{base_url}/api/login", json={"contact": contact, "password": user["password"]}
+        ))
+        menu = timed(results, "menu", lambda: http.get(f"{base_url}/api/menu")).json()
+        available = [item["id"] for item in menu]
+        items = [
+            {"menu_item_id": item_id, "quantity": random.randint(1, 3)}
+            for item_id in random.sample(available, min(3, len(available)))
+        ]
+        order = timed(results, "create_order", lambda: http.post(
+            f"{base_url}/api/orders", json={"customer_phone": contact, "items": items}
+        )).json()
+        payment = timed(results, "pay", lambda: http.post(f"{base_url}/api/make-payment", json={
+            "phone": contact, "amount": max(1, int(order["total_amount"])), "order_id": order["order_id"],
+        })).json()
+
+        checkout_request_id = payment["checkout_request_id"]
+        wait_start = time.perf_counter()
+        while True:
+            result = http.get(
+                f"{base_url}/api/payments/{checkout_request_id}/events", timeout=result_timeout + 30
+            ).json()
+            if result.get("status") != "pending":
+                results.record("await_result", time.perf_counter() - wait_start)
+                results.outcome(result.get("status"))
+                break
+            if time.perf_counter() - wait_start > result_timeout:
+                results.record("await_result", 0, ok=False)
+                raise StepFailed("await_result: no payment result")
+        results.record("flow", time.perf_counter() - flow_start)
+    except (StepFailed, KeyError, ValueError, requests.exceptions.RequestException):
+        results.record("flow", 0, ok=False)
+
+
+def serve_in_process(args):
+    """Starts the simulator and the app; returns the app's base URL"""
+    workdir = tempfile.mkdtemp(prefix="bench-e2e-")
+    app_port = args.app_port
+    sim = daraja_simulator.simulator_from_args(args)
+    daraja_simulator.start(sim, port=args.simulator_port)
+
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "SESSION_COOKIE_SECURE": "0",
+        "MPESA_BASE_URL": f"http://127.0.0.1:{args.simulator_port}",
+        "MPESA_CALLBACK_URL": f"http://127.0.0.1:{app_port}/api/mpesa-callback",
+        "MPESA_CONSUMER_KEY": "bench-key",
+        "MPESA_CONSUMER_SECRET": "bench-secret",
+        "MPESA_PASSKEY": "bench-passkey",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import create_app
+    from models import db
+    from models.category import Category
+    from models.menu import MenuItem
+    import migrations
+
+    app = create_app()
+
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+        categories = [Category(name=name) for name in ("Mains", "Drinks", "Desserts")]
+        db.session.add_all(categories)
+        db.session.flush()
+        db.session.add_all(
+            MenuItem(name=f"Item {i}", price=50 + 10 * i, category_id=categories[i % 3].id)
+            for i in range(30)
+        )
+        db.session.commit()
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", app_port, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return f"http://127.0.0.1:{app_port}"
+
+
+def print_summary(summary, baseline=None):
+    print(f"wall time: {summary['wall_time']:.2f}s   outcomes: {summary['outcomes']}")
+    width = 18 if baseline else 10
+    print(f"{'step':<14}{'count':>7}{'errors':>8}{'retries':>9}{'req/s':>9}"
+          + "".join(f"{label:>{width}}" for label in ("p50 ms", "p95 ms", "p99 ms")))
+    for step, s in summary["steps"].items():
+        cells = []
+        for pct in ("p50", "p95", "p99"):
+            value = s[pct]
+            cell = "-" if value is None else f"{value * 1000:.1f}"
+            old = (baseline or {}).get("steps", {}).get(step, {}).get(pct)
+            if value is not None and old:
+                cell += f" ({(value - old) / old * 100:+.0f}%)"
+            cells.append(cell)
+        print(f"{step:<14}{s['count']:>7}{s['errors']:>8}{s.get('retries', 0):>9}{s['throughput']:>9.1f}"
+              + "".join(f"{cell:>{width}}" for cell in cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--base-url", help="Benchmark a running deployment instead")
+    parser.add_argument("--app-port", type=int, default=18080)
+    parser.add_argument("--simulator-port", type=int, default=18999)
+    parser.add_argument("--result-timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="Write the summary as JSON")
+    parser.add_argument("--baseline", help="Compare against a summary saved with --save")
+    daraja_simulator.add_arguments(parser)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    base_url = args.base_url.rstrip("/") if args.base_url else serve_in_process(args)
+
+    results = Results()
+    run_id = uuid.uuid4().hex[:8]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        for i in range(args.users):
+            pool.submit(run_user, base_url, run_id, i, results, args.result_timeout)
+    summary = results.summary(time.perf_counter() - start)
+    summary["config"] = {"users": args.users, "concurrency": args.concurrency,
+                         "latency_ms": args.latency_ms, "error_rate": args.error_rate,
+                         "callback_delay": args.callback_delay}
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+bench/export_stream.py - Export throughput and memory against row count
+
+Seeds a temporary SQLite database with each of --sizes orders and runs
+`flask export orders` in a subprocess per size and format, printing rows/s,
+output size and the process's peak RSS. The RSS should stay flat as the
+row count grows. SQLite's mmap is turned off for the run: mapped database
+pages count towards RSS and would grow with the file, not the export.
+
+Usage:
+    python bench/export_stream.py --sizes 100000 1000000
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def seed(orders):
+    from sqlalchemy import text
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        db.session.execute(text("DELETE FROM orders"))
+        db.session.execute(text(
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :orders) "
+            "INSERT INTO orders (id, user_id, total_amount, status, payment_status, customer_phone, "
+            "delivery_address, created_at) "
+            "SELECT i, 1 + i % 500, 100 + i % 900, 'completed', 'completed', '254700000000', 'Moi Avenue, Nairobi', "
+            "datetime('2025-01-01', '+' || (i * 7) || ' seconds') FROM n"
+        ), {"orders": orders})
+        db.session.commit()
+
+
+def run_export(fmt, output):
+    """Runs one export in a child process; returns (seconds, peak RSS in MB)"""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", "flask", "--app", "app", "export", "orders", "--format", fmt, "-o", output],
+        cwd=ROOT, check=True, stderr=subprocess.DEVNULL,
+    )
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is the largest child so far; sizes run in increasing order
+    return elapsed, max(before, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-export-")
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "SQLITE_MMAP_SIZE": "0",
+    })
+    output = os.path.join(workdir, "export.out")
+
+    print(f"{'rows':>10}{'format':>8}{'rows/s':>10}{'MB out':>10}{'peak RSS MB':>14}")
+    for size in sorted(args.sizes):
+        seed(size)
+        for fmt in ("csv", "ndjson"):
+            elapsed, rss = run_export(fmt, output)
+            print(f"{size:>10}{fmt:>8}{size / elapsed:>10.0f}{os.path.getsize(output) / 1e6:>10.1f}{rss:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
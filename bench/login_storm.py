@@ -0,0 +1,196 @@
+"""
+bench/login_storm.py - Menu latency during a burst of logins
+
+Serves the app with one gunicorn worker (gthread, GUNICORN_THREADS threads)
+and, for --duration seconds, keeps --login-concurrency clients logging in
+while --menu-concurrency clients read /api/menu. Runs once per mode:
+
+- inline: PASSWORD_HASH_WORKERS=0, every login hashes on a request thread
+          and nothing is rejected
+- pool:   hashing in PASSWORD_HASH_WORKERS processes with at most
+          --max-pending hashes in flight; further logins wait up to
+          PASSWORD_HASH_QUEUE_TIMEOUT seconds and then get a 503
+
+Prints successful logins/s, rejected logins, menu reads/s and menu
+p50/p95/p99 latency per mode, plus the menu latency with no logins.
+
+Usage:
+    python bench/login_storm.py --duration 20 --login-concurrency 32 --menu-concurrency 4
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "storm-password"
+
+
+def seed(users, method):
+    """
+    Creates the schema, a menu and `users` users sharing one password
+
+    Returns:
+        tuple: (session cookie name, value) of the first user, for the menu readers
+    """
+    from werkzeug.security import generate_password_hash
+    from app import create_app
+    from models import db
+    from models.menu import MenuItem
+    from models.user import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        password_hash = generate_password_hash(PASSWORD, method)
+        db.session.add_all(
+            User(fullname=f"User {i}", contacts=f"07{i:08d}", email=f"user{i}@example.com",
+                 password_hash=password_hash)
+            for i in range(users)
+        )
+        db.session.add_all(MenuItem(name=f"Item {i}", price=100 + i) for i in range(40))
+        db.session.commit()
+        return (
+            app.config["SESSION_COOKIE_NAME"],
+            app.session_interface.get_signing_serializer(app).dumps({"user_id": 1}),
+        )
+
+
+def start_server(port, env):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("gunicorn did not start")
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else None
+
+
+def storm(base_url, args, cookie, logins):
+    """
+    Runs menu readers, and login clients if `logins`, for --duration seconds
+
+    Returns:
+        dict: Login and menu counts and menu latencies
+    """
+    stop = threading.Event()
+    menu_latencies = []
+    counts = {"logins": 0, "rejected": 0, "login_errors": 0}
+    lock = threading.Lock()
+
+    def read_menu():
+        http = requests.Session()
+        http.cookies.set(*cookie)
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = http.get(f"{base_url}/api/menu", timeout=60)
+            if response.status_code == 200:
+                menu_latencies.append(time.perf_counter() - start)
+
+    def log_in(i):
+        http = requests.Session()
+        while not stop.is_set():
+            response = http.post(f"{base_url}/api/login", json={
+                "contact": f"07{i % args.users:08d}", "password": PASSWORD,
+            }, timeout=60)
+            name = {200: "logins", 503: "rejected"}.get(response.status_code, "login_errors")
+            with lock:
+                counts[name] += 1
+            if response.status_code == 503:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+            i += args.login_concurrency
+
+    threads = [threading.Thread(target=read_menu) for _ in range(args.menu_concurrency)]
+    if logins:
+        threads += [threading.Thread(target=log_in, args=(i,)) for i in range(args.login_concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    menu_latencies.sort()
+    return {
+        **counts,
+        "logins_per_second": counts["logins"] / args.duration,
+        "menu_per_second": len(menu_latencies) / args.duration,
+        "p50": percentile(menu_latencies, 0.5),
+        "p95": percentile(menu_latencies, 0.95),
+        "p99": percentile(menu_latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--login-concurrency", type=int, default=32)
+    parser.add_argument("--menu-concurrency", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=8, help="GUNICORN_THREADS")
+    parser.add_argument("--hash-workers", type=int, default=1, help="PASSWORD_HASH_WORKERS for the pool mode")
+    parser.add_argument("--max-pending", type=int, default=4, help="PASSWORD_HASH_MAX_PENDING for the pool mode")
+    parser.add_argument("--method", default="scrypt:32768:8:1", help="PASSWORD_HASH_METHOD")
+    parser.add_argument("--port", type=int, default=18083)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-login-")
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "SESSION_COOKIE_SECURE": "0",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+        "PASSWORD_HASH_METHOD": args.method,
+    })
+    cookie = seed(args.users, args.method)
+
+    modes = {
+        "idle": ({"PASSWORD_HASH_WORKERS": "0"}, False),
+        "inline": ({"PASSWORD_HASH_WORKERS": "0", "PASSWORD_HASH_MAX_PENDING": "1000000"}, True),
+        "pool": ({"PASSWORD_HASH_WORKERS": str(args.hash_workers),
+                  "PASSWORD_HASH_MAX_PENDING": str(args.max_pending)}, True),
+    }
+    print(f"{args.duration:.0f}s, {args.login_concurrency} login clients, {args.menu_concurrency} menu readers, "
+          f"{args.threads} threads, {args.method}")
+    print(f"{'mode':<8}{'logins/s':>10}{'503s':>8}{'menu/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    base_url = f"http://127.0.0.1:{args.port}"
+    for mode, (settings, logins) in modes.items():
+        env = dict(os.environ, WEB_CONCURRENCY="1", GUNICORN_WORKER_CLASS="gthread",
+                   GUNICORN_THREADS=str(args.threads), GUNICORN_BIND=f"127.0.0.1:{args.port}", **settings)
+        server = start_server(args.port, env)
+        try:
+            if logins:
+                # Start the hashing pool before timing
+                requests.post(f"{base_url}/api/login", json={"contact": "0700000000", "password": PASSWORD})
+            r = storm(base_url, args, cookie, logins)
+        finally:
+            server.terminate()
+            server.wait()
+        ms = ["-" if r[p] is None else f"{r[p] * 1000:.1f}" for p in ("p50", "p95", "p99")]
+        print(f"{mode:<8}{r['logins_per_second']:>10.1f}{r['rejected']:>8}{r['menu_per_second']:>10.1f}"
+              f"{ms[0]:>10}{ms[1]:>10}{ms[2]:>10}")
+        if r["login_errors"]:
+            print(f"  {r['login_errors']} logins failed with other errors")
+
+
+if __name__ == "__main__":
+    main()
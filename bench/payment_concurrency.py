@@ -0,0 +1,189 @@
+"""
+bench/payment_concurrency.py - Concurrent payment initiations per worker
+
+Serves the app with one gunicorn worker per mode and fires --requests
+POST /api/make-payment calls, --concurrency at a time, at it. Daraja is the
+in-process simulator with --latency-ms on every call, so a worker's
+throughput is bounded by how many requests it can keep waiting on Safaricom
+at once:
+
+- sync:    one request at a time (the sync worker class)
+- gthread: GUNICORN_THREADS requests at a time (the default configuration)
+- gevent:  GUNICORN_WORKER_CONNECTIONS requests at a time on greenlets
+           (skipped when gevent is not installed)
+
+Prints payments/s and p50/p95 latency per mode.
+
+Usage:
+    python bench/payment_concurrency.py --requests 300 --concurrency 100 --latency-ms 300
+"""
+
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import daraja_simulator  # noqa: E402
+
+MODES = {
+    # gunicorn switches sync to gthread when threads > 1
+    "sync": {"GUNICORN_WORKER_CLASS": "sync", "GUNICORN_THREADS": "1"},
+    "gthread": {"GUNICORN_WORKER_CLASS": "gthread"},
+    "gevent": {"GUNICORN_WORKER_CLASS": "gevent"},
+}
+
+
+def seed(count):
+    """
+    Creates the schema, one user and `count` orders
+
+    Returns:
+        tuple: ((session cookie name, value), order ids)
+    """
+    from app import create_app
+    from models import db
+    from models.order import Order
+    from models.user import User
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+        user = User(fullname="Bench User", contacts="0712345678",
+                    email="bench@example.com", password_hash="-")
+        db.session.add(user)
+        db.session.flush()
+        orders = [Order(user_id=user.id, total_amount=100, customer_phone="0712345678")
+                  for _ in range(count)]
+        db.session.add_all(orders)
+        db.session.commit()
+        order_ids = [order.id for order in orders]
+        cookie = (
+            app.config["SESSION_COOKIE_NAME"],
+            app.session_interface.get_signing_serializer(app).dumps({"user_id": user.id}),
+        )
+    return cookie, order_ids
+
+
+def start_server(mode, port, threads):
+    env = dict(os.environ, WEB_CONCURRENCY="1", GUNICORN_THREADS=str(threads),
+               GUNICORN_BIND=f"127.0.0.1:{port}")
+    env.update(MODES[mode])
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/metrics", timeout=1)
+            return server
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit(f"{mode}: gunicorn did not start")
+
+
+def run_mode(mode, port, args, cookie, order_ids):
+    server = start_server(mode, port, args.threads)
+    local = threading.local()
+    latencies, errors = [], []
+
+    def pay(order_id):
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = requests.Session()
+            http.cookies.set(*cookie)
+        start = time.perf_counter()
+        try:
+            response = http.post(f"http://127.0.0.1:{port}/api/make-payment", json={
+                "phone": "0712345678", "amount": 100, "order_id": order_id,
+            }, timeout=120)
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        (latencies if ok else errors).append(time.perf_counter() - start)
+
+    try:
+        # One request first so the worker's token is cached before timing
+        pay(order_ids[0])
+        latencies.clear()
+        errors.clear()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(pay, order_ids[1:]))
+        wall = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    return {
+        "ok": len(latencies),
+        "errors": len(errors),
+        "throughput": len(latencies) / wall,
+        "p50": statistics.median(latencies) if latencies else None,
+        "p95": latencies[int(len(latencies) * 0.95)] if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=8, help="GUNICORN_THREADS for gthread")
+    parser.add_argument("--modes", default="sync,gthread,gevent")
+    parser.add_argument("--app-port", type=int, default=18081)
+    parser.add_argument("--simulator-port", type=int, default=18998)
+    daraja_simulator.add_arguments(parser)
+    # Keep callbacks out of the measurement
+    parser.set_defaults(latency_ms="300", callback_delay="3600")
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    if "gevent" in modes and importlib.util.find_spec("gevent") is None:
+        print("gevent is not installed; skipping the gevent mode")
+        modes.remove("gevent")
+
+    daraja_simulator.start(daraja_simulator.simulator_from_args(args), port=args.simulator_port)
+    workdir = tempfile.mkdtemp(prefix="bench-payments-")
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "MPESA_BASE_URL": f"http://127.0.0.1:{args.simulator_port}",
+        "MPESA_CALLBACK_URL": f"http://127.0.0.1:{args.app_port}/api/mpesa-callback",
+        "MPESA_CONSUMER_KEY": "bench-key",
+        "MPESA_CONSUMER_SECRET": "bench-secret",
+        "MPESA_PASSKEY": "bench-passkey",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+    # A fresh order per payment: a second push for an order is coalesced
+    cookie, order_ids = seed((args.requests + 1) * len(modes))
+
+    print(f"{args.requests} payments, concurrency {args.concurrency}, Daraja latency {args.latency_ms} ms")
+    print(f"{'mode':<10}{'ok':>6}{'errors':>8}{'payments/s':>12}{'p50 ms':>10}{'p95 ms':>10}")
+    for i, mode in enumerate(modes):
+        orders = order_ids[i * (args.requests + 1):(i + 1) * (args.requests + 1)]
+        r = run_mode(mode, args.app_port, args, cookie, orders)
+        p50 = "-" if r["p50"] is None else f"{r['p50'] * 1000:.0f}"
+        p95 = "-" if r["p95"] is None else f"{r['p95'] * 1000:.0f}"
+        print(f"{mode:<10}{r['ok']:>6}{r['errors']:>8}{r['throughput']:>12.1f}{p50:>10}{p95:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+bench/sales_analytics.py - Analytics latency from the rollups vs scanning orders
+
+Seeds a temporary SQLite database with --orders orders (2-4 items each,
+spread over --days days), rebuilds the sales rollups and then times, per
+group_by, GET /api/admin/analytics/sales over the whole range against the
+equivalent aggregate over orders and order_items.
+
+Usage:
+    python bench/sales_analytics.py --orders 200000 --days 365
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STATUSES = ["confirmed"] * 6 + ["completed"] * 2 + ["cancelled", "pending"]
+
+
+def seed(db, args):
+    """Inserts the menu and orders with Core statements, in batches"""
+    from models.category import Category
+    from models.menu import MenuItem
+    from models.order import Order, OrderItem
+
+    db.session.execute(db.insert(Category), [{"name": f"Category {i}"} for i in range(8)])
+    db.session.execute(db.insert(MenuItem), [
+        {"name": f"Item {i}", "price": 50 + i * 10, "category_id": 1 + i % 8} for i in range(40)
+    ])
+    rng = random.Random(1)
+    start = datetime.utcnow().replace(microsecond=0) - timedelta(days=args.days)
+    span = args.days * 86400
+    order_id = 0
+    for batch_start in range(0, args.orders, 5000):
+        orders, items = [], []
+        for _ in range(min(5000, args.orders - batch_start)):
+            order_id += 1
+            total = 0
+            for menu_item in rng.sample(range(1, 41), rng.randint(2, 4)):
+                quantity = rng.randint(1, 3)
+                price = 50 + (menu_item - 1) * 10
+                total += quantity * price
+                items.append({"order_id": order_id, "menu_item_id": menu_item, "quantity": quantity,
+                              "unit_price": price, "subtotal": quantity * price})
+            orders.append({"id": order_id, "total_amount": total, "status": rng.choice(STATUSES),
+                           "customer_phone": "254700000000",
+                           "created_at": start + timedelta(seconds=rng.randrange(span))})
+        db.session.execute(db.insert(Order), orders)
+        db.session.execute(db.insert(OrderItem), items)
+        db.session.commit()
+
+
+def scan(db, group_by, lower, upper):
+    """The report computed from orders and order_items"""
+    from models.menu import MenuItem
+    from models.order import Order, OrderItem
+
+    filters = (Order.created_at >= lower, Order.created_at < upper, Order.status.in_(["confirmed", "completed"]))
+    if group_by in ("day", "hour"):
+        bucket = db.func.strftime("%Y-%m-%d" if group_by == "day" else "%Y-%m-%d %H", Order.created_at)
+        query = db.session.query(bucket, db.func.count(Order.id), db.func.sum(Order.total_amount))
+    else:
+        group = MenuItem.category_id if group_by == "category" else OrderItem.menu_item_id
+        query = db.session.query(
+            group, db.func.count(db.distinct(Order.id)), db.func.sum(OrderItem.quantity), db.func.sum(OrderItem.subtotal)
+        ).join(OrderItem, OrderItem.order_id == Order.id).join(MenuItem, MenuItem.id == OrderItem.menu_item_id)
+        bucket = group
+    return query.filter(*filters).group_by(bucket).all()
+
+
+def timed(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=5, help="Timings per query; the best is reported")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-sales-")
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "ADMIN_TOKEN": "bench",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+    from app import create_app
+    from models import db
+    from services.sales_rollup import rebuild
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        seed(db, args)
+        print(f"seeded {args.orders} orders in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        rebuild(days_per_batch=30)
+        print(f"rebuilt the rollups in {time.perf_counter() - started:.1f}s")
+
+        upper = datetime.utcnow() + timedelta(days=1)
+        lower = upper - timedelta(days=min(args.days + 1, 366))
+        client = app.test_client()
+        headers = {"Authorization": "Bearer bench"}
+        query = f"from={lower.date()}&to={(upper - timedelta(days=1)).date()}"
+
+        print(f"{'group_by':<10}{'rollup ms':>12}{'scan ms':>12}")
+        for group_by in ("day", "hour", "item", "category"):
+            def rollup():
+                response = client.get(f"/api/admin/analytics/sales?{query}&group_by={group_by}", headers=headers)
+                if response.status_code != 200:
+                    raise SystemExit(f"analytics returned {response.status_code}: {response.get_data(as_text=True)}")
+            rollup_s = timed(rollup, args.repeat)
+            scan_s = timed(lambda: scan(db, group_by, lower, upper), args.repeat)
+            db.session.rollback()
+            print(f"{group_by:<10}{rollup_s * 1000:>12.1f}{scan_s * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
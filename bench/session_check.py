@@ -0,0 +1,120 @@
+"""
+bench/session_check.py - Requests/sec on GET /api/check-session
+
+Serves the app in-process (threaded werkzeug, temporary SQLite database with
+--users users) and hits /api/check-session from --concurrency client threads
+with a logged-in session cookie per user, once with the user cache disabled
+(USER_CACHE_SIZE=0, one users query per request) and once enabled.
+Each mode runs in its own process so the two apps share nothing.
+
+Usage:
+    python bench/session_check.py --requests 5000 --concurrency 8
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {"no cache": "0", "user cache": "1024"}
+
+
+def serve(args):
+    """Seeds the database, serves the app and returns (base_url, cookies)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import create_app
+    from models import db
+    from models.user import User
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        users = [
+            User(fullname=f"User {i}", contacts=f"07{i:08d}", email=f"user{i}@example.com", password_hash="-")
+            for i in range(args.users)
+        ]
+        db.session.add_all(users)
+        db.session.commit()
+        serializer = app.session_interface.get_signing_serializer(app)
+        cookies = [(app.config["SESSION_COOKIE_NAME"], serializer.dumps({"user_id": u.id})) for u in users]
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", args.port, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{args.port}", cookies
+
+
+def run(args):
+    """Runs one mode in this process and prints 'rps p50 p95'"""
+    base_url, cookies = serve(args)
+    local = threading.local()
+    latencies = []
+
+    def check(i):
+        http = getattr(local, "http", None)
+        if http is None:
+            http = local.http = requests.Session()
+        name, value = cookies[i % len(cookies)]
+        start = time.perf_counter()
+        response = http.get(f"{base_url}/api/check-session", cookies={name: value})
+        latencies.append(time.perf_counter() - start)
+        if not response.json().get("valid"):
+            raise SystemExit("session check failed")
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(check, range(min(args.requests, len(cookies)))))
+        latencies.clear()
+        start = time.perf_counter()
+        list(pool.map(check, range(args.requests)))
+        wall = time.perf_counter() - start
+    latencies.sort()
+    print(args.requests / wall, statistics.median(latencies), latencies[int(len(latencies) * 0.95)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--port", type=int, default=18082)
+    parser.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run(args)
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, {args.users} users")
+    print(f"{'mode':<12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode, cache_size in MODES.items():
+        workdir = tempfile.mkdtemp(prefix="bench-session-")
+        env = dict(
+            os.environ,
+            USER_CACHE_SIZE=cache_size,
+            DATABASE_URL="sqlite:///" + os.path.join(workdir, "bench.db"),
+            SECRET_KEY="bench",
+            CATALOG_VERSION_PATH=os.path.join(workdir, "catalog.version"),
+            METRICS_DIR=os.path.join(workdir, "metrics"),
+        )
+        out = subprocess.run(
+            [sys.executable, __file__, "--run", "--requests", str(args.requests),
+             "--concurrency", str(args.concurrency), "--users", str(args.users), "--port", str(args.port)],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout.split()
+        rps, p50, p95 = (float(v) for v in out[-3:])
+        print(f"{mode:<12}{rps:>10.0f}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
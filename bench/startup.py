@@ -0,0 +1,132 @@
+"""
+bench/startup.py - Cold start and fork-to-first-request times
+
+Measures, each over --runs repetitions (medians reported):
+
+- cold start: a fresh interpreter importing app and calling create_app()
+- fork-to-first-request, preloaded: the parent builds the app and warms its
+  caches (as gunicorn's master does with preload_app), then each forked
+  child runs init_worker() and serves GET /api/menu
+- fork-to-first-request, not preloaded: each forked child imports and builds
+  the app itself before serving the same request
+
+Usage:
+    python bench/startup.py --runs 10
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+COLD_START = """
+import sys, time
+start = time.perf_counter()
+from app import create_app
+create_app()
+print(time.perf_counter() - start, "requests" in sys.modules)
+"""
+
+
+def seed():
+    """Creates the schema and a small menu in a child process"""
+    pid = os.fork()
+    if pid == 0:
+        from app import create_app
+        from models import db
+        from models.menu import MenuItem
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            db.session.add_all(MenuItem(name=f"Item {i}", price=100 + i) for i in range(40))
+            db.session.commit()
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def first_request(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = 1
+    return client.get("/api/menu").status_code
+
+
+def fork_to_first_request(preloaded_app=None):
+    """Forks a worker and returns the seconds until its first response"""
+    read_fd, write_fd = os.pipe()
+    forked_at = time.perf_counter()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        if preloaded_app is None:
+            from app import create_app, init_worker
+            app = create_app()
+        else:
+            from app import init_worker
+            app = preloaded_app
+        init_worker(app)
+        status = first_request(app)
+        os.write(write_fd, f"{time.perf_counter() - forked_at} {status}".encode())
+        os._exit(0)
+    os.close(write_fd)
+    elapsed, status = os.read(read_fd, 64).decode().split()
+    os.close(read_fd)
+    os.waitpid(pid, 0)
+    if status != "200":
+        raise SystemExit(f"first request returned HTTP {status}")
+    return float(elapsed)
+
+
+def median_ms(values):
+    return f"{statistics.median(values) * 1000:.1f} ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench-startup-")
+    os.environ.update({
+        "DATABASE_URL": "sqlite:///" + os.path.join(workdir, "bench.db"),
+        "SECRET_KEY": "bench",
+        "CATALOG_VERSION_PATH": os.path.join(workdir, "catalog.version"),
+        "METRICS_DIR": os.path.join(workdir, "metrics"),
+    })
+    seed()
+
+    cold, requests_loaded = [], False
+    for _ in range(args.runs):
+        out = subprocess.run(
+            [sys.executable, "-c", COLD_START], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.split()
+        cold.append(float(out[0]))
+        requests_loaded = requests_loaded or out[1] == "True"
+
+    # Not preloaded first, while this process has not imported the app yet
+    cold_forks = [fork_to_first_request() for _ in range(args.runs)]
+
+    from app import create_app, warm_caches
+    from models import db
+
+    app = create_app()
+    warm_caches(app)
+    with app.app_context():
+        db.engine.dispose()
+    warm_forks = [fork_to_first_request(app) for _ in range(args.runs)]
+
+    print(f"cold start (import + create_app):        {median_ms(cold)}"
+          f"  (requests imported: {'yes' if requests_loaded else 'no'})")
+    print(f"fork to first request, not preloaded:    {median_ms(cold_forks)}")
+    print(f"fork to first request, preloaded+warm:   {median_ms(warm_forks)}")
+
+
+if __name__ == "__main__":
+    main()
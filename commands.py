@@ -0,0 +1,225 @@
+"""
+commands.py - Maintenance commands for the Food Ordering System
+
+Registered on the Flask CLI by create_app(), e.g.:
+
+    flask --app app replay-callbacks --status failed
+    flask --app app reconcile-payments --dry-run
+    flask --app app import-users users.csv
+    flask --app app rebuild-sales-rollups
+    flask --app app export orders --from 2025-01-01 --to 2025-01-31 -o orders.csv
+    flask --app app db-upgrade
+"""
+
+import csv
+import os
+import sys
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from models import db
+from routes.payments import get_reconciler
+from services.accounts import import_users
+from services.passwords import PasswordHasher
+from services.callback_inbox import drain, replay
+from services.exports import DATASETS, FORMATS, ExportError, export, gzip_chunks
+from services.query_plans import GUARDED_TABLES, check_query_plans
+from services.query_stats import check_query_budgets
+from services.sales_rollup import rebuild as rebuild_sales
+
+# ==================================================================
+# M-PESA CALLBACK INBOX
+# ==================================================================
+
+@click.command("replay-callbacks")
+@with_appcontext
+@click.option("--id", "ids", type=int, multiple=True, help="Inbox row id (repeatable)")
+@click.option("--checkout-request-id", help="Replay every row for this CheckoutRequestID")
+@click.option(
+    "--status", "statuses", multiple=True, default=("failed", "unmatched"), show_default=True,
+    help="Row statuses to requeue when no --id is given (repeatable)",
+)
+@click.option("--batch-size", type=int, default=50, show_default=True)
+def replay_callbacks(ids, checkout_request_id, statuses, batch_size):
+    """Requeues stored M-Pesa callbacks and applies them"""
+    requeued = replay(ids=list(ids), checkout_request_id=checkout_request_id, statuses=statuses)
+    processed = drain(batch_size)
+    click.echo(f"Requeued {requeued} callback(s), processed {processed}")
+
+@click.command("reconcile-payments")
+@with_appcontext
+@click.option("--min-age", type=float, help="Only payments pending longer than this many seconds")
+@click.option("--workers", type=int, help="Concurrent STK queries")
+@click.option("--rate", type=float, help="Maximum STK queries per second (0 for no limit)")
+@click.option("--batch-size", type=int, help="Payments applied per transaction")
+@click.option("--limit", type=int, help="Stop after this many payments")
+@click.option("--dry-run", is_flag=True, help="Query Safaricom but do not change any payment")
+@click.option("--every", type=float, default=0, help="Keep running, every this many seconds")
+def reconcile_payments(min_age, workers, rate, batch_size, limit, dry_run, every):
+    """Resolves stale pending payments with STK status queries"""
+    reconciler = get_reconciler(workers=workers, rate=rate, batch_size=batch_size, min_age=min_age)
+    while True:
+        stats = reconciler.run(limit=limit, dry_run=dry_run)
+        db.session.remove()
+        click.echo(
+            f"{'[dry run] ' if dry_run else ''}scanned {stats['scanned']}, queried {stats['queried']}"
+            f" in {stats['seconds']}s ({stats['queries_per_second']}/s): {stats['completed']} completed,"
+            f" {stats['failed']} failed, {stats['still_pending']} still pending,"
+            f" {stats['already_resolved']} already resolved, {stats['errors']} errors"
+        )
+        if stats["stopped_early"]:
+            click.echo(f"Stopped early: {stats['stopped_early']}")
+        if not every:
+            break
+        time.sleep(every)
+
+# ==================================================================
+# USERS
+# ==================================================================
+
+@click.command("import-users")
+@with_appcontext
+@click.argument("csv_file", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--batch-size", type=int, default=500, show_default=True, help="Users inserted per transaction")
+@click.option("--workers", type=int, default=os.cpu_count() or 1, show_default=True,
+              help="Password hashing processes (0 hashes inline)")
+@click.option("--dry-run", is_flag=True, help="Validate and check for taken emails and phones only")
+def import_users_command(csv_file, batch_size, workers, dry_run):
+    """
+    Registers users from a CSV file with fullname, email, contact and password columns
+
+    Rows go through the same validation and phone normalization as
+    /api/register. Rows that are invalid or already registered are listed
+    on stderr and skipped; use - to read from stdin.
+    """
+    hasher = PasswordHasher(method=current_app.config["PASSWORD_HASH_METHOD"], workers=workers)
+    try:
+        stats = import_users(
+            csv.DictReader(csv_file), hasher, batch_size=batch_size, dry_run=dry_run,
+            on_reject=lambda number, message: click.echo(f"row {number}: {message}", err=True),
+        )
+    finally:
+        hasher.shutdown()
+    click.echo(
+        f"{'[dry run] ' if dry_run else ''}imported {stats['imported']},"
+        f" {stats['duplicates']} already registered, {stats['invalid']} invalid"
+    )
+
+# ==================================================================
+# SALES ROLLUPS
+# ==================================================================
+
+@click.command("rebuild-sales-rollups")
+@with_appcontext
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), help="First day (default: oldest order)")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), help="Last day (default: newest order)")
+@click.option("--days-per-batch", type=int, default=7, show_default=True, help="Days rebuilt per transaction")
+def rebuild_sales_rollups(start, end, days_per_batch):
+    """Recomputes the sales rollup tables from the orders, in day batches"""
+    started = time.perf_counter()
+    counted = rebuild_sales(
+        start.date() if start else None, end.date() if end else None, days_per_batch,
+        on_batch=lambda first, last, orders: click.echo(f"{first} .. {last}: {orders} order(s)"),
+    )
+    click.echo(f"Rebuilt the sales rollups from {counted} order(s) in {time.perf_counter() - started:.1f}s")
+
+# ==================================================================
+# EXPORTS
+# ==================================================================
+
+@click.command("export")
+@with_appcontext
+@click.argument("dataset", type=click.Choice(list(DATASETS)))
+@click.option("--from", "start", type=click.DateTime(["%Y-%m-%d"]), help="First creation day (default: unbounded)")
+@click.option("--to", "end", type=click.DateTime(["%Y-%m-%d"]), help="Last creation day (default: unbounded)")
+@click.option("--status", "statuses", multiple=True, help="Status to include (repeatable; default: all)")
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="csv", show_default=True)
+@click.option("--gzip", "compress", is_flag=True, help="Write gzip-compressed output")
+@click.option("--batch-size", type=int, default=None, help="Rows per fetch (default: EXPORT_BATCH_SIZE)")
+@click.option("-o", "--output", type=click.Path(dir_okay=False, writable=True), default="-",
+              help="Output file (default: stdout)")
+def export_command(dataset, start, end, statuses, fmt, compress, batch_size, output):
+    """Streams orders, order_items, payments or order_status_history as CSV or NDJSON"""
+    counted = [0]
+
+    def count(rows):
+        counted[0] += rows
+
+    started = time.perf_counter()
+    try:
+        chunks = export(
+            dataset, fmt, start.date() if start else None, end.date() if end else None, list(statuses),
+            batch_size or current_app.config["EXPORT_BATCH_SIZE"], on_batch=count,
+        )
+    except ExportError as e:
+        raise click.UsageError(str(e))
+    chunks = gzip_chunks(chunks) if compress else (chunk.encode() for chunk in chunks)
+
+    out = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    click.echo(f"Exported {counted[0]} {dataset} row(s) in {time.perf_counter() - started:.1f}s", err=True)
+
+# ==================================================================
+# SCHEMA MIGRATIONS
+# ==================================================================
+
+@click.command("db-upgrade")
+@with_appcontext
+def db_upgrade():
+    """Creates missing tables and applies pending schema migrations"""
+    import migrations
+
+    db.create_all()
+    applied = migrations.upgrade(db.engine)
+    click.echo(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}")
+
+@click.command("db-status")
+@with_appcontext
+def db_status():
+    """Lists schema migrations and whether they have been applied"""
+    import migrations
+
+    for version, applied in migrations.status(db.engine):
+        click.echo(f"[{'x' if applied else ' '}] {version}")
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    """Fails if a statement issued by the routes does a full scan of a large table"""
+    failures = 0
+    for description, statement, plan, scans in check_query_plans():
+        click.echo(f"{'FAIL' if scans else 'ok  '} {description}: {'; '.join(plan) or 'no table read'}")
+        if scans:
+            click.echo(f"     {' '.join(statement.split())}")
+        failures += bool(scans)
+    if failures:
+        raise SystemExit(f"{failures} query plan(s) scan one of {', '.join(GUARDED_TABLES)}")
+
+@click.command("check-query-budgets")
+@with_appcontext
+@click.option("--user-id", type=int, required=True, help="User whose session is replayed")
+def check_query_budgets_command(user_id):
+    """Fails if an endpoint runs more SQL statements than its budget"""
+    failures = 0
+    for path, status, queries, budget in check_query_budgets(current_app._get_current_object(), user_id):
+        over = status >= 400 or queries > budget
+        click.echo(f"{'FAIL' if over else 'ok  '} {path}: {queries}/{budget} queries (HTTP {status})")
+        failures += over
+    if failures:
+        raise SystemExit(f"{failures} endpoint(s) failed or exceeded their query budget")
+
+COMMANDS = (
+    replay_callbacks, reconcile_payments, import_users_command, rebuild_sales_rollups, export_command, db_upgrade,
+    db_status, check_query_plans_command, check_query_budgets_command,
+)
+
+def register_commands(app):
+    for command in COMMANDS:
+        app.cli.add_command(command)
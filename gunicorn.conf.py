@@ -0,0 +1,52 @@
+"""
+gunicorn.conf.py - Gunicorn settings for the Food Ordering System
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app (GUNICORN_PRELOAD, on by default) the master imports and
+builds the app once and warms the catalog cache before forking, so workers
+start with Flask/SQLAlchemy loaded and the menu already serialized.
+post_fork then gives each worker its own database connections.
+
+GUNICORN_WORKER_CLASS=gevent switches to the async worker: each worker runs
+requests on greenlets, so an STK push or a payment long-poll waiting on
+Safaricom no longer holds one of a few threads. The standard library is
+patched here, before the preloaded app is imported, so the locks and
+threads created at import time are cooperative too.
+"""
+
+import os
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Payment events hold a request open for MPESA_EVENTS_MAX_WAIT seconds, so
+# each worker serves several requests concurrently on threads
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+if worker_class == "gevent":
+    worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+    from gevent import monkey
+
+    monkey.patch_all()
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 60))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() in ("1", "true", "yes")
+
+
+def when_ready(server):
+    """Warms caches in the master so forked workers inherit them"""
+    if not server.cfg.preload_app:
+        return
+    from app import warm_caches
+    from models import db
+
+    app = server.app.wsgi()
+    warm_caches(app)
+    with app.app_context():
+        # Workers must not share the master's connections
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    from app import init_worker
+
+    init_worker(server.app.wsgi())
@@ -0,0 +1,11 @@
+"""
+Creates the tables added after the initial schema on existing databases:
+payment_events and mpesa_callback_inbox.
+"""
+
+from models import db
+
+
+def upgrade(connection):
+    for name in ("payment_events", "mpesa_callback_inbox"):
+        db.metadata.tables[name].create(connection, checkfirst=True)
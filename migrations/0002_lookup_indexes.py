@@ -0,0 +1,35 @@
+"""
+Adds the foreign-key and lookup indexes used by the hot routes.
+
+- order_items.order_id, order_status_history.order_id, payments.order_id:
+  loading and deleting an order's children
+- orders (user_id, created_at DESC, id DESC): order history pages; also
+  serves plain lookups by orders.user_id
+- push_requests.checkout_request_id (unique): callback and status lookups
+- payments.mpesa_receipt_number: receipt lookups
+- cart_items (user_id, menu_item_id) (unique): cart upserts; also serves
+  lookups by cart_items.user_id
+"""
+
+from sqlalchemy import text
+
+STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS ix_order_items_order_id ON order_items (order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_order_status_history_order_id ON order_status_history (order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_order_id ON payments (order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_payments_mpesa_receipt_number ON payments (mpesa_receipt_number)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_id_created_at_id"
+    " ON orders (user_id, created_at DESC, id DESC)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ix_push_requests_checkout_request_id"
+    " ON push_requests (checkout_request_id)",
+    # The cart was never used before this constraint; drop any duplicates
+    "DELETE FROM cart_items WHERE id NOT IN ("
+    " SELECT MIN(id) FROM cart_items GROUP BY user_id, menu_item_id)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_items_user_menu_item"
+    " ON cart_items (user_id, menu_item_id)",
+]
+
+
+def upgrade(connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,19 @@
+"""
+Adds the indexes behind the reconciler's scan of stale pending payments
+(services/reconciliation.py):
+
+- payments (status, id): pending payments in creation order
+- push_requests.payments_id: joining each payment to its STK push
+"""
+
+from sqlalchemy import text
+
+STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS ix_payments_status_id ON payments (status, id)",
+    "CREATE INDEX IF NOT EXISTS ix_push_requests_payments_id ON push_requests (payments_id)",
+]
+
+
+def upgrade(connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
@@ -0,0 +1,10 @@
+"""
+Creates the idempotency_keys table (services/idempotency.py) on existing
+databases.
+"""
+
+from models import db
+
+
+def upgrade(connection):
+    db.metadata.tables["idempotency_keys"].create(connection, checkfirst=True)
@@ -0,0 +1,20 @@
+"""
+Widens users.password_hash from 128 to 255 characters
+
+werkzeug's scrypt hashes are 162 characters long, and PASSWORD_HASH_METHOD
+may name longer parameter strings. SQLite does not enforce VARCHAR lengths,
+so there is nothing to do there.
+"""
+
+from sqlalchemy import text
+
+STATEMENTS = {
+    "postgresql": "ALTER TABLE users ALTER COLUMN password_hash TYPE VARCHAR(255)",
+    "mysql": "ALTER TABLE users MODIFY password_hash VARCHAR(255) NOT NULL",
+}
+
+
+def upgrade(connection):
+    statement = STATEMENTS.get(connection.dialect.name)
+    if statement:
+        connection.execute(text(statement))
@@ -0,0 +1,30 @@
+"""
+Rewrites users.contacts to the canonical 254XXXXXXXXX form
+
+Registration and login now normalize phone numbers with
+format_phone_number, so rows stored as typed ("0712345678",
+"+254 712 345 678") must be rewritten for their owners to be found.
+
+A row is left as it is when its canonical number already belongs to
+another account (the same person registered twice in different formats);
+login still matches such rows by the number exactly as stored.
+"""
+
+from sqlalchemy import text
+
+from services.phone_numbers import format_phone_number
+
+
+def upgrade(connection):
+    rows = connection.execute(text("SELECT id, contacts FROM users")).fetchall()
+    taken = {contacts for _, contacts in rows}
+    for user_id, contacts in rows:
+        canonical = format_phone_number(contacts)
+        if canonical == contacts or canonical in taken:
+            continue
+        connection.execute(
+            text("UPDATE users SET contacts = :contacts WHERE id = :id"),
+            {"contacts": canonical, "id": user_id},
+        )
+        taken.discard(contacts)
+        taken.add(canonical)
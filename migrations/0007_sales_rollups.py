@@ -0,0 +1,18 @@
+"""
+Creates the sales rollup tables (services/sales_rollup.py) and the
+orders (created_at) index their backfill scans by.
+
+Fill the tables for existing orders with:
+
+    flask --app app rebuild-sales-rollups
+"""
+
+from sqlalchemy import text
+
+from models import db
+
+
+def upgrade(connection):
+    db.metadata.tables["sales_daily_items"].create(connection, checkfirst=True)
+    db.metadata.tables["sales_hourly"].create(connection, checkfirst=True)
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)"))
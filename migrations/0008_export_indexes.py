@@ -0,0 +1,21 @@
+"""
+Adds the indexes behind date-range exports (services/exports.py), which
+read rows in (created_at, id) order:
+
+- payments (created_at, id)
+- order_status_history (created_at, id)
+
+orders already has ix_orders_created_at (0007).
+"""
+
+from sqlalchemy import text
+
+STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS ix_payments_created_at_id ON payments (created_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_order_status_history_created_at_id ON order_status_history (created_at, id)",
+]
+
+
+def upgrade(connection):
+    for statement in STATEMENTS:
+        connection.execute(text(statement))
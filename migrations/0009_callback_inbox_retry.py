@@ -0,0 +1,15 @@
+"""
+Adds mpesa_callback_inbox.next_attempt_at
+
+Callbacks that arrive before their push request is committed are retried
+with a backoff instead of being marked unmatched at once; a pending row is
+not claimed before its next_attempt_at.
+"""
+
+from sqlalchemy import inspect, text
+
+
+def upgrade(connection):
+    columns = {column["name"] for column in inspect(connection).get_columns("mpesa_callback_inbox")}
+    if "next_attempt_at" not in columns:
+        connection.execute(text("ALTER TABLE mpesa_callback_inbox ADD COLUMN next_attempt_at TIMESTAMP"))
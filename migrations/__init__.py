@@ -0,0 +1,78 @@
+"""
+migrations - Versioned schema migrations
+
+db.create_all() only creates missing tables; it never adds indexes or
+constraints to tables that already exist. Each module in this package named
+NNNN_description.py defines upgrade(connection) and is applied once, in
+order, with its version recorded in the schema_migrations table.
+
+Migrations are written to be safe on databases created by db.create_all()
+(CREATE ... IF NOT EXISTS), so a fresh install simply records them.
+
+    flask --app app db-upgrade
+    flask --app app db-status
+"""
+
+import importlib
+import pkgutil
+
+from sqlalchemy import text
+
+VERSION_TABLE = "schema_migrations"
+
+
+def available_migrations():
+    """
+    Returns:
+        list: (version, module) pairs sorted by version
+    """
+    migrations = []
+    for info in pkgutil.iter_modules(__path__):
+        version = info.name.split("_", 1)[0]
+        if version.isdigit():
+            module = importlib.import_module(f"{__name__}.{info.name}")
+            migrations.append((info.name, module))
+    return sorted(migrations)
+
+
+def applied_versions(connection):
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {VERSION_TABLE} ("
+        " version VARCHAR(255) PRIMARY KEY,"
+        " applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+    ))
+    return {row[0] for row in connection.execute(text(f"SELECT version FROM {VERSION_TABLE}"))}
+
+
+def upgrade(engine):
+    """
+    Applies every pending migration, each in its own transaction
+
+    Returns:
+        list: Versions that were applied
+    """
+    applied = []
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+
+    for version, module in available_migrations():
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            module.upgrade(connection)
+            connection.execute(
+                text(f"INSERT INTO {VERSION_TABLE} (version) VALUES (:version)"),
+                {"version": version},
+            )
+        applied.append(version)
+    return applied
+
+
+def status(engine):
+    """
+    Returns:
+        list: (version, applied) pairs
+    """
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    return [(version, version in done) for version, _ in available_migrations()]
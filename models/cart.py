@@ -4,6 +4,9 @@ from sqlalchemy.sql import func
 
 class CartItem(db.Model):
     __tablename__ = "cart_items"
+    __table_args__ = (
+        db.Index("uq_cart_items_user_menu_item", "user_id", "menu_item_id", unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"))
@@ -42,7 +42,7 @@ class OrderItem(db.Model):
     __tablename__ = "order_items"
     
     id = db.Column(db.Integer, primary_key=True, index=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
     menu_item_id = db.Column(db.Integer, db.ForeignKey("menu_items.id"), nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=1)
     unit_price = db.Column(db.DECIMAL(10, 2), nullable=False)
@@ -66,7 +66,7 @@ class OrderStatusHistory(db.Model):
     __tablename__ = "order_status_history"
     
     id = db.Column(db.Integer, primary_key=True, index=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
     old_status = db.Column(db.String(20))
     new_status = db.Column(db.String(20), nullable=False)
     created_at = db.Column(db.DateTime, default=func.now())
@@ -81,4 +81,19 @@ class OrderStatusHistory(db.Model):
             'old_status': self.old_status,
             'new_status': self.new_status,
             'created_at': self.created_at
-        }
\ No newline at end of file
+        }
+
+# Covers the order history query: one user's orders, newest first, with id
+# as tie-breaker for keyset pagination
+db.Index(
+    "ix_orders_user_id_created_at_id",
+    Order.user_id,
+    Order.created_at.desc(),
+    Order.id.desc(),
+)
+
+# Range scans of orders by creation time (sales rollup backfill, exports)
+db.Index("ix_orders_created_at", Order.created_at)
+
+# Date-range exports of the status history in (created_at, id) order
+db.Index("ix_order_status_history_created_at_id", OrderStatusHistory.created_at, OrderStatusHistory.id)
@@ -4,15 +4,20 @@ from sqlalchemy.sql import func
 
 class Payment(db.Model):
     __tablename__ = "payments"
+    __table_args__ = (
+        db.Index("ix_payments_status_id", "status", "id"),
+        # Date-range exports in (created_at, id) order
+        db.Index("ix_payments_created_at_id", "created_at", "id"),
+    )
     
     id = db.Column(db.Integer, primary_key=True, index=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("orders.id"), nullable=False, index=True)
     amount = db.Column(db.DECIMAL(10, 2), nullable=False)
     payment_method = db.Column(db.String(20), nullable=False)
     transaction_id = db.Column(db.String(100))
     phone_number = db.Column(db.String(20))
     status = db.Column(db.String(20), default="pending")
-    mpesa_receipt_number = db.Column(db.String(100))
+    mpesa_receipt_number = db.Column(db.String(100), index=True)
     error_message = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
@@ -44,8 +49,9 @@ class PushRequest(db.Model):
         db.Integer,
         db.ForeignKey("payments.id", ondelete="CASCADE"),
         nullable=False,
+        index=True,
     )
-    checkout_request_id = db.Column(db.String(255), nullable=False)
+    checkout_request_id = db.Column(db.String(255), nullable=False, unique=True, index=True)
     date_created = db.Column(db.DateTime, default=func.now())
     last_updated = db.Column(
         db.DateTime, default=func.now(), onupdate=func.now()
@@ -65,4 +71,70 @@ class PushRequest(db.Model):
             "last_updated": self.last_updated.isoformat()
             if self.last_updated
             else None,
-        }
\ No newline at end of file
+        }
+
+class PaymentEvent(db.Model):
+    __tablename__ = "payment_events"
+
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_request_id = db.Column(db.String(255), nullable=False, unique=True, index=True)
+    result_code = db.Column(db.Integer, nullable=False)
+    result_desc = db.Column(db.Text)
+    mpesa_receipt_number = db.Column(db.String(100))
+    source = db.Column(db.String(20), default="callback")
+    created_at = db.Column(db.DateTime, default=func.now())
+
+    @property
+    def status(self):
+        return "completed" if self.result_code == 0 else "failed"
+
+    def to_dict(self):
+        return {
+            "checkout_request_id": self.checkout_request_id,
+            "status": self.status,
+            "result_code": self.result_code,
+            "result_desc": self.result_desc,
+            "mpesa_receipt_number": self.mpesa_receipt_number,
+            "source": self.source,
+            "created_at": self.created_at.isoformat()
+            if self.created_at
+            else None,
+        }
+
+
+class CallbackInbox(db.Model):
+    __tablename__ = "mpesa_callback_inbox"
+    __table_args__ = (
+        db.UniqueConstraint("checkout_request_id", "result_code", name="uq_callback_inbox_checkout_result"),
+        db.Index("ix_callback_inbox_status_id", "status", "id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    checkout_request_id = db.Column(db.String(255), nullable=False)
+    result_code = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claim_token = db.Column(db.String(36))
+    locked_at = db.Column(db.DateTime)
+    # Pending rows are not claimed before this time (unmatched-callback retries)
+    next_attempt_at = db.Column(db.DateTime)
+    error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=func.now())
+    processed_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "checkout_request_id": self.checkout_request_id,
+            "result_code": self.result_code,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "received_at": self.received_at.isoformat()
+            if self.received_at
+            else None,
+            "processed_at": self.processed_at.isoformat()
+            if self.processed_at
+            else None,
+        }
@@ -0,0 +1,22 @@
+# models/sales.py
+from models import db
+
+class SalesDailyItem(db.Model):
+    """Sales of one menu item on one day, by order status (services/sales_rollup.py)"""
+    __tablename__ = "sales_daily_items"
+
+    day = db.Column(db.Date, primary_key=True)
+    menu_item_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(12, 2), nullable=False, default=0)
+
+class SalesHourly(db.Model):
+    """Orders and their totals per hour, by order status (services/sales_rollup.py)"""
+    __tablename__ = "sales_hourly"
+
+    hour = db.Column(db.DateTime, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.DECIMAL(12, 2), nullable=False, default=0)
@@ -10,7 +10,7 @@ class User(db.Model):
     fullname = db.Column(db.String(100), nullable=False)
     contacts = db.Column(db.String(20), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=db.func.now())
     last_login = db.Column(db.DateTime)  
 
@@ -29,10 +29,10 @@ class User(db.Model):
         db.session.commit()
     
     def to_dict(self):
+        """Public profile; never includes the password hash"""
         return {
             'id': self.id,
             'fullname': self.fullname,
             'contact': self.contacts,
             'email': self.email,
-            'password': self.password_hash
         }
\ No newline at end of file
@@ -0,0 +1,23 @@
+"""
+routes - Blueprints of the Food Ordering System
+
+- core: frontend pages, the session gate, operational endpoints and the
+  error handler
+- auth: user registration, login and logout
+- menu: menu and category management
+- orders: cart, checkout and order processing
+- payments: M-Pesa payment integration
+- analytics: admin sales reports from the sales rollups
+- exports: admin CSV/NDJSON downloads of orders and payments
+
+The application uses Flask for routing and SQLAlchemy for database operations.
+"""
+
+from routes import analytics, auth, core, exports, menu, orders, payments
+
+BLUEPRINTS = (core.bp, auth.bp, menu.bp, orders.bp, payments.bp, analytics.bp, exports.bp)
+
+
+def register_blueprints(app):
+    for blueprint in BLUEPRINTS:
+        app.register_blueprint(blueprint)
@@ -0,0 +1,162 @@
+"""
+routes/analytics.py - Admin sales analytics
+
+Answers dashboard queries from the sales rollups (services/sales_rollup.py)
+only, so a report over any date range reads a few hundred small rows
+whatever the size of the order history. Requires
+"Authorization: Bearer <ADMIN_TOKEN>"; without a configured token the
+endpoints do not exist.
+"""
+
+from datetime import date, datetime, time, timedelta
+
+from flask import Blueprint, request, jsonify, current_app
+
+from models import db
+from models.category import Category
+from models.menu import MenuItem
+from models.sales import SalesDailyItem, SalesHourly
+from services.profiler import token_matches
+from services.sales_rollup import REVENUE_STATUSES
+from services.sql import utcnow
+
+bp = Blueprint("analytics", __name__)
+
+GROUPINGS = ("day", "hour", "item", "category")
+
+# Longest range one request may ask for, in days
+MAX_RANGE_DAYS = 366
+
+# ==================================================================
+# HELPER FUNCTIONS
+# ==================================================================
+
+class AnalyticsQueryError(Exception):
+    """Raised for an invalid analytics query string"""
+
+def admin_authorized():
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return token_matches(supplied, current_app.config.get("ADMIN_TOKEN"))
+
+def parse_range(args):
+    """
+    Reads the from/to query parameters (YYYY-MM-DD, inclusive)
+
+    Defaults to the last 30 days, today included (UTC).
+
+    Returns:
+        tuple: (first day, last day)
+
+    Raises:
+        AnalyticsQueryError: If a date is malformed or the range is invalid
+    """
+    try:
+        end = date.fromisoformat(args["to"]) if args.get("to") else utcnow().date()
+        start = date.fromisoformat(args["from"]) if args.get("from") else end - timedelta(days=29)
+    except ValueError:
+        raise AnalyticsQueryError("from and to must be dates (YYYY-MM-DD)")
+    if start > end:
+        raise AnalyticsQueryError("from must not be after to")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise AnalyticsQueryError(f"The range may span at most {MAX_RANGE_DAYS} days")
+    return start, end
+
+def money(value):
+    return round(float(value or 0), 2)
+
+def hourly_filter(start, end, statuses):
+    return (
+        SalesHourly.hour >= datetime.combine(start, time.min),
+        SalesHourly.hour < datetime.combine(end + timedelta(days=1), time.min),
+        SalesHourly.status.in_(statuses),
+    )
+
+def sales_by_time(start, end, statuses, by_day):
+    """Orders and revenue per hour, or per day summed from the hours"""
+    bucket = db.func.date(SalesHourly.hour) if by_day else SalesHourly.hour
+    rows = db.session.query(
+        bucket, db.func.sum(SalesHourly.orders), db.func.sum(SalesHourly.revenue)
+    ).filter(*hourly_filter(start, end, statuses)).group_by(bucket).order_by(bucket)
+    key = "day" if by_day else "hour"
+    return [
+        # SQLite returns date() as a string, other databases as a date
+        {key: value if isinstance(value, str) else value.isoformat(), "orders": int(orders or 0), "revenue": money(revenue)}
+        for value, orders, revenue in rows
+    ]
+
+def sales_totals(start, end, statuses):
+    orders, revenue = db.session.query(
+        db.func.sum(SalesHourly.orders), db.func.sum(SalesHourly.revenue)
+    ).filter(*hourly_filter(start, end, statuses)).one()
+    return {"orders": int(orders or 0), "revenue": money(revenue)}
+
+def sales_by_item(start, end, statuses, by_category):
+    """Orders, quantity and revenue per menu item or per category"""
+    group = MenuItem.category_id if by_category else SalesDailyItem.menu_item_id
+    query = db.session.query(
+        group,
+        db.func.sum(SalesDailyItem.orders),
+        db.func.sum(SalesDailyItem.quantity),
+        db.func.sum(SalesDailyItem.revenue),
+    ).filter(
+        SalesDailyItem.day >= start,
+        SalesDailyItem.day <= end,
+        SalesDailyItem.status.in_(statuses),
+    )
+    if by_category:
+        query = query.outerjoin(MenuItem, MenuItem.id == SalesDailyItem.menu_item_id)
+    rows = query.group_by(group).all()
+
+    model = Category if by_category else MenuItem
+    names = dict(
+        db.session.query(model.id, model.name).filter(model.id.in_([r[0] for r in rows if r[0] is not None]))
+    )
+    key = "category_id" if by_category else "menu_item_id"
+    result = [
+        {key: group_id, "name": names.get(group_id), "orders": int(orders or 0),
+         "quantity": int(quantity or 0), "revenue": money(revenue)}
+        for group_id, orders, quantity, revenue in rows
+    ]
+    result.sort(key=lambda row: row["revenue"], reverse=True)
+    return result
+
+# ==================================================================
+# ANALYTICS ROUTES
+# ==================================================================
+
+@bp.route("/api/admin/analytics/sales", methods=["GET"])
+def sales_analytics():
+    """
+    Sales per day, hour, menu item or category
+
+    Query parameters:
+        from, to: First and last day, YYYY-MM-DD (default: the last 30 days)
+        group_by: day (default), hour, item or category
+        status: Comma-separated order statuses (default: confirmed,completed)
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Not found"}), 404
+
+    try:
+        start, end = parse_range(request.args)
+    except AnalyticsQueryError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    group_by = request.args.get("group_by", "day")
+    if group_by not in GROUPINGS:
+        return jsonify({"success": False, "message": f"group_by must be one of {', '.join(GROUPINGS)}"}), 400
+    statuses = [s for s in request.args.get("status", "").split(",") if s] or list(REVENUE_STATUSES)
+
+    if group_by in ("day", "hour"):
+        rows = sales_by_time(start, end, statuses, by_day=group_by == "day")
+    else:
+        rows = sales_by_item(start, end, statuses, by_category=group_by == "category")
+
+    return jsonify({
+        "success": True,
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "group_by": group_by,
+        "statuses": statuses,
+        "totals": sales_totals(start, end, statuses),
+        "rows": rows,
+    })
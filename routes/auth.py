@@ -0,0 +1,207 @@
+"""
+routes/auth.py - User registration, login and session routes
+"""
+
+from flask import Blueprint, request, jsonify, session, current_app
+from datetime import datetime
+from models import db
+from models.user import User
+from services.accounts import RegistrationError, register_user
+from services.passwords import PasswordHasher, PasswordHasherBusy
+from services.phone_numbers import format_phone_number
+from services.user_cache import UserCache
+
+bp = Blueprint("auth", __name__)
+
+# ==================================================================
+# HELPER FUNCTIONS
+# ==================================================================
+
+def validate_login_data(data):
+    """
+    Validates login data
+
+    Registration data is validated by services.accounts.clean_registration.
+
+    Args:
+        data (dict): Login data to validate
+
+    Returns:
+        tuple: (bool success, str message)
+    """
+    if not isinstance(data, dict) or not data.get('contact') or not data.get('password'):
+        return False, "Phone and password are required"
+    return True, ""
+
+def get_user_cache():
+    """Returns this app's cache of user profiles, creating it on first use"""
+    cache = current_app.extensions.get("user_cache")
+    if cache is None:
+        cache = UserCache(current_app.config["USER_CACHE_SIZE"], current_app.config["USER_CACHE_TTL"])
+        current_app.extensions["user_cache"] = cache
+    return cache
+
+def get_password_hasher():
+    """Returns this app's password hasher, creating it on first use"""
+    hasher = current_app.extensions.get("password_hasher")
+    if hasher is None:
+        hasher = PasswordHasher(
+            method=current_app.config["PASSWORD_HASH_METHOD"],
+            workers=current_app.config["PASSWORD_HASH_WORKERS"],
+            max_pending=current_app.config["PASSWORD_HASH_MAX_PENDING"],
+            timeout=current_app.config["PASSWORD_HASH_TIMEOUT"],
+            queue_timeout=current_app.config["PASSWORD_HASH_QUEUE_TIMEOUT"],
+        )
+        current_app.extensions["password_hasher"] = hasher
+    return hasher
+
+def get_session_profile():
+    """
+    Returns the logged-in user's public profile
+
+    Served from the user cache, so a warm session check costs no query.
+
+    Returns:
+        dict: User.to_dict(), or None without a session or if the user is gone
+    """
+    user_id = session.get("user_id")
+    if user_id is None:
+        return None
+    cache = get_user_cache()
+    profile = cache.get(user_id)
+    if profile is None:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        profile = user.to_dict()
+        cache.set(user_id, profile)
+    return profile
+
+@bp.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Answers with a retryable 503 when too many logins or registrations are being hashed"""
+    retry_after = max(1, int(round(error.retry_after)))
+    response = jsonify({"success": False, "message": str(error), "retry_after": retry_after})
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 503
+
+# ==================================================================
+# AUTHENTICATION ROUTES
+# ==================================================================
+
+@bp.route("/api/register", methods=["POST"])
+def register():
+    """
+    Handles user registration
+    
+    Expected JSON:
+    {
+        "fullname": "User Name",
+        "email": "user@example.com",
+        "contact": "0712345678",
+        "password": "securepassword"
+    }
+
+    The phone number is stored as 254XXXXXXXXX. A taken email or phone
+    number is reported by the users table's unique indexes: 409 with the
+    offending field.
+    """
+    data = request.get_json(silent=True)
+
+    try:
+        user = register_user(data, get_password_hasher())
+        return jsonify({
+            "success": True,
+            "message": "Registration successful",
+            "user": user.to_dict(),
+        }), 201
+
+    except RegistrationError as e:
+        return jsonify({"success": False, "message": e.message, "field": e.field}), e.status
+    except PasswordHasherBusy:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@bp.route("/api/login", methods=["POST"])
+def login():
+    """
+    Handles user login
+    
+    Expected JSON:
+    {
+        "contact": "0712345678",
+        "password": "userpassword"
+    }
+    """
+    data = request.get_json(silent=True)
+
+    # Validate input
+    valid, message = validate_login_data(data)
+    if not valid:
+        return jsonify({"success": False, "message": message}), 400
+
+    try:
+        # Find user by phone number, stored as 254XXXXXXXXX; the number as
+        # typed still matches accounts the migration could not normalize
+        contact = str(data["contact"])
+        user = User.query.filter(User.contacts.in_({format_phone_number(contact), contact})).first()
+
+        # Verify password
+        hasher = get_password_hasher()
+        if user and hasher.verify(user.password_hash, data["password"]):
+            # Create session
+            session["user_id"] = user.id
+            session.permanent = True
+
+            # Upgrade a hash made with older parameters while we have the password
+            if hasher.needs_rehash(user.password_hash):
+                try:
+                    user.password_hash = hasher.hash(data["password"], purpose="login")
+                except PasswordHasherBusy:
+                    # Saturated; the next login upgrades it
+                    pass
+
+            # Update last login time
+            user.last_login = datetime.now()
+            db.session.commit()
+
+            return jsonify({
+                "success": True,
+                "message": "Login successful",
+                "user": user.to_dict(),
+            })
+        else:
+            return jsonify({"success": False, "message": "Invalid credentials"}), 401
+    except PasswordHasherBusy:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@bp.route("/api/check-session", methods=["GET"])
+def check_session():
+    """Checks if user has a valid session"""
+    profile = get_session_profile()
+    if profile:
+        return jsonify({"valid": True, "user": profile})
+    return jsonify({"valid": False})
+
+@bp.route("/api/user", methods=["GET"])
+def get_user_info():
+    """Gets current user's information"""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 401
+
+    profile = get_session_profile()
+    if not profile:
+        return jsonify({"success": False, "message": "User not logged in"}), 404
+
+    return jsonify({"success": True, "user": profile})
+
+@bp.route("/api/logout", methods=["POST"])
+def logout():
+    """Terminates the current session"""
+    session.clear()
+    return jsonify({"success": True, "message": "Logged out successfully"})
@@ -0,0 +1,118 @@
+"""
+routes/core.py - Frontend pages, the session gate and operational endpoints
+
+Holds what is not part of a single feature: the single-page frontend, the
+global session check, the metrics/profiling/pool endpoints and the 500
+error handler.
+"""
+
+from flask import Blueprint, render_template, request, jsonify, session, current_app, Response, send_file
+import hmac
+from models import db
+from services.database import pool_status
+from services.profiler import token_matches
+
+bp = Blueprint("core", __name__)
+
+# ==================================================================
+# FRONTEND PAGES
+# ==================================================================
+
+@bp.route("/")
+@bp.route("/<page>")
+def index(page=None):
+    """Serves the main frontend application"""
+    return render_template("index.html")
+
+@bp.route("/login")
+@bp.route("/register")
+def auth_pages():
+    """Serves authentication pages (handled by frontend routing)"""
+    return render_template("index.html")
+
+# ==================================================================
+# SESSION GATE
+# ==================================================================
+
+@bp.before_app_request
+def check_valid_session():
+    """
+    Global session checker - runs before each request
+    Skips authentication for static files and auth routes
+    """
+    # /profiles and /api/admin/ check their own bearer tokens
+    if request.path.startswith(("/static/", "/profiles", "/api/admin/")) or request.path in [
+        "/api/login",
+        "/api/register",
+        "/api/mpesa-callback",
+        "/metrics",
+        "/",
+    ]:
+        return
+
+    if "user_id" not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+
+# ==================================================================
+# OPERATIONS
+# ==================================================================
+
+@bp.route("/db-pool-stats")
+def db_pool_stats():
+    """Reports connection pool occupancy and checkout wait times for this worker"""
+    return jsonify({"success": True, "stats": pool_status(db.engine)})
+
+@bp.route("/metrics")
+def metrics():
+    """
+    Prometheus metrics merged from every worker
+
+    Needs "Authorization: Bearer <METRICS_TOKEN>"; without a token configured
+    it is a 404 unless METRICS_PUBLIC is set.
+    """
+    expected = current_app.config.get("METRICS_TOKEN")
+    if expected:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied, expected):
+            return jsonify({"error": "Unauthorized"}), 401
+    elif not current_app.config.get("METRICS_PUBLIC"):
+        return jsonify({"error": "Not found"}), 404
+    return Response(
+        current_app.extensions["metrics"].render(),
+        mimetype="text/plain; version=0.0.4",
+    )
+
+def profiler_authorized():
+    """Profiles need "Authorization: Bearer <PROFILER_TOKEN>"; off without a token"""
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return token_matches(supplied, current_app.config.get("PROFILER_TOKEN"))
+
+@bp.route("/profiles")
+def list_profiles():
+    """Lists the request profiles stored by this host, newest first"""
+    if not profiler_authorized():
+        return jsonify({"error": "Not found"}), 404
+    return jsonify({"success": True, "profiles": current_app.extensions["profile_store"].list()})
+
+@bp.route("/profiles/<name>")
+def download_profile(name):
+    """Downloads one profile as collapsed stacks (flamegraph.pl/speedscope input)"""
+    if not profiler_authorized():
+        return jsonify({"error": "Not found"}), 404
+    path = current_app.extensions["profile_store"].path(name)
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(path, mimetype="text/plain", as_attachment=True, download_name=name)
+
+# ==================================================================
+# ERROR HANDLER
+# ==================================================================
+
+@bp.app_errorhandler(500)
+def handle_server_error(e):
+    """Global 500 error handler"""
+    return jsonify({
+        'success': False,
+        'message': 'Internal server error',
+        'error': str(e)
+    }), 500
@@ -0,0 +1,59 @@
+"""
+routes/exports.py - Admin data exports
+
+Streams orders, order items, payments and status history as CSV or NDJSON
+(services/exports.py) without holding the result in memory. Requires
+"Authorization: Bearer <ADMIN_TOKEN>" like the analytics endpoints.
+"""
+
+from datetime import date
+
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+
+from routes.analytics import admin_authorized
+from services.exports import FORMATS, ExportError, export, gzip_chunks
+
+bp = Blueprint("exports", __name__)
+
+# ==================================================================
+# EXPORT ROUTES
+# ==================================================================
+
+@bp.route("/api/admin/exports/<dataset>", methods=["GET"])
+def export_dataset(dataset):
+    """
+    Downloads a dataset
+
+    Query parameters:
+        format: csv (default) or ndjson
+        from, to: First and last creation day, YYYY-MM-DD (default: unbounded)
+        status: Comma-separated statuses (default: all)
+        gzip: 1 to download gzip-compressed
+    """
+    if not admin_authorized():
+        return jsonify({"error": "Not found"}), 404
+
+    fmt = request.args.get("format", "csv")
+    compress = request.args.get("gzip", "0").lower() in ("1", "true", "yes")
+    try:
+        start = date.fromisoformat(request.args["from"]) if request.args.get("from") else None
+        end = date.fromisoformat(request.args["to"]) if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"success": False, "message": "from and to must be dates (YYYY-MM-DD)"}), 400
+    statuses = [s for s in request.args.get("status", "").split(",") if s]
+    try:
+        chunks = export(dataset, fmt, start, end, statuses, current_app.config["EXPORT_BATCH_SIZE"])
+    except ExportError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    filename = f"{dataset}_{start or 'start'}_{end or 'end'}.{fmt}"
+    mimetype = FORMATS[fmt]
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        mimetype = "application/gzip"
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,105 @@
+"""
+routes/menu.py - Menu and category routes
+
+Responses are served from the per-worker catalog cache with strong ETags
+(see services/catalog.py).
+"""
+
+from flask import Blueprint, request, current_app, Response
+import os
+from models import db
+from models.category import Category
+from models.menu import MenuItem
+from services.catalog import CatalogCache, set_shared_version_path
+
+bp = Blueprint("menu", __name__)
+
+# ==================================================================
+# MENU & CATEGORY ROUTES
+# ==================================================================
+
+def get_catalog_cache():
+    """Returns this worker's catalog cache, creating it on first use"""
+    cache = current_app.extensions.get("catalog_cache")
+    if cache is None:
+        version_path = current_app.config["CATALOG_VERSION_PATH"]
+        if version_path:
+            os.makedirs(os.path.dirname(version_path), exist_ok=True)
+        set_shared_version_path(version_path)
+        cache = CatalogCache(
+            check_interval=current_app.config["CATALOG_CHECK_INTERVAL"],
+            max_age=current_app.config["CATALOG_MAX_AGE"],
+            max_entries=current_app.config["CATALOG_CACHE_SIZE"],
+        )
+        current_app.extensions["catalog_cache"] = cache
+    return cache
+
+def catalog_response(key, builder):
+    """
+    Serves a catalog endpoint from the cache, honouring If-None-Match
+
+    Args:
+        key (str): Cache key for this endpoint
+        builder (callable): Returns (status, data) on a cache miss
+    """
+    entry = get_catalog_cache().get(key, builder, current_app.json.dumps)
+
+    if entry.status == 200 and request.if_none_match.contains(entry.etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry.body, status=entry.status, mimetype="application/json")
+    response.set_etag(entry.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def build_categories():
+    categories = Category.query.filter_by(is_active=True).all()
+    return 200, [category.to_dict() for category in categories]
+
+def build_menu():
+    menu_items = MenuItem.query.filter_by(is_available=True).all()
+    return 200, [item.to_dict() for item in menu_items]
+
+def warm_catalog():
+    """Builds the menu and category responses before the first request asks"""
+    cache = get_catalog_cache()
+    cache.get("categories", build_categories, current_app.json.dumps)
+    cache.get("menu", build_menu, current_app.json.dumps)
+
+@bp.route("/api/categories", methods=["GET"])
+def get_categories():
+    """Gets all active food categories"""
+    return catalog_response("categories", build_categories)
+
+@bp.route("/api/menu/category/<int:category_id>", methods=["GET"])
+def get_menu_by_category(category_id):
+    """Gets menu items for a specific category"""
+    def build():
+        # Verify category exists
+        category = db.session.get(Category, category_id)
+        if not category:
+            return 404, {"success": False, "message": "Category not found"}
+
+        # Get available items in category
+        menu_items = MenuItem.query.filter_by(
+            category_id=category_id, is_available=True
+        ).all()
+        return 200, [item.to_dict() for item in menu_items]
+
+    return catalog_response(f"menu:category:{category_id}", build)
+
+@bp.route("/api/menu", methods=["GET"])
+def get_menu():
+    """Gets all available menu items"""
+    return catalog_response("menu", build_menu)
+
+@bp.route("/api/menu/<int:item_id>", methods=["GET"])
+def get_menu_item(item_id):
+    """Gets details for a specific menu item"""
+    def build():
+        menu_item = db.session.get(MenuItem, item_id)
+        if not menu_item:
+            return 404, {"success": False, "message": "Menu item not found"}
+        return 200, {"success": True, "item": menu_item.to_dict()}
+
+    return catalog_response(f"menu:item:{item_id}", build)
@@ -0,0 +1,647 @@
+"""
+routes/orders.py - Cart, checkout and order management routes
+
+Orders and carts are priced server-side from the catalog cache's price index
+(see services/orders.py).
+"""
+
+from flask import Blueprint, request, jsonify, session
+from datetime import datetime, timedelta
+from decimal import Decimal
+import base64
+from sqlalchemy.sql import case, func
+from models import db
+from models.menu import MenuItem
+from models.order import Order, OrderItem, OrderStatusHistory
+from models.cart import CartItem
+from routes.menu import get_catalog_cache
+from services.orders import (
+    OrderError, build_price_index, normalize_lines, price_lines, price_order_request,
+    insert_order, insert_order_items,
+)
+from services.idempotency import idempotent
+from services.sales_rollup import record_order_added, record_order_removed, record_status_change
+from services.sql import timestamp_param, upsert
+
+bp = Blueprint("orders", __name__)
+
+# ==================================================================
+# CART ROUTES
+# ==================================================================
+
+# Largest quantity of one menu item in a cart
+MAX_QUANTITY = 99
+
+def get_price_index():
+    """Returns menu prices from the catalog cache (no query on a hit)"""
+    return get_catalog_cache().lookup(
+        "prices", lambda: build_price_index(MenuItem.query.all())
+    )
+
+def parse_quantity(value):
+    """Returns a quantity between 0 and MAX_QUANTITY, or None if invalid"""
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if 0 <= quantity <= MAX_QUANTITY else None
+
+def cart_response(user_id, status=200):
+    """Builds the cart JSON for a user, priced from the catalog cache"""
+    rows = (
+        db.session.query(CartItem.menu_item_id, CartItem.quantity)
+        .filter_by(user_id=user_id)
+        .order_by(CartItem.id)
+        .all()
+    )
+    prices = get_price_index()
+
+    items = []
+    total = Decimal("0.00")
+    for menu_item_id, quantity in rows:
+        entry = prices.get(menu_item_id)
+        if not entry:
+            continue
+        subtotal = entry["price"] * quantity
+        if entry["is_available"]:
+            total += subtotal
+        items.append({
+            "menu_item_id": menu_item_id,
+            "name": entry["name"],
+            "price": float(entry["price"]),
+            "quantity": quantity,
+            "subtotal": float(subtotal),
+            "is_available": entry["is_available"],
+        })
+
+    return jsonify({"success": True, "items": items, "total": float(total)}), status
+
+@bp.route("/api/cart", methods=["GET"])
+def get_cart():
+    """Gets the current user's cart"""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+    return cart_response(session["user_id"])
+
+@bp.route("/api/cart/items", methods=["POST"])
+def add_cart_item():
+    """
+    Adds an item to the cart, or increases its quantity (up to MAX_QUANTITY)
+
+    Expected JSON:
+    {
+        "menu_item_id": 1,
+        "quantity": 1
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    quantity = parse_quantity(data.get("quantity", 1))
+    try:
+        menu_item_id = int(data.get("menu_item_id"))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "menu_item_id is required"}), 400
+    entry = get_price_index().get(menu_item_id)
+    if not quantity:
+        return jsonify({"success": False, "message": f"Quantity must be between 1 and {MAX_QUANTITY}"}), 400
+    if not entry or not entry["is_available"]:
+        return jsonify({"success": False, "message": "Menu item not available"}), 404
+
+    try:
+        # Single-statement upsert on (user_id, menu_item_id)
+        upsert(
+            CartItem,
+            {"user_id": session["user_id"], "menu_item_id": menu_item_id, "quantity": quantity},
+            ["user_id", "menu_item_id"],
+            {"quantity": lambda excluded: case(
+                (CartItem.__table__.c.quantity + excluded.quantity > MAX_QUANTITY, MAX_QUANTITY),
+                else_=CartItem.__table__.c.quantity + excluded.quantity,
+            )},
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return cart_response(session["user_id"], 201)
+
+@bp.route("/api/cart/items/<int:menu_item_id>", methods=["PUT"])
+def update_cart_item(menu_item_id):
+    """
+    Sets the quantity of a cart item (0 removes it)
+
+    Expected JSON:
+    {
+        "quantity": 2
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    quantity = parse_quantity(data.get("quantity"))
+    if quantity is None:
+        return jsonify({"success": False, "message": f"Quantity must be between 0 and {MAX_QUANTITY}"}), 400
+    if quantity == 0:
+        return remove_cart_item(menu_item_id)
+
+    entry = get_price_index().get(menu_item_id)
+    if not entry or not entry["is_available"]:
+        return jsonify({"success": False, "message": "Menu item not available"}), 404
+
+    try:
+        upsert(
+            CartItem,
+            {"user_id": session["user_id"], "menu_item_id": menu_item_id, "quantity": quantity},
+            ["user_id", "menu_item_id"],
+            ["quantity"],
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return cart_response(session["user_id"])
+
+@bp.route("/api/cart/items/<int:menu_item_id>", methods=["DELETE"])
+def remove_cart_item(menu_item_id):
+    """Removes an item from the cart"""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    try:
+        CartItem.query.filter_by(user_id=session["user_id"], menu_item_id=menu_item_id).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return cart_response(session["user_id"])
+
+@bp.route("/api/cart", methods=["PUT"])
+def replace_cart():
+    """
+    Replaces the whole cart (e.g. to sync a cart built offline)
+
+    Expected JSON:
+    {
+        "items": [
+            {"menu_item_id": 1, "quantity": 2},
+            ...
+        ]
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True) or {}
+    items = data.get("items", []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        return jsonify({"success": False, "message": "items must be a list"}), 400
+
+    prices = get_price_index()
+    rows = {}
+    for item in items:
+        if not isinstance(item, dict):
+            return jsonify({"success": False, "message": "Each item must be an object"}), 400
+        try:
+            menu_item_id = int(item.get("menu_item_id"))
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "Each item needs an integer menu_item_id"}), 400
+        quantity = parse_quantity(item.get("quantity"))
+        if quantity is None:
+            return jsonify({"success": False, "message": f"Quantity must be between 0 and {MAX_QUANTITY}"}), 400
+        entry = prices.get(menu_item_id)
+        if quantity and entry and entry["is_available"]:
+            rows[menu_item_id] = min(MAX_QUANTITY, rows.get(menu_item_id, 0) + quantity)
+
+    try:
+        CartItem.query.filter_by(user_id=session["user_id"]).delete()
+        if rows:
+            db.session.execute(
+                CartItem.__table__.insert(),
+                [
+                    {"user_id": session["user_id"], "menu_item_id": menu_item_id, "quantity": quantity}
+                    for menu_item_id, quantity in rows.items()
+                ],
+            )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return cart_response(session["user_id"])
+
+@bp.route("/api/cart", methods=["DELETE"])
+def clear_cart():
+    """Empties the current user's cart"""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    try:
+        CartItem.query.filter_by(user_id=session["user_id"]).delete()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return jsonify({"success": True, "items": [], "total": 0.0})
+
+@bp.route("/api/cart/checkout", methods=["POST"])
+@idempotent("checkout_cart")
+def checkout_cart():
+    """
+    Turns the cart into a pending order in one transaction
+
+    Prices come from the menu, not the client. The cart is emptied in the
+    same transaction that creates the order. Accepts an Idempotency-Key
+    header, so a resent checkout gets the first order back.
+
+    Expected JSON:
+    {
+        "customer_phone": "0712345678",
+        "delivery_address": "optional"
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json() or {}
+    if not data.get("customer_phone"):
+        return jsonify({"success": False, "message": "Customer phone is required"}), 400
+
+    user_id = session["user_id"]
+    try:
+        rows = (
+            db.session.query(CartItem.menu_item_id, CartItem.quantity)
+            .filter_by(user_id=user_id)
+            .all()
+        )
+        if not rows:
+            return jsonify({"success": False, "message": "Cart is empty"}), 400
+
+        priced_items, total = price_lines(normalize_lines(rows), get_price_index())
+        order = insert_order(
+            user_id, priced_items, total, data["customer_phone"], data.get("delivery_address")
+        )
+        order_id = order.id
+        CartItem.query.filter_by(user_id=user_id).delete()
+        db.session.commit()
+
+        return jsonify({
+            "success": True,
+            "order_id": order_id,
+            "total_amount": float(total),
+            "message": "Order created successfully"
+        }), 201
+
+    except OrderError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+# ==================================================================
+# ORDER MANAGEMENT ROUTES
+# ==================================================================
+
+@bp.route("/api/orders", methods=["POST"])
+@idempotent("create_order")
+def create_order():
+    """
+    Creates a new order
+
+    Items are priced from the menu in one query; any unit_price, subtotal
+    or total_amount sent by the client is ignored. The order and all of its
+    items are written in a single transaction.
+    
+    Expected JSON:
+    {
+        "customer_phone": "0712345678",
+        "items": [
+            {
+                "menu_item_id": 1,
+                "quantity": 2
+            },
+            ...
+        ]
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json()
+
+    # Check if updating existing order
+    if "order_id" in data and data["order_id"]:
+        return update_order(data["order_id"])
+
+    if not data.get("customer_phone"):
+        return jsonify({"success": False, "message": "Customer phone is required"}), 400
+
+    try:
+        priced_items, total = price_order_request(data.get("items"))
+        order = insert_order(
+            session["user_id"], priced_items, total,
+            data["customer_phone"], data.get("delivery_address"),
+        )
+        order_id = order.id
+        db.session.commit()
+
+        return jsonify({
+            "success": True,
+            "order_id": order_id,
+            "total_amount": float(total),
+            "message": "Order created successfully"
+        }), 201
+
+    except OrderError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+ORDER_FIELDS = {
+    "id", "user_id", "total_amount", "status", "payment_status", "payment_method",
+    "customer_phone", "mpesa_transaction_id", "delivery_address", "created_at", "updated_at",
+}
+
+def encode_order_cursor(order):
+    """Encodes an order's (created_at, id) position as an opaque cursor"""
+    raw = f"{order.created_at.isoformat()}|{order.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_order_cursor(cursor):
+    """
+    Returns:
+        tuple: (created_at, id)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, order_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(order_id)
+
+def parse_date_param(value, end_of_range=False):
+    """Parses an ISO date/datetime query parameter; bare end dates are inclusive"""
+    parsed = datetime.fromisoformat(value)
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+@bp.route('/api/orders', methods=['GET'])
+def get_user_orders():
+    """
+    Gets the current user's orders, newest first, one page at a time
+
+    Query parameters:
+        limit: Page size (default 20, max 100)
+        cursor: Value of the previous page's X-Next-Cursor header
+        status, payment_status: Exact-match filters
+        from, to: ISO date/datetime range on created_at (to is inclusive
+            for bare dates)
+        fields: Comma-separated order fields to return; include "items"
+            for line items (default: all fields and items)
+
+    Returns a JSON list. When more orders exist, the X-Next-Cursor header
+    carries the cursor for the next page.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+
+    args = request.args
+    try:
+        limit = min(max(int(args.get('limit', 20)), 1), 100)
+        cursor = decode_order_cursor(args['cursor']) if args.get('cursor') else None
+        date_from = parse_date_param(args['from']) if args.get('from') else None
+        date_to = parse_date_param(args['to'], end_of_range=True) if args.get('to') else None
+    except (ValueError, UnicodeDecodeError):
+        return jsonify({'success': False, 'message': 'Invalid pagination or date parameters'}), 400
+
+    if args.get('fields'):
+        fields = {field.strip() for field in args['fields'].split(',') if field.strip()}
+        include_items = 'items' in fields
+        fields &= ORDER_FIELDS
+    else:
+        fields, include_items = ORDER_FIELDS, True
+
+    try:
+        # Served by ix_orders_user_id_created_at_id; keyset instead of OFFSET
+        # keeps every page equally cheap
+        query = Order.query.filter(Order.user_id == session['user_id'])
+        if args.get('status'):
+            query = query.filter(Order.status == args['status'])
+        if args.get('payment_status'):
+            query = query.filter(Order.payment_status == args['payment_status'])
+        if date_from:
+            query = query.filter(Order.created_at >= timestamp_param(date_from))
+        if date_to:
+            query = query.filter(Order.created_at < timestamp_param(date_to))
+        if cursor:
+            created_at, order_id = cursor
+            query = query.filter(db.tuple_(Order.created_at, Order.id) < db.tuple_(timestamp_param(created_at), order_id))
+
+        if include_items:
+            # One extra query for all items of the page (no join fan-out)
+            query = query.options(
+                db.selectinload(Order.order_items).joinedload(OrderItem.menu_item)
+            )
+
+        orders = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1).all()
+        has_more = len(orders) > limit
+        orders = orders[:limit]
+        
+        # Format response data
+        orders_list = []
+        for order in orders:
+            order_data = order.to_dict()
+            order_data = {key: value for key, value in order_data.items() if key in fields}
+
+            if include_items:
+                order_data['items'] = [
+                    {
+                        'id': item.id,
+                        'name': item.menu_item.name if item.menu_item else 'Deleted Item',
+                        'menu_item_id': item.menu_item_id,
+                        'quantity': item.quantity,
+                        'price': float(item.unit_price) if item.unit_price else 0.0,
+                        'subtotal': float(item.subtotal) if item.subtotal else 0.0
+                    }
+                    for item in order.order_items
+                ]
+            
+            orders_list.append(order_data)
+        
+        response = jsonify(orders_list)
+        if has_more:
+            response.headers['X-Next-Cursor'] = encode_order_cursor(orders[-1])
+        return response
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@bp.route("/api/orders/<int:order_id>", methods=["GET"])
+def get_order(order_id):
+    """Gets details for a specific order"""
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    order = Order.query.filter_by(id=order_id, user_id=session["user_id"]).first()
+
+    if not order:
+        return jsonify({"success": False, "message": "Order not found"}), 404
+
+    return jsonify({
+        'success': True,
+        'order': order.to_dict()
+    })
+
+@bp.route('/api/orders/<int:order_id>', methods=['DELETE'])
+def delete_order(order_id):
+    """Deletes an order and all related records"""
+    try:
+        order = Order.query.get(order_id)
+        if not order:
+            return jsonify({'success': False, 'message': 'Order not found'}), 404
+        
+        # Take it out of the sales rollups while its items are still there
+        record_order_removed(order)
+
+        # Delete related records first (maintain referential integrity)
+        OrderItem.query.filter_by(order_id=order_id).delete()
+        OrderStatusHistory.query.filter_by(order_id=order_id).delete()
+        
+        # Then delete the order
+        db.session.delete(order)
+        db.session.commit()
+        
+        return jsonify({'success': True}), 200
+    
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+# Statuses a customer may set on their own order
+CUSTOMER_STATUSES = ("cancelled",)
+
+@bp.route("/api/orders/<int:order_id>/status", methods=["PUT"])
+def update_order_status(order_id):
+    """
+    Cancels one of the current user's unpaid orders
+
+    Customers may only cancel: confirmation and completion follow the
+    payment result (services/callback_inbox.py), so a customer cannot count
+    an unpaid order as a sale. Paid orders get a 409.
+
+    Expected JSON:
+    {
+        "status": "cancelled"
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json(silent=True)
+    if not data or "status" not in data:
+        return jsonify({"success": False, "message": "Status is required"}), 400
+    if data["status"] not in CUSTOMER_STATUSES:
+        return jsonify({"success": False, "message": "Orders can only be cancelled"}), 400
+
+    try:
+        # Get and verify order belongs to user
+        order = Order.query.filter_by(id=order_id, user_id=session["user_id"]).with_for_update().first()
+
+        if not order:
+            return jsonify({"success": False, "message": "Order not found"}), 404
+        if order.payment_status == "completed":
+            return jsonify({"success": False, "message": "Paid orders cannot be cancelled"}), 409
+
+        # Create status history record
+        status_history = OrderStatusHistory(
+            order_id=order.id, 
+            old_status=order.status, 
+            new_status=data["status"]
+        )
+        db.session.add(status_history)
+
+        # Update order status
+        old_status = order.status
+        order.status = data["status"]
+        record_status_change(order, old_status)
+        db.session.commit()
+
+        return jsonify({"success": True, "order": order.to_dict()})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@bp.route("/api/orders/<int:order_id>", methods=["PUT"])
+def update_order(order_id):
+    """
+    Updates an existing order
+
+    Items are re-priced from the menu; client-supplied prices are ignored.
+    Only unpaid orders can be changed (409 otherwise), and status and
+    payment_status are not client-settable: payments set them through the
+    M-Pesa callback, the callback inbox or the reconciler.
+    
+    Expected JSON:
+    {
+        "customer_phone": "0712345678",
+        "items": [
+            {
+                "menu_item_id": 1,
+                "quantity": 2
+            },
+            ...
+        ]
+    }
+    """
+    if "user_id" not in session:
+        return jsonify({"success": False, "message": "Unauthorized"}), 401
+
+    data = request.get_json()
+
+    try:
+        # Get and verify order
+        # Locked so a payment result cannot land between the check and the re-pricing
+        order = Order.query.filter_by(id=order_id, user_id=session["user_id"]).with_for_update().first()
+
+        if not order:
+            return jsonify({"success": False, "message": "Order not found"}), 404
+        if order.payment_status != "pending":
+            return jsonify({"success": False, "message": "Paid orders cannot be changed"}), 409
+
+        # Price the new items from the menu
+        priced_items, total = price_order_request(data.get("items"))
+
+        # Recount it in the sales rollups once the new items are in
+        record_order_removed(order)
+
+        # Update order fields
+        order.total_amount = total
+        order.customer_phone = data.get("customer_phone", order.customer_phone)
+        order.updated_at = func.now()
+
+        # Clear existing items
+        OrderItem.query.filter_by(order_id=order.id).delete()
+
+        # Add new items
+        insert_order_items(order.id, priced_items)
+        record_order_added(order)
+        order_id = order.id
+        db.session.commit()
+
+        return jsonify({"success": True, "order_id": order_id, "total_amount": float(total)})
+
+    except OrderError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": e.message}), e.status
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
@@ -0,0 +1,650 @@
+"""
+routes/payments.py - M-Pesa payment routes
+
+STK pushes go through the shared Daraja client (services/mpesa_client.py),
+results arrive through the callback inbox (services/callback_inbox.py) and
+are pushed to waiting clients by payment_events.
+"""
+
+from flask import Blueprint, request, jsonify, session, current_app, Response, stream_with_context
+from datetime import datetime, timedelta, timezone
+import base64
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from models import db
+from models.order import Order
+from models.payment import Payment, PushRequest
+from services.mpesa_client import MpesaRequestError, MpesaUnavailable, client_from_config, time_budget
+from services.mpesa_token import TokenManager, TokenError, SQLiteTokenStore
+from services.payment_events import watch_payment, get_payment_result
+from services.callback_inbox import CallbackProcessor, parse_callback, store_callback
+from services.sql import utcnow
+from services.idempotency import idempotent
+from services.query_stats import expect_repeated_queries
+from services.reconciliation import Reconciler, apply_query_results
+from services.phone_numbers import format_phone_number, is_valid_phone_number
+
+bp = Blueprint("payments", __name__)
+
+# Serialize concurrent pushes for the same order (see order_push_lock)
+PUSH_LOCKS = [threading.Lock() for _ in range(64)]
+
+# ==================================================================
+# HELPER FUNCTIONS
+# ==================================================================
+
+def get_mpesa_client(app_obj=None):
+    """
+    Returns the shared, connection-pooled Daraja API client for this app
+
+    Args:
+        app_obj (Flask): App to use when called outside a request context
+    """
+    app_obj = app_obj or current_app._get_current_object()
+    client = app_obj.extensions.get("mpesa_client")
+    if client is None:
+        client = client_from_config(app_obj.config)
+        app_obj.extensions["mpesa_client"] = client
+    return client
+
+def get_callback_processor():
+    """Returns this app's background callback processor, creating it on first use"""
+    processor = current_app.extensions.get("mpesa_callback_processor")
+    if processor is None:
+        processor = CallbackProcessor(
+            current_app._get_current_object(),
+            workers=current_app.config["MPESA_CALLBACK_WORKERS"],
+            batch_size=current_app.config["MPESA_CALLBACK_BATCH_SIZE"],
+            sweep_interval=current_app.config["MPESA_CALLBACK_SWEEP_INTERVAL"],
+        )
+        current_app.extensions["mpesa_callback_processor"] = processor
+    return processor
+
+def get_token_manager():
+    """
+    Returns the process-wide M-Pesa token manager, creating it on first use
+
+    The manager is stored on the app so every request in this worker shares
+    the same cached token.
+    """
+    manager = current_app.extensions.get("mpesa_token")
+    if manager is None:
+        app_obj = current_app._get_current_object()
+        store = None
+        if current_app.config.get("MPESA_TOKEN_CACHE_PATH"):
+            store = SQLiteTokenStore(
+                current_app.config["MPESA_TOKEN_CACHE_PATH"],
+                key=current_app.config["MPESA_CONSUMER_KEY"] or "default",
+            )
+        manager = TokenManager(
+            lambda: fetch_access_token(app_obj),
+            expiry_margin=current_app.config["MPESA_TOKEN_EXPIRY_MARGIN"],
+            refresh_ahead=current_app.config["MPESA_TOKEN_REFRESH_AHEAD"],
+            store=store,
+        )
+        current_app.extensions["mpesa_token"] = manager
+    return manager
+
+def fetch_access_token(app_obj):
+    """
+    Requests a new access token from the Safaricom M-Pesa API
+
+    Called by the token manager, possibly from a background thread, so it
+    takes the app explicitly instead of relying on current_app.
+
+    Returns:
+        tuple: (access_token, expires_in)
+
+    Raises:
+        TokenError: If the token could not be obtained
+    """
+    client = get_mpesa_client(app_obj)
+    url = client.url(app_obj.config["MPESA_ACCESS_TOKEN_URL"])
+
+    try:
+        response = client.generate_token(
+            app_obj.config["MPESA_ACCESS_TOKEN_URL"],
+            app_obj.config["MPESA_CONSUMER_KEY"],
+            app_obj.config["MPESA_CONSUMER_SECRET"],
+        )
+        if not response.ok:
+            raise MpesaRequestError(f"HTTP {response.status_code}")
+
+        result = response.json()
+    except MpesaUnavailable:
+        # Not a token problem; the endpoint answers it with a 503
+        raise
+    except (MpesaRequestError, ValueError) as e:
+        app_obj.logger.error(f"Error getting M-Pesa access token: {str(e)}")
+        app_obj.logger.error(f"Request URL: {url}")
+        raise TokenError(str(e))
+
+    if 'access_token' not in result:
+        error_msg = result.get('errorMessage', 'Unknown error')
+        app_obj.logger.error(f"M-Pesa token error: {error_msg}")
+        raise TokenError(error_msg)
+
+    app_obj.logger.info("Successfully obtained M-Pesa access token")
+    return result['access_token'], result.get('expires_in', 3599)
+
+def get_access_token():
+    """
+    Gets an access token for the Safaricom M-Pesa API
+
+    Served from the token manager's cache; only calls the OAuth endpoint
+    when the cached token is missing or about to expire.
+
+    Returns:
+        str: Access token or None if failed
+
+    Raises:
+        MpesaUnavailable: If the token breaker is open or the time budget ran out
+    """
+    try:
+        return get_token_manager().get_token()
+    except TokenError:
+        return None
+
+def get_io_executor():
+    """
+    Returns this worker's executor for Daraja calls made off the request thread
+
+    Keyed by pid so a worker forked from a preloaded master never inherits
+    the master's threads.
+    """
+    pid, executor = current_app.extensions.get("mpesa_io", (None, None))
+    if pid != os.getpid():
+        executor = ThreadPoolExecutor(
+            current_app.config["MPESA_IO_THREADS"], thread_name_prefix="mpesa-io"
+        )
+        current_app.extensions["mpesa_io"] = (os.getpid(), executor)
+    return executor
+
+def prefetch_access_token():
+    """
+    Starts getting an access token while the caller prepares its request
+
+    A cached token is returned straight away; otherwise the OAuth call runs
+    on the I/O executor so it overlaps with the caller's database and
+    payload work instead of preceding it.
+
+    Returns:
+        callable: Waits for and returns the access token, or None if failed
+    """
+    manager = get_token_manager()
+    if manager.has_token():
+        return get_access_token
+
+    def fetch():
+        try:
+            return manager.get_token()
+        except TokenError:
+            return None
+
+    # Run in a copy of this context so the fetch shares the request's time budget
+    return get_io_executor().submit(contextvars.copy_context().run, fetch).result
+
+def mpesa_time_budget(view):
+    """Limits the Daraja calls made by a view to MPESA_REQUEST_BUDGET seconds in total"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with time_budget(current_app.config["MPESA_REQUEST_BUDGET"]):
+            return view(*args, **kwargs)
+    return wrapper
+
+@bp.errorhandler(MpesaUnavailable)
+def mpesa_unavailable(error):
+    """Answers with a retryable 503 when Daraja is tripped or too slow"""
+    retry_after = max(1, int(round(error.retry_after)))
+    response = jsonify({
+        "success": False,
+        "error": "M-Pesa is temporarily unavailable, please retry",
+        "retry_after": retry_after,
+    })
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 503
+
+def get_reconciler(**options):
+    """
+    Builds a payment reconciler from the MPESA_RECONCILE_* settings
+
+    Args:
+        options: workers, rate, batch_size or min_age overrides; None
+            values keep the configured setting
+    """
+    config = current_app.config
+    settings = {
+        "workers": config["MPESA_RECONCILE_WORKERS"],
+        "rate": config["MPESA_RECONCILE_RATE"],
+        "batch_size": config["MPESA_RECONCILE_BATCH_SIZE"],
+        "min_age": config["MPESA_RECONCILE_MIN_AGE"],
+    }
+    settings.update({name: value for name, value in options.items() if value is not None})
+    return Reconciler(
+        current_app._get_current_object(), query_stk_status, get_access_token, **settings
+    )
+
+def order_push_lock(order_id):
+    """
+    Returns the lock serializing STK pushes for an order in this worker
+
+    Locks are striped, so unrelated orders occasionally share one; it is
+    only held for the length of one push.
+    """
+    return PUSH_LOCKS[order_id % len(PUSH_LOCKS)]
+
+def find_in_flight_push(order_id):
+    """
+    Returns the CheckoutRequestID of the order's push still awaiting the
+    customer, or None
+
+    A push is in flight while its payment is pending and it is younger than
+    MPESA_PUSH_COALESCE_WINDOW seconds; Safaricom times the PIN prompt out
+    well before that.
+    """
+    window = current_app.config["MPESA_PUSH_COALESCE_WINDOW"]
+    row = (
+        db.session.query(PushRequest.checkout_request_id)
+        .join(Payment, PushRequest.payments_id == Payment.id)
+        .filter(
+            Payment.order_id == order_id,
+            Payment.status == "pending",
+            PushRequest.date_created > utcnow() - timedelta(seconds=window),
+        )
+        .order_by(PushRequest.id.desc())
+        .first()
+    )
+    return row[0] if row else None
+
+def generate_stk_password():
+    """
+    Builds the password/timestamp pair required by STK push and query calls
+
+    Returns:
+        tuple: (password, timestamp)
+    """
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    password = base64.b64encode(
+        (
+            current_app.config["MPESA_BUSINESS_SHORT_CODE"]
+            + current_app.config["MPESA_PASSKEY"]
+            + timestamp
+        ).encode()
+    ).decode()
+    return password, timestamp
+
+def query_stk_status(checkout_request_id, access_token):
+    """
+    Asks M-Pesa for the status of an STK push
+
+    Returns:
+        requests.Response: Raw response from the STK query API
+    """
+    password, timestamp = generate_stk_password()
+    query_payload = {
+        "BusinessShortCode": current_app.config["MPESA_BUSINESS_SHORT_CODE"],
+        "Password": password,
+        "Timestamp": timestamp,
+        "CheckoutRequestID": checkout_request_id,
+    }
+    return get_mpesa_client().stk_query(
+        current_app.config["MPESA_STK_QUERY_URL"], access_token, query_payload
+    )
+
+# ==================================================================
+# PAYMENT PROCESSING ROUTES
+# ==================================================================
+
+@bp.route("/api/make-payment", methods=["POST"])
+@idempotent("make_payment")
+@mpesa_time_budget
+def make_payment():
+    """
+    Initiates M-Pesa STK push payment
+
+    The amount charged is the order's total, rounded up to whole shillings
+    (M-Pesa takes integers); an "amount" in the request is ignored. Orders
+    already paid get a 409.
+    
+    Expected JSON:
+    {
+        "phone": "0712345678",
+        "order_id": 123
+    }
+    """
+    data = request.get_json()
+
+    # Validate input
+    required_fields = ["phone", "order_id"]
+    if not all(field in data for field in required_fields):
+        return jsonify({"error": "Missing required fields"}), 400
+
+    # Refuse at once while Safaricom is failing
+    get_mpesa_client().check_available("stkpush")
+
+    # 1. Start getting the M-Pesa access token while the push is prepared
+    wait_for_token = prefetch_access_token()
+
+    order = Order.query.filter_by(id=data["order_id"], user_id=session.get("user_id")).first()
+    if not order:
+        return jsonify({"error": "Order not found"}), 404
+    if order.payment_status == "completed":
+        return jsonify({"error": "Order is already paid"}), 409
+    order_id = order.id
+    amount = math.ceil(order.total_amount)
+
+    # A push for this order still waiting on the customer is reused instead
+    # of prompting them a second time
+    with order_push_lock(order_id):
+        in_flight = find_in_flight_push(order_id)
+        # Don't hold a pooled connection while waiting on Safaricom
+        db.session.close()
+        if in_flight:
+            return jsonify({
+                "success": True,
+                "message": "Payment already initiated",
+                "checkout_request_id": in_flight,
+                "coalesced": True,
+            })
+        return send_stk_push(order_id, amount, data, wait_for_token)
+
+def send_stk_push(order_id, amount, data, wait_for_token):
+    """
+    Sends the STK push for a validated make_payment request and records it
+
+    Args:
+        order_id (int): Order being paid, owned by the current user
+        amount (int): Shillings to charge, from the order's total
+        data (dict): The make_payment request body
+        wait_for_token (callable): From prefetch_access_token()
+    """
+    try:
+        # 2. Format phone number
+        phone = format_phone_number(data["phone"])
+        if not is_valid_phone_number(phone):
+            return jsonify({"error": "Invalid phone format"}), 400
+
+        # 3. Create timestamp and password
+        password, timestamp = generate_stk_password()
+        business_short_code = current_app.config["MPESA_BUSINESS_SHORT_CODE"]
+
+        # 4. Prepare STK push request
+        payload = {
+            "BusinessShortCode": business_short_code,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": amount,
+            "PartyA": phone,
+            "PartyB": business_short_code,
+            "PhoneNumber": phone,
+            "CallBackURL": current_app.config["MPESA_CALLBACK_URL"],
+            "AccountReference": f"Order{order_id}",
+            "TransactionDesc": "Food Order Payment",
+        }
+
+        access_token = wait_for_token()
+        if not access_token:
+            return jsonify({"error": "Failed to get access token"}), 500
+
+        # 5. Make the API request
+        response = get_mpesa_client().stk_push(
+            current_app.config["MPESA_STK_PUSH_URL"], access_token, payload
+        )
+        response_data = response.json()
+
+        # 6. Handle response
+        if response.status_code == 200 and "ResponseCode" in response_data:
+            if response_data["ResponseCode"] == "0":
+                # 7. Record the payment intent so the callback can find it
+                payment = Payment(
+                    order_id=order_id,
+                    amount=amount,
+                    payment_method="mpesa",
+                    transaction_id=response_data.get("MerchantRequestID"),
+                    phone_number=phone,
+                    status="pending",
+                )
+                db.session.add(payment)
+                db.session.add(PushRequest(
+                    payment=payment,
+                    checkout_request_id=response_data["CheckoutRequestID"],
+                ))
+                db.session.commit()
+
+                return jsonify({
+                    "success": True,
+                    "message": "Payment initiated",
+                    "checkout_request_id": response_data["CheckoutRequestID"],
+                })
+
+        # If we get here, something went wrong
+        return jsonify({
+            "success": False,
+            "error": "STK push failed",
+            "mpesa_response": response_data,
+            "status_code": response.status_code,
+        }), 400
+
+    except MpesaUnavailable:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@bp.route("/test-payment")
+def test_payment():
+    """Test endpoint for payment processing"""
+    test_data = {
+        "phone": "254114505949",  # Sandbox test number
+        "amount": 1,  # 1 KSH
+        "order_id": 123,
+    }
+    return make_payment(test_data)
+
+@bp.route("/api/query-payment-status", methods=["POST"])
+@mpesa_time_budget
+def perform_stk_query():
+    """
+    Queries M-Pesa for payment status
+    
+    Expected JSON:
+    {
+        "checkout_request_id": "ws_CO_123456789"
+    }
+    """
+    data = request.get_json()
+    checkout_request_id = data.get("checkout_request_id")
+
+    if not checkout_request_id:
+        return jsonify({"error": "Checkout Request ID not provided"}), 400
+    get_mpesa_client().check_available("stkquery")
+
+    try:
+        # Get access token
+        access_token = get_access_token()
+        if not access_token:
+            return jsonify({"error": "Failed to get M-Pesa access token"}), 500
+
+        # Send query request
+        response = query_stk_status(checkout_request_id, access_token)
+        return jsonify(response.json())
+
+    except MpesaUnavailable:
+        raise
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@bp.route("/check-payment-status/<checkout_request_id>")
+@mpesa_time_budget
+def check_status(checkout_request_id):
+    """Alternative endpoint for checking payment status"""
+    get_mpesa_client().check_available("stkquery")
+    access_token = get_access_token()
+    if not access_token:
+        return jsonify({"error": "No token"}), 500
+
+    try:
+        response = query_stk_status(checkout_request_id, access_token)
+    except MpesaUnavailable:
+        raise
+    except MpesaRequestError as e:
+        return jsonify({"error": str(e)}), 502
+    return jsonify(response.json())
+
+@bp.route("/api/payments/<checkout_request_id>/events", methods=["GET"])
+def payment_events(checkout_request_id):
+    """
+    Streams the result of an STK push as it arrives
+
+    Clients sending "Accept: text/event-stream" get Server-Sent Events: a
+    "status" event carrying the result, or a "timeout" event after
+    MPESA_EVENTS_MAX_WAIT seconds (EventSource then reconnects). Other
+    clients get a long-poll JSON response: the result, or
+    {"status": "pending"} on timeout.
+
+    Results come from mpesa_callback; Safaricom is only queried once
+    MPESA_STATUS_QUERY_AFTER seconds have passed since the push, and a
+    result found that way is applied to the payment and order exactly as
+    the reconciler would. Pushes for another user's orders are a 404.
+    """
+    # Re-reading the result while waiting is polling, not an N+1
+    expect_repeated_queries()
+    config = current_app.config
+    push_request = (
+        PushRequest.query
+        .join(Payment, PushRequest.payments_id == Payment.id)
+        .join(Order, Order.id == Payment.order_id)
+        .filter(PushRequest.checkout_request_id == checkout_request_id, Order.user_id == session.get("user_id"))
+        .first()
+    )
+    if push_request is None:
+        return jsonify({"error": "Payment not found"}), 404
+    # date_created is set by the database's now(), which is UTC
+    pushed_at = (
+        push_request.date_created.replace(tzinfo=timezone.utc).timestamp()
+        if push_request.date_created
+        else time.time()
+    )
+    db.session.close()
+
+    def query_fallback():
+        """Asks Safaricom directly once the callback is overdue"""
+        try:
+            with time_budget(config["MPESA_REQUEST_BUDGET"]):
+                access_token = get_access_token()
+                if not access_token:
+                    return None
+                data = query_stk_status(checkout_request_id, access_token).json()
+        except (MpesaRequestError, ValueError):
+            # Includes an open breaker; the wait goes on and retries later
+            return None
+        # While the customer has not responded the query returns an error
+        if "ResultCode" not in data:
+            return None
+        # Updates the payment and order under their row locks and records the
+        # result; skipped if the callback got there first
+        try:
+            apply_query_results({checkout_request_id: data})
+        finally:
+            db.session.close()
+        return get_payment_result(checkout_request_id)
+
+    updates = watch_payment(
+        checkout_request_id,
+        timeout=config["MPESA_EVENTS_MAX_WAIT"],
+        poll_interval=config["MPESA_EVENTS_POLL_INTERVAL"],
+        fallback=query_fallback,
+        fallback_at=pushed_at + config["MPESA_STATUS_QUERY_AFTER"],
+        fallback_interval=config["MPESA_STATUS_QUERY_INTERVAL"],
+    )
+
+    if "text/event-stream" not in request.headers.get("Accept", ""):
+        result = next((update for update in updates if update), None)
+        return jsonify(result or {"checkout_request_id": checkout_request_id, "status": "pending"})
+
+    def stream():
+        yield "retry: 2000\n\n"
+        for update in updates:
+            if update is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: status\ndata: {json.dumps(update)}\n\n"
+                return
+        yield "event: timeout\ndata: {}\n\n"
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@bp.route("/test-mpesa-token")
+@mpesa_time_budget
+def test_mpesa_token():
+    """Tests M-Pesa token generation"""
+    token = get_access_token()
+    if token:
+        return jsonify({"success": True, "token": token})
+    return jsonify({"success": False, "error": "Failed to get token"})
+
+@bp.route("/mpesa-breaker-stats")
+def mpesa_breaker_stats():
+    """Reports the state and trip counts of this worker's Daraja circuit breakers"""
+    return jsonify({"success": True, "stats": get_mpesa_client().breaker_stats()})
+
+@bp.route("/mpesa-token-stats")
+def mpesa_token_stats():
+    """Reports token cache hits, misses and refreshes for this worker"""
+    return jsonify({"success": True, "stats": get_token_manager().stats()})
+
+@bp.route("/api/mpesa-callback", methods=["GET"])
+def callback_verification():
+    """Required for M-Pesa URL verification"""
+    return jsonify({"status": "ok"}), 200
+
+@bp.route("/api/mpesa-callback", methods=["POST"])
+def mpesa_callback():
+    """
+    Handles M-Pesa payment callback notifications
+
+    The callback is only stored in the inbox here; background threads apply
+    it to the payment and order (see services/callback_inbox.py). Retried
+    callbacks are acknowledged without being stored twice.
+    """
+    try:
+        data = request.get_json(silent=True)
+
+        if not data:
+            current_app.logger.error("No data received in callback")
+            return jsonify({"success": False, "message": "No data received"}), 400
+
+        # Extract callback data
+        callback_data = parse_callback(data)
+
+        if not callback_data:
+            current_app.logger.error("Invalid callback data structure")
+            return jsonify({"success": False, "message": "Invalid callback data"}), 400
+
+        stored = store_callback(callback_data, request.get_data(as_text=True))
+        get_callback_processor().wake()
+
+        current_app.logger.info(
+            "ResultCode: %s, CheckoutRequestID: %s, stored: %s",
+            callback_data["ResultCode"], callback_data["CheckoutRequestID"], stored
+        )
+        return jsonify({
+            "success": True,
+            "message": "Callback accepted" if stored else "Duplicate callback ignored"
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error storing callback: {str(e)}")
+        return jsonify({"success": False, "message": str(e)}), 500
@@ -0,0 +1,6 @@
+"""
+services - Supporting components used by the routes
+
+Keeps infrastructure concerns (M-Pesa integration, caching, etc.) out of
+routes.py so the view functions stay focused on request handling.
+"""
@@ -0,0 +1,204 @@
+"""
+services/accounts.py - User registration and bulk import
+
+Registration normalizes the phone number to 254XXXXXXXXX with
+format_phone_number, hashes the password and inserts the user without
+looking anything up first: the unique indexes on users.email and
+users.contacts decide. Only when the insert fails is one combined query run
+to tell the caller which field is taken, so concurrent registrations of the
+same email or phone get a 409 instead of a 500.
+
+import_users streams rows (e.g. from a CSV file) through the same
+validation in batches: one conflict query and one multi-row INSERT per
+batch, with the passwords hashed in parallel by the password pool.
+
+    flask --app app import-users users.csv --batch-size 500
+"""
+
+import itertools
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from models.user import User
+from services.phone_numbers import format_phone_number, is_valid_phone_number
+from services.sql import insert_ignore
+
+REQUIRED_FIELDS = ("fullname", "email", "contact", "password")
+
+
+class RegistrationError(Exception):
+    """
+    Raised when registration data is invalid or already registered
+
+    Attributes:
+        message (str): Message for the client
+        status (int): 400 for invalid data, 409 for a taken email or phone
+        field (str): Offending request field, if any
+    """
+
+    def __init__(self, message, status=400, field=None):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.field = field
+
+
+def clean_registration(data):
+    """
+    Validates and normalizes registration data
+
+    Args:
+        data (dict): fullname, email, contact and password
+
+    Returns:
+        tuple: (User column values without the hash, password)
+
+    Raises:
+        RegistrationError: If a field is missing, too long or the phone
+            number is not a Kenyan mobile number
+    """
+    if not isinstance(data, dict) or not all(data.get(k) for k in REQUIRED_FIELDS):
+        raise RegistrationError("All fields are required")
+
+    values = {
+        "fullname": str(data["fullname"]).strip(),
+        "email": str(data["email"]).strip(),
+        "contacts": format_phone_number(str(data["contact"])),
+    }
+    if not is_valid_phone_number(values["contacts"]):
+        raise RegistrationError("Invalid phone number", field="contact")
+    for column in ("fullname", "email"):
+        if len(values[column]) > User.__table__.c[column].type.length:
+            raise RegistrationError(f"{column} is too long", field=column)
+    return values, str(data["password"])
+
+
+def find_taken(emails, contacts):
+    """
+    Looks up which emails and phone numbers are registered, in one query
+
+    Returns:
+        tuple: (set of taken emails, set of taken contacts)
+    """
+    rows = db.session.query(User.email, User.contacts).filter(
+        or_(User.email.in_(emails), User.contacts.in_(contacts))
+    ).all()
+    return {r.email for r in rows} & set(emails), {r.contacts for r in rows} & set(contacts)
+
+
+def conflict_error(values):
+    """Returns the 409 RegistrationError for values that hit a unique index"""
+    taken_emails, taken_contacts = find_taken([values["email"]], [values["contacts"]])
+    if values["email"] in taken_emails:
+        return RegistrationError("Email already registered", 409, "email")
+    if values["contacts"] in taken_contacts:
+        return RegistrationError("Phone number already registered", 409, "contact")
+    return RegistrationError("Account already registered", 409)
+
+
+def register_user(data, hasher):
+    """
+    Creates a user and commits
+
+    Args:
+        data (dict): fullname, email, contact and password
+        hasher (PasswordHasher): Hashes the password
+
+    Returns:
+        User: The new user
+
+    Raises:
+        RegistrationError: 400 for invalid data, 409 if the email or phone
+            is already registered
+        PasswordHasherBusy: If the password pool is saturated
+    """
+    values, password = clean_registration(data)
+    user = User(**values, password_hash=hasher.hash(password))
+    db.session.add(user)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        raise conflict_error(values)
+    return user
+
+
+def import_users(rows, hasher, batch_size=500, dry_run=False, on_reject=None):
+    """
+    Registers users from an iterable of registration dicts, in batches
+
+    Each batch is validated like register_user, checked against existing
+    users with one query, hashed in parallel and inserted with one
+    statement that skips rows registered concurrently. Every batch is
+    committed on its own, so an interrupted import can simply be rerun.
+
+    Args:
+        rows (iterable): Dicts with fullname, email, contact and password
+        hasher (PasswordHasher): Hashes the passwords
+        batch_size (int): Rows per transaction
+        dry_run (bool): Validate and check conflicts only; rows repeating
+            one in an earlier batch are not caught, as nothing is committed
+        on_reject (callable): Called with (row number, message) for every
+            row that is not imported; rows are numbered from 1
+
+    Returns:
+        dict: Counts of imported, duplicate and invalid rows
+    """
+    stats = {"imported": 0, "duplicates": 0, "invalid": 0}
+
+    def reject(number, message, kind):
+        stats[kind] += 1
+        if on_reject is not None:
+            on_reject(number, message)
+
+    numbered = enumerate(rows, start=1)
+    while True:
+        batch = list(itertools.islice(numbered, batch_size))
+        if not batch:
+            break
+
+        cleaned, emails, contacts = [], set(), set()
+        for number, row in batch:
+            try:
+                values, password = clean_registration(row)
+            except RegistrationError as e:
+                reject(number, e.message, "invalid")
+                continue
+            if values["email"] in emails or values["contacts"] in contacts:
+                reject(number, "Email or phone number repeats an earlier row", "duplicates")
+                continue
+            emails.add(values["email"])
+            contacts.add(values["contacts"])
+            cleaned.append((number, values, password))
+        if not cleaned:
+            continue
+
+        # Earlier batches are committed, so this also catches repeats across batches
+        taken_emails, taken_contacts = find_taken(emails, contacts)
+        fresh = []
+        for number, values, password in cleaned:
+            if values["email"] in taken_emails:
+                reject(number, "Email already registered", "duplicates")
+            elif values["contacts"] in taken_contacts:
+                reject(number, "Phone number already registered", "duplicates")
+            else:
+                fresh.append((values, password))
+        if dry_run:
+            # Counted as they would be imported
+            stats["imported"] += len(fresh)
+            db.session.rollback()
+            continue
+        if not fresh:
+            continue
+
+        hashes = hasher.hash_many([password for _, password in fresh])
+        inserted = insert_ignore(
+            User, [{**values, "password_hash": h} for (values, _), h in zip(fresh, hashes)], None
+        )
+        db.session.commit()
+        stats["imported"] += inserted
+        # Registered by someone else since find_taken
+        stats["duplicates"] += len(fresh) - inserted
+    return stats
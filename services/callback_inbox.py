@@ -0,0 +1,389 @@
+"""
+services/callback_inbox.py - Durable inbox for M-Pesa STK callbacks
+
+Safaricom retries callbacks it does not see acknowledged quickly. Instead of
+updating orders while the request waits, mpesa_callback only appends the raw
+payload to the mpesa_callback_inbox table (keyed by CheckoutRequestID and
+ResultCode, so retries are dropped by the unique constraint) and returns.
+
+A small pool of background threads per worker drains the inbox in batches.
+Rows are claimed with a conditional UPDATE so workers never process the same
+row twice, and each row is marked processed in the same transaction that
+applies its effects. A payment that is no longer pending is left untouched,
+so replaying a row is always safe, and the payment_events row records the
+result that was actually applied.
+
+A callback can beat the commit of its push request. Such a row goes back
+to the queue with a doubling delay, UNMATCHED_RETRIES times, before it is
+marked unmatched for an operator (replay-callbacks) or the reconciler.
+"""
+
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+
+from models import db
+from models.order import Order, OrderStatusHistory
+from models.payment import Payment, PushRequest, PaymentEvent, CallbackInbox
+from services.metrics import observe_callback
+from services.payment_events import notifier
+from services.sales_rollup import record_status_change
+from services.sql import insert_ignore, upsert, utcnow
+
+# Retries of a callback whose push request is not found yet, the first
+# UNMATCHED_RETRY_DELAY seconds later and doubling after that (~1 minute)
+UNMATCHED_RETRIES = 5
+UNMATCHED_RETRY_DELAY = 2.0
+
+
+def parse_callback(data):
+    """
+    Extracts the stkCallback section of a callback body
+
+    Returns:
+        dict: stkCallback data, or None if the structure is invalid
+    """
+    if not isinstance(data, dict):
+        return None
+    callback_data = data.get("Body", {}).get("stkCallback", {})
+    if not callback_data or callback_data.get("CheckoutRequestID") is None:
+        return None
+    if callback_data.get("ResultCode") is None:
+        return None
+    return callback_data
+
+
+def store_callback(callback_data, raw_body):
+    """
+    Appends a callback to the inbox and commits
+
+    Returns:
+        bool: False if the same CheckoutRequestID/ResultCode was already stored
+    """
+    inserted = insert_ignore(
+        CallbackInbox,
+        {
+            "checkout_request_id": callback_data["CheckoutRequestID"],
+            "result_code": int(callback_data["ResultCode"]),
+            "payload": raw_body,
+            "status": "pending",
+            "attempts": 0,
+            "received_at": utcnow(),
+        },
+        ["checkout_request_id", "result_code"],
+    )
+    db.session.commit()
+    return inserted > 0
+
+
+def metadata_value(callback_metadata, name):
+    return next(
+        (item.get("Value") for item in callback_metadata if item.get("Name") == name),
+        None,
+    )
+
+
+def apply_stk_result(payment, order, result_code, result_desc, callback_metadata):
+    """
+    Applies an STK push result to a payment and its order
+
+    Does not commit. Payments that are no longer pending are skipped so a
+    result is only ever applied once, provided the caller loaded the payment
+    and order with with_for_update() in the same transaction.
+
+    Returns:
+        bool: True if the payment and order were updated
+    """
+    if payment.status != "pending":
+        return False
+
+    old_status = order.status
+    if int(result_code) == 0:
+        # Payment successful
+        payment.status = "completed"
+        payment.mpesa_receipt_number = metadata_value(callback_metadata, "MpesaReceiptNumber")
+
+        # Add status history records
+        db.session.add(OrderStatusHistory(
+            order_id=order.id,
+            old_status=order.status,
+            new_status="confirmed"
+        ))
+        db.session.add(OrderStatusHistory(
+            order_id=order.id,
+            old_status=order.payment_status,
+            new_status="completed",
+        ))
+
+        # Extract transaction date if available
+        transaction_date_str = metadata_value(callback_metadata, "TransactionDate")
+        if transaction_date_str:
+            try:
+                payment.created_at = datetime.strptime(
+                    str(transaction_date_str), "%Y%m%d%H%M%S"
+                )
+            except ValueError:
+                pass
+
+        # Update order status
+        order.status = "confirmed"
+        order.payment_status = "completed"
+        order.mpesa_transaction_id = payment.mpesa_receipt_number
+    else:
+        # Payment failed
+        payment.status = "failed"
+        payment.error_message = result_desc
+
+        # Update order status
+        order.status = "cancelled"
+        order.payment_status = "failed"
+
+    record_status_change(order, old_status)
+    return True
+
+
+def _apply_rows(rows):
+    """Applies a batch of claimed inbox rows inside the current transaction"""
+    parsed = {}
+    for row in rows:
+        try:
+            parsed[row.id] = parse_callback(json.loads(row.payload))
+        except ValueError:
+            parsed[row.id] = None
+
+    # Resolve every payment/order in the batch with one indexed join, locking
+    # them so a concurrent reconcile or status query waits and then skips
+    checkout_ids = [row.checkout_request_id for row in rows]
+    targets = {
+        checkout_request_id: (payment, order, pushed_at)
+        for checkout_request_id, pushed_at, payment, order in (
+            db.session.query(PushRequest.checkout_request_id, PushRequest.date_created, Payment, Order)
+            .join(Payment, PushRequest.payments_id == Payment.id)
+            .join(Order, Order.id == Payment.order_id)
+            .filter(PushRequest.checkout_request_id.in_(checkout_ids))
+            .with_for_update()
+        )
+    }
+
+    events = []
+    now = utcnow()
+    for row in rows:
+        callback_data = parsed[row.id]
+        row.processed_at = now
+        if not callback_data:
+            row.status = "failed"
+            row.error = "Invalid callback payload"
+            continue
+
+        target = targets.get(row.checkout_request_id)
+        if not target:
+            if row.attempts <= UNMATCHED_RETRIES:
+                # The push request may not be committed yet; try again later
+                row.status = "pending"
+                row.claim_token = None
+                row.next_attempt_at = now + timedelta(seconds=UNMATCHED_RETRY_DELAY * 2 ** (row.attempts - 1))
+                row.processed_at = None
+                row.error = f"No payment found for CheckoutRequestID (attempt {row.attempts})"
+            else:
+                row.status = "unmatched"
+                row.error = "No payment found for CheckoutRequestID"
+            continue
+
+        payment, order, pushed_at = target
+        callback_metadata = callback_data.get("CallbackMetadata", {}).get("Item", [])
+        applied = apply_stk_result(
+            payment, order, row.result_code, callback_data.get("ResultDesc"), callback_metadata
+        )
+        if applied:
+            observe_callback(
+                lag_seconds=(row.received_at - pushed_at).total_seconds() if pushed_at else None,
+                delay_seconds=(now - row.received_at).total_seconds(),
+            )
+            # Only the applied result is published, so the event can never
+            # contradict the payment when callbacks disagree
+            events.append({
+                "checkout_request_id": row.checkout_request_id,
+                "result_code": row.result_code,
+                "result_desc": callback_data.get("ResultDesc"),
+                "mpesa_receipt_number": payment.mpesa_receipt_number,
+                "source": "callback",
+                "created_at": now,
+            })
+        row.status = "processed"
+        row.error = None
+
+    if events:
+        upsert(
+            PaymentEvent, events, ["checkout_request_id"],
+            ["result_code", "result_desc", "mpesa_receipt_number", "source"],
+        )
+
+
+def release_stale_claims(lease_seconds=60):
+    """Hands rows claimed by a worker that died back to the queue"""
+    stale = db.session.query(CallbackInbox.id).filter(
+        CallbackInbox.status == "processing",
+        CallbackInbox.locked_at < utcnow() - timedelta(seconds=lease_seconds),
+    ).first()
+    if stale:
+        db.session.query(CallbackInbox).filter(
+            CallbackInbox.status == "processing",
+            CallbackInbox.locked_at < utcnow() - timedelta(seconds=lease_seconds),
+        ).update({"status": "pending"}, synchronize_session=False)
+        db.session.commit()
+
+
+def process_pending(batch_size=50):
+    """
+    Claims and processes one batch of pending inbox rows
+
+    Returns:
+        int: Number of rows claimed
+    """
+    ids = [
+        row_id for (row_id,) in db.session.query(CallbackInbox.id)
+        .filter(
+            CallbackInbox.status == "pending",
+            or_(CallbackInbox.next_attempt_at.is_(None), CallbackInbox.next_attempt_at <= utcnow()),
+        )
+        .order_by(CallbackInbox.id)
+        .limit(batch_size)
+    ]
+    if not ids:
+        db.session.commit()
+        return 0
+
+    claim_token = str(uuid.uuid4())
+    db.session.query(CallbackInbox).filter(
+        CallbackInbox.id.in_(ids), CallbackInbox.status == "pending"
+    ).update(
+        {
+            "status": "processing",
+            "claim_token": claim_token,
+            "locked_at": utcnow(),
+            "attempts": CallbackInbox.attempts + 1,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    rows = CallbackInbox.query.filter_by(claim_token=claim_token).order_by(CallbackInbox.id).all()
+    row_ids = [row.id for row in rows]
+    try:
+        _apply_rows(rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Isolate the row that failed so the rest of the batch still applies
+        for row_id in row_ids:
+            row = db.session.get(CallbackInbox, row_id)
+            try:
+                _apply_rows([row])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                row = db.session.get(CallbackInbox, row_id)
+                row.status = "failed"
+                row.error = str(e)
+                db.session.commit()
+
+    if row_ids:
+        notifier.notify()
+    return len(row_ids)
+
+
+def drain(batch_size=50):
+    """Processes batches until the inbox is empty; returns rows processed"""
+    release_stale_claims()
+    total = 0
+    while True:
+        claimed = process_pending(batch_size)
+        total += claimed
+        if claimed < batch_size:
+            return total
+
+
+def replay(ids=None, checkout_request_id=None, statuses=("failed", "unmatched")):
+    """
+    Puts inbox rows back in the queue
+
+    Args:
+        ids (list[int]): Specific inbox row ids
+        checkout_request_id (str): All rows for one checkout request
+        statuses (tuple): Row statuses to requeue when no ids are given
+
+    Returns:
+        int: Number of rows requeued
+    """
+    query = db.session.query(CallbackInbox)
+    if ids:
+        query = query.filter(CallbackInbox.id.in_(ids))
+    if checkout_request_id:
+        query = query.filter(CallbackInbox.checkout_request_id == checkout_request_id)
+    if not ids and statuses:
+        query = query.filter(CallbackInbox.status.in_(statuses))
+    count = query.update(
+        {"status": "pending", "claim_token": None, "error": None, "next_attempt_at": None},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return count
+
+
+class CallbackProcessor:
+    """
+    Background threads that drain the callback inbox
+
+    Threads wake immediately when this worker stores a callback and
+    otherwise sweep the inbox every sweep_interval seconds, which also picks
+    up rows left behind by other workers.
+
+    Args:
+        app (Flask): App used to push an app context in each thread
+        workers (int): Number of draining threads
+        batch_size (int): Rows claimed per transaction
+        sweep_interval (float): Seconds between idle sweeps
+    """
+
+    def __init__(self, app, workers=2, batch_size=50, sweep_interval=5.0):
+        self.app = app
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sweep_interval = sweep_interval
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        """Starts the threads once per process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                threading.Thread(
+                    target=self._run, name=f"mpesa-callback-{i}", daemon=True
+                ).start()
+            self._pid = os.getpid()
+
+    def wake(self):
+        self.start()
+        self._event.set()
+
+    def _run(self):
+        while True:
+            self._event.wait(self.sweep_interval)
+            self._event.clear()
+            with self.app.app_context():
+                try:
+                    drain(self.batch_size)
+                except Exception as e:
+                    db.session.rollback()
+                    self.app.logger.error(f"Error draining callback inbox: {str(e)}")
+                finally:
+                    db.session.remove()
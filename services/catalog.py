@@ -0,0 +1,195 @@
+"""
+services/catalog.py - Versioned cache of the serialized menu and categories
+
+The menu changes a few times a day but is read on every page load. The
+CatalogCache keeps the encoded JSON body and a strong ETag for each catalog
+endpoint, so a hit costs no database query and no JSON encoding.
+
+Entries are tagged with the catalog version. SQLAlchemy session events bump
+the version whenever a transaction that wrote a MenuItem or Category commits.
+Other workers learn about the change through a shared version file whose
+mtime is checked at most once per check_interval, and every entry is rebuilt
+after max_age seconds regardless, which covers writes made outside the ORM
+(e.g. the SQL seed files).
+
+Only 200 responses are kept, so requests for ids that do not exist cannot
+fill the cache, and at most max_entries responses are kept per worker,
+least recently used first out.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models.category import Category
+from models.menu import MenuItem
+
+CATALOG_MODELS = (MenuItem, Category)
+
+_version_lock = threading.Lock()
+_local_version = 0
+_shared_version_path = None
+
+
+def set_shared_version_path(path):
+    """Sets the file used to broadcast catalog changes to other workers"""
+    global _shared_version_path
+    _shared_version_path = path
+
+
+def bump_version():
+    """Invalidates every cached catalog entry, in all workers"""
+    global _local_version
+    with _version_lock:
+        _local_version += 1
+    if _shared_version_path:
+        try:
+            with open(_shared_version_path, "a"):
+                pass
+            os.utime(_shared_version_path, None)
+        except OSError:
+            pass
+
+
+# ------------------------------------------------------------------
+# Session events: bump the version when catalog writes are committed
+# ------------------------------------------------------------------
+
+@event.listens_for(Session, "after_flush")
+def _track_catalog_flush(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info["catalog_dirty"] = True
+            return
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_catalog_bulk(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ in CATALOG_MODELS:
+            orm_execute_state.session.info["catalog_dirty"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_on_commit(session):
+    if session.info.pop("catalog_dirty", False):
+        bump_version()
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop("catalog_dirty", None)
+
+
+class CatalogEntry:
+    """A cached response: status code, encoded body and its strong ETag"""
+
+    __slots__ = ("status", "body", "etag", "version", "built_at")
+
+    def __init__(self, status, body, version):
+        self.status = status
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.version = version
+        self.built_at = time.monotonic()
+
+
+class CatalogCache:
+    """
+    Per-worker cache of encoded catalog responses
+
+    Args:
+        check_interval (float): Seconds between checks of the shared
+            version file
+        max_age (float): Seconds after which an entry is always rebuilt
+        max_entries (int): Responses kept; the least recently used go first
+    """
+
+    def __init__(self, check_interval=1.0, max_age=300.0, max_entries=1024):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._values = {}
+        self._lock = threading.Lock()
+        self._shared_mtime = None
+        self._next_check = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        """Returns the current (local, shared) catalog version"""
+        now = time.monotonic()
+        if _shared_version_path and now >= self._next_check:
+            self._next_check = now + self.check_interval
+            try:
+                self._shared_mtime = os.stat(_shared_version_path).st_mtime_ns
+            except OSError:
+                self._shared_mtime = None
+        return (_local_version, self._shared_mtime)
+
+    def get(self, key, builder, encode):
+        """
+        Returns the cached entry for key, building it on a miss
+
+        Error responses (e.g. 404 for an unknown id) are returned but not
+        kept.
+
+        Args:
+            key (str): Cache key, e.g. "menu" or "menu:category:3"
+            builder (callable): Returns (status, data) from the database
+            encode (callable): Serializes data to a JSON string
+        """
+        version = self.version()
+        entry = self._entries.get(key)
+        if (entry is not None and entry.version == version
+                and time.monotonic() - entry.built_at < self.max_age):
+            self.hits += 1
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        status, data = builder()
+        entry = CatalogEntry(status, encode(data).encode("utf-8"), version)
+        with self._lock:
+            if status == 200:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            else:
+                self._entries.pop(key, None)
+        return entry
+
+    def lookup(self, key, builder):
+        """
+        Returns a cached Python value for key, building it on a miss
+
+        Same versioning as get(), for data the server uses itself (e.g. the
+        price list) rather than sends to clients.
+        """
+        version = self.version()
+        cached = self._values.get(key)
+        if (cached is not None and cached[0] == version
+                and time.monotonic() - cached[1] < self.max_age):
+            self.hits += 1
+            return cached[2]
+
+        self.misses += 1
+        value = builder()
+        with self._lock:
+            self._values[key] = (version, time.monotonic(), value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._values.clear()
@@ -0,0 +1,180 @@
+"""
+services/circuit_breaker.py - Circuit breaker for calls to an external API
+
+A breaker watches the outcome of the last `window` calls. Once at least
+`min_calls` were made and the share of failed calls reaches `failure_rate`,
+or the share of calls slower than `slow_call_seconds` reaches
+`slow_call_rate`, the breaker opens: calls are refused with
+CircuitOpenError for `open_seconds` instead of waiting on an API that is
+down. After that a single probe call is let through (half-open); it closes
+the breaker if it succeeds quickly and reopens it otherwise.
+
+State is per process, so each gunicorn worker trips on its own traffic.
+"""
+
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is refused because the breaker is open
+
+    Attributes:
+        name (str): Breaker name
+        retry_after (float): Seconds until the breaker lets a probe through
+    """
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} circuit is open; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Failure-rate and latency circuit breaker with a half-open probe
+
+    Args:
+        name (str): Name reported in errors and stats
+        window (int): Number of recent calls considered
+        min_calls (int): Calls needed in the window before it can trip
+        failure_rate (float): Share of failed calls that trips it
+        slow_call_seconds (float): Calls at least this slow count as slow
+        slow_call_rate (float): Share of slow calls that trips it
+        open_seconds (float): How long calls are refused once tripped
+        on_event (callable): Called with (name, event) on every state
+            change ("opened", "half_open", "closed") and refusal ("rejected")
+    """
+
+    def __init__(self, name, window=20, min_calls=10, failure_rate=0.5,
+                 slow_call_seconds=5.0, slow_call_rate=0.5, open_seconds=30.0, on_event=None):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.on_event = on_event
+
+        self.state = CLOSED
+        self._calls = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._stats = {"trips": 0, "rejected": 0, "failures": 0, "slow_calls": 0}
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def check(self):
+        """
+        Raises CircuitOpenError if a call would currently be refused
+
+        Unlike before_call() this never claims the half-open probe, so
+        endpoints can use it to fail fast before doing any other work.
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() < self._opened_at + self.open_seconds:
+                raise self._reject_locked()
+            if self.state == HALF_OPEN and self._probing:
+                raise self._reject_locked()
+
+    def before_call(self):
+        """
+        Admits a call or raises CircuitOpenError
+
+        Every admitted call must be followed by record() or abandon().
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() < self._opened_at + self.open_seconds:
+                    raise self._reject_locked()
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise self._reject_locked()
+                self._probing = True
+
+    def record(self, failed, seconds):
+        """
+        Records the outcome of an admitted call
+
+        Args:
+            failed (bool): Whether the call failed
+            seconds (float): How long it took
+        """
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            self._stats["failures"] += failed
+            self._stats["slow_calls"] += slow
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed or slow:
+                    self._open_locked()
+                else:
+                    self._calls.clear()
+                    self._transition(CLOSED)
+                return
+            if self.state == OPEN:
+                # Started before the breaker tripped
+                return
+            self._calls.append((failed, slow))
+            if len(self._calls) >= self.min_calls:
+                count = len(self._calls)
+                failures = sum(1 for f, _ in self._calls if f)
+                slow_calls = sum(1 for _, s in self._calls if s)
+                if failures / count >= self.failure_rate or slow_calls / count >= self.slow_call_rate:
+                    self._open_locked()
+
+    def abandon(self):
+        """Releases an admitted call that never reached the API"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through (0 when closed)"""
+        if self.state == CLOSED:
+            return 0.0
+        return max(1.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def stats(self):
+        """Returns the breaker's state and counters"""
+        with self._lock:
+            snapshot = dict(self._stats)
+            snapshot["state"] = self.state
+            snapshot["window_calls"] = len(self._calls)
+            snapshot["window_failures"] = sum(1 for f, _ in self._calls if f)
+            snapshot["window_slow_calls"] = sum(1 for _, s in self._calls if s)
+        snapshot["retry_after"] = round(self.retry_after(), 1)
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _open_locked(self):
+        self._opened_at = time.monotonic()
+        self._calls.clear()
+        self._stats["trips"] += 1
+        self._transition(OPEN)
+
+    def _reject_locked(self):
+        self._stats["rejected"] += 1
+        self._emit("rejected")
+        return CircuitOpenError(self.name, self.retry_after())
+
+    def _transition(self, state):
+        self.state = state
+        self._emit("opened" if state == OPEN else state)
+
+    def _emit(self, event):
+        if self.on_event is not None:
+            self.on_event(self.name, event)
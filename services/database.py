@@ -0,0 +1,182 @@
+"""
+services/database.py - Database engine configuration
+
+Builds SQLALCHEMY_ENGINE_OPTIONS from environment variables:
+
+- Server databases (PostgreSQL, MySQL) get an explicitly sized QueuePool
+  with pre-ping and recycling so stale connections are replaced quietly.
+- SQLite connections are switched to WAL with synchronous=NORMAL, a busy
+  timeout and larger page/mmap caches, so concurrent gunicorn workers can
+  read while one writes instead of failing with "database is locked".
+
+The pool records how long each checkout waited for a free connection, which
+shows whether workers are starved by the pool size.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+# Upper bounds (seconds) of the checkout wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def env_int(name, default):
+    return int(os.getenv(name, default))
+
+
+def env_bool(name, default):
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+class PoolWaitStats:
+    """Thread-safe counters of connection checkout wait times"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+            self.timeouts = 0
+            self.buckets = [0] * (len(WAIT_BUCKETS) + 1)
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            if timed_out:
+                self.timeouts += 1
+            for i, bound in enumerate(WAIT_BUCKETS):
+                if seconds <= bound:
+                    self.buckets[i] += 1
+                    break
+            else:
+                self.buckets[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            labels = [f"<={bound}s" for bound in WAIT_BUCKETS] + [f">{WAIT_BUCKETS[-1]}s"]
+            return {
+                "checkouts": self.count,
+                "avg_wait_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+                "max_wait_ms": round(self.max * 1000, 3),
+                "timeouts": self.timeouts,
+                "wait_histogram": dict(zip(labels, self.buckets)),
+            }
+
+
+pool_wait_stats = PoolWaitStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except Exception:
+            timed_out = True
+            raise
+        finally:
+            pool_wait_stats.record(time.perf_counter() - start, timed_out)
+
+
+def is_sqlite(database_uri):
+    return database_uri.startswith("sqlite")
+
+
+def engine_options(database_uri):
+    """
+    Returns SQLALCHEMY_ENGINE_OPTIONS for the configured database
+
+    Environment variables:
+        DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+        DB_POOL_PRE_PING: Pool settings for server databases
+        SQLITE_BUSY_TIMEOUT_MS: How long SQLite waits on a locked database
+    """
+    if is_sqlite(database_uri):
+        options = {
+            "connect_args": {
+                "timeout": env_int("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000,
+                "check_same_thread": False,
+            },
+        }
+        if ":memory:" not in database_uri and database_uri not in ("sqlite://", "sqlite:///"):
+            options.update({
+                "poolclass": TimedQueuePool,
+                "pool_size": env_int("DB_POOL_SIZE", 5),
+                "max_overflow": env_int("DB_MAX_OVERFLOW", 10),
+                "pool_timeout": env_int("DB_POOL_TIMEOUT", 30),
+            })
+        return options
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": env_int("DB_POOL_SIZE", 10),
+        "max_overflow": env_int("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": env_int("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": env_int("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": env_bool("DB_POOL_PRE_PING", True),
+    }
+
+
+def sqlite_pragmas():
+    """
+    Returns the PRAGMA statements run on every new SQLite connection
+
+    Environment variables:
+        SQLITE_JOURNAL_MODE (WAL), SQLITE_SYNCHRONOUS (NORMAL),
+        SQLITE_BUSY_TIMEOUT_MS (5000), SQLITE_MMAP_SIZE (256 MiB),
+        SQLITE_CACHE_SIZE (-16000, i.e. 16 MiB)
+    """
+    return [
+        f"PRAGMA journal_mode={os.getenv('SQLITE_JOURNAL_MODE', 'WAL')}",
+        f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+        f"PRAGMA busy_timeout={env_int('SQLITE_BUSY_TIMEOUT_MS', 5000)}",
+        f"PRAGMA mmap_size={env_int('SQLITE_MMAP_SIZE', 268435456)}",
+        f"PRAGMA cache_size={env_int('SQLITE_CACHE_SIZE', -16000)}",
+    ]
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas():
+    """Applies sqlite_pragmas() to every SQLite connection opened from now on"""
+    if not event.contains(Engine, "connect", _set_sqlite_pragmas):
+        event.listen(Engine, "connect", _set_sqlite_pragmas)
+
+
+def pool_status(engine):
+    """Returns current pool occupancy plus the checkout wait statistics"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    status.update(pool_wait_stats.snapshot())
+    return status
@@ -0,0 +1,211 @@
+"""
+services/exports.py - Streaming CSV/NDJSON exports for accounting
+
+Dumps orders, order items, payments and order status history in constant
+memory, however many rows match: rows are read with yield_per batches
+(a server-side cursor on PostgreSQL and MySQL; SQLite steps its cursor
+lazily anyway) and every batch is formatted into one text chunk before the
+next is fetched. The same generator backs the CLI and the HTTP endpoint:
+
+    flask --app app export payments --from 2025-01-01 --to 2025-01-31 --gzip -o payments.csv.gz
+
+Rows are filtered by creation day (UTC, through the created_at indexes) and
+status, and come out in (created_at, id) order. Amounts are written as
+exact decimal strings in both formats.
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import select
+
+from models import db
+from models.order import Order, OrderItem, OrderStatusHistory
+from models.payment import Payment
+from services.sql import as_datetime
+
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Rows fetched and formatted per chunk
+DEFAULT_BATCH_SIZE = 1000
+
+
+class ExportError(ValueError):
+    """Raised for an unknown dataset or format, or an invalid date range"""
+
+
+class Dataset:
+    """
+    One exportable table
+
+    Args:
+        columns (list): Columns written, in order
+        created_at: Timestamp column the date range applies to
+        status: Status column the status filter applies to
+        order_by (list): Sort order, matching an index that starts with created_at
+        joins (list): (model, on clause) pairs needed by the filters
+    """
+
+    def __init__(self, columns, created_at, status, order_by, joins=()):
+        self.columns = columns
+        self.created_at = created_at
+        self.status = status
+        self.order_by = order_by
+        self.joins = joins
+
+
+DATASETS = {
+    "orders": Dataset(
+        [Order.id, Order.user_id, Order.total_amount, Order.status, Order.payment_status, Order.payment_method,
+         Order.mpesa_transaction_id, Order.customer_phone, Order.delivery_address, Order.created_at,
+         Order.updated_at],
+        Order.created_at, Order.status, [Order.created_at, Order.id],
+    ),
+    # Filtered by their order's creation time and status
+    "order_items": Dataset(
+        [OrderItem.id, OrderItem.order_id, OrderItem.menu_item_id, OrderItem.quantity, OrderItem.unit_price,
+         OrderItem.subtotal],
+        Order.created_at, Order.status, [Order.created_at, Order.id, OrderItem.id],
+        joins=[(Order, Order.id == OrderItem.order_id)],
+    ),
+    "payments": Dataset(
+        [Payment.id, Payment.order_id, Payment.amount, Payment.payment_method, Payment.transaction_id,
+         Payment.phone_number, Payment.status, Payment.mpesa_receipt_number, Payment.error_message,
+         Payment.created_at, Payment.updated_at],
+        Payment.created_at, Payment.status, [Payment.created_at, Payment.id],
+    ),
+    "order_status_history": Dataset(
+        [OrderStatusHistory.id, OrderStatusHistory.order_id, OrderStatusHistory.old_status,
+         OrderStatusHistory.new_status, OrderStatusHistory.created_at],
+        OrderStatusHistory.created_at, OrderStatusHistory.new_status,
+        [OrderStatusHistory.created_at, OrderStatusHistory.id],
+    ),
+}
+
+
+def day_bounds(start, end):
+    """
+    Returns:
+        tuple: (lower, upper) datetimes of the days start..end inclusive;
+            either is None when its day is not given
+    """
+    lower = datetime.combine(start, time.min) if start else None
+    upper = datetime.combine(end + timedelta(days=1), time.min) if end else None
+    return lower, upper
+
+
+def export_query(dataset, start=None, end=None, statuses=None):
+    """
+    Builds the statement for a dataset
+
+    The last selected column is the row's timestamp, used to apply the date
+    range exactly: SQLite compares stored timestamps as text, and
+    "... 00:00:00" sorts before "... 00:00:00.000000", so the SQL range is
+    widened by a second on each side.
+
+    Args:
+        dataset (str): Key of DATASETS
+        start (date): First day, inclusive
+        end (date): Last day, inclusive
+        statuses (list): Statuses to include; all when empty
+    """
+    spec = DATASETS[dataset]
+    stmt = select(*spec.columns, spec.created_at)
+    for model, on in spec.joins:
+        stmt = stmt.join(model, on)
+    lower, upper = day_bounds(start, end)
+    if lower is not None:
+        stmt = stmt.where(spec.created_at >= lower - timedelta(seconds=1))
+    if upper is not None:
+        stmt = stmt.where(spec.created_at < upper + timedelta(seconds=1))
+    if statuses:
+        stmt = stmt.where(spec.status.in_(statuses))
+    return stmt.order_by(*spec.order_by)
+
+
+def plain(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export(dataset, fmt="csv", start=None, end=None, statuses=None, batch_size=DEFAULT_BATCH_SIZE,
+           on_batch=None):
+    """
+    Streams a dataset as text chunks, one per batch of rows
+
+    Arguments are checked straight away, so a bad request fails before any
+    output is produced.
+
+    Args:
+        dataset (str): orders, order_items, payments or order_status_history
+        fmt (str): csv (with a header row) or ndjson
+        start (date): First creation day, inclusive
+        end (date): Last creation day, inclusive
+        statuses (list): Statuses to include; all when empty
+        batch_size (int): Rows fetched per round trip and per chunk
+        on_batch (callable): Called with the number of rows in each chunk
+
+    Returns:
+        generator: str chunks
+
+    Raises:
+        ExportError: For an unknown dataset or format, or start after end
+    """
+    if dataset not in DATASETS:
+        raise ExportError(f"dataset must be one of {', '.join(DATASETS)}")
+    if fmt not in FORMATS:
+        raise ExportError(f"format must be one of {', '.join(FORMATS)}")
+    if start and end and start > end:
+        raise ExportError("from must not be after to")
+    if batch_size < 1:
+        raise ExportError("batch_size must be positive")
+    return _chunks(dataset, fmt, start, end, statuses, batch_size, on_batch)
+
+
+def _chunks(dataset, fmt, start, end, statuses, batch_size, on_batch):
+    header = [column.key for column in DATASETS[dataset].columns]
+    lower, upper = day_bounds(start, end)
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        yield buffer.getvalue()
+
+    result = db.session.execute(export_query(dataset, start, end, statuses).execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if fmt == "csv" else None
+        written = 0
+        for row in rows:
+            created_at = row[-1]
+            if created_at is not None:
+                created_at = as_datetime(created_at)
+                if (lower is not None and created_at < lower) or (upper is not None and created_at >= upper):
+                    continue
+            values = [plain(value) for value in row[:-1]]
+            if writer is not None:
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(header, values))) + "\n")
+            written += 1
+        if on_batch is not None:
+            on_batch(written)
+        if written:
+            yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresses a stream of str chunks into gzip bytes, incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
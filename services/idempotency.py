@@ -0,0 +1,198 @@
+"""
+services/idempotency.py - Idempotency-Key support for endpoints with side effects
+
+A client that may resend a request (double-click, mobile retry) sends the
+same Idempotency-Key header with each copy. The first copy claims the key by
+inserting an idempotency_keys row and runs; its response is stored on the
+row. Later copies with the same key get the stored response replayed, with
+an Idempotent-Replayed header, instead of creating another order or STK
+push. Keys are scoped to the user and endpoint and expire after
+IDEMPOTENCY_TTL seconds.
+
+- Same key, different body: 422, the key was reused by mistake
+- Same key while the first copy is still running: 409 with Retry-After
+- A claim older than IDEMPOTENCY_LOCK_TIMEOUT seconds that never finished
+  (the worker died) is taken over by the next copy
+- 5xx responses are not stored, so a retry runs again
+"""
+
+import functools
+import hashlib
+import time
+from datetime import timedelta
+
+from flask import current_app, jsonify, make_response, request, session
+
+from models import db
+from models.idempotency import IdempotencyKey
+from services.sql import insert_ignore, utcnow
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+# Inserts tried before giving up when other requests keep taking the key
+CLAIM_ATTEMPTS = 3
+
+# Expired keys are deleted at most once per interval per worker
+PURGE_INTERVAL = 60
+_last_purge = 0.0
+
+
+def request_fingerprint():
+    """Hash of the method, path and body, to detect a key reused for another request"""
+    digest = hashlib.sha256()
+    digest.update(f"{request.method} {request.path}\n".encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def purge_expired():
+    """
+    Deletes expired keys and commits
+
+    Returns:
+        int: Number of keys deleted
+    """
+    deleted = db.session.query(IdempotencyKey).filter(
+        IdempotencyKey.expires_at < utcnow()
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def _maybe_purge():
+    global _last_purge
+    now = time.monotonic()
+    if now - _last_purge >= PURGE_INTERVAL:
+        _last_purge = now
+        purge_expired()
+
+
+def _claim(user_id, endpoint, key, fingerprint):
+    """
+    Inserts the key's row if nobody holds it
+
+    Returns:
+        bool: True if this request claimed the key
+    """
+    now = utcnow()
+    inserted = insert_ignore(
+        IdempotencyKey,
+        {
+            "user_id": user_id,
+            "endpoint": endpoint,
+            "key": key,
+            "request_hash": fingerprint,
+            "status": "in_progress",
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=current_app.config["IDEMPOTENCY_TTL"]),
+        },
+        ["user_id", "endpoint", "key"],
+    )
+    db.session.commit()
+    return inserted > 0
+
+
+def _release(user_id, endpoint, key, row_id=None):
+    """Deletes a claim so the key can be used again"""
+    query = db.session.query(IdempotencyKey).filter_by(user_id=user_id, endpoint=endpoint, key=key)
+    if row_id is not None:
+        query = query.filter(IdempotencyKey.id == row_id)
+    query.delete(synchronize_session=False)
+    db.session.commit()
+
+
+def _existing_response(row, fingerprint):
+    """
+    Returns the response for a request whose key is already claimed, or
+    None if the claim is stale and may be taken over
+    """
+    if row.request_hash != fingerprint:
+        return jsonify({
+            "success": False,
+            "error": f"{HEADER} was already used for a different request",
+        }), 422
+
+    if row.status == "completed":
+        response = current_app.response_class(
+            row.response_body, status=row.response_status, mimetype="application/json"
+        )
+        response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+    lock_timeout = current_app.config["IDEMPOTENCY_LOCK_TIMEOUT"]
+    if row.created_at and row.created_at < utcnow() - timedelta(seconds=lock_timeout):
+        return None
+
+    response = jsonify({
+        "success": False,
+        "error": "A request with this Idempotency-Key is still being processed",
+    })
+    response.headers["Retry-After"] = "1"
+    return response, 409
+
+
+def idempotent(endpoint):
+    """
+    Makes a view honour the Idempotency-Key header
+
+    Requests without the header run as before.
+
+    Args:
+        endpoint (str): Name the keys are scoped to, e.g. "create_order"
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            user_id = session.get("user_id")
+            if not key or user_id is None:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({"success": False, "error": f"{HEADER} is too long"}), 400
+
+            _maybe_purge()
+            fingerprint = request_fingerprint()
+            for _ in range(CLAIM_ATTEMPTS):
+                if _claim(user_id, endpoint, key, fingerprint):
+                    break
+                row = IdempotencyKey.query.filter_by(user_id=user_id, endpoint=endpoint, key=key).first()
+                if row is None:
+                    # Released between our insert and this read
+                    continue
+                if row.expires_at >= utcnow():
+                    existing = _existing_response(row, fingerprint)
+                    if existing is not None:
+                        db.session.commit()
+                        return existing
+                # Expired, or the request that claimed it died; take it over
+                _release(user_id, endpoint, key, row.id)
+            else:
+                return jsonify({"success": False, "error": f"Could not claim the {HEADER}"}), 409
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except Exception:
+                db.session.rollback()
+                _release(user_id, endpoint, key)
+                raise
+
+            if response.status_code >= 500 or response.is_streamed:
+                db.session.rollback()
+                _release(user_id, endpoint, key)
+                return response
+
+            db.session.query(IdempotencyKey).filter_by(
+                user_id=user_id, endpoint=endpoint, key=key
+            ).update(
+                {
+                    "status": "completed",
+                    "response_status": response.status_code,
+                    "response_body": response.get_data(as_text=True),
+                },
+                synchronize_session=False,
+            )
+            db.session.commit()
+            return response
+        return wrapper
+    return decorator
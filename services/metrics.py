@@ -0,0 +1,270 @@
+"""
+services/metrics.py - Prometheus metrics shared across gunicorn workers
+
+Each worker records into an in-process Registry; an update is a dict lookup
+and a few additions under an uncontended lock, i.e. a few microseconds. A
+background thread writes the registry to METRICS_DIR/worker-<pid>-<nonce>.json
+every flush interval (atomically, via a temporary file), and /metrics merges
+every worker's file on scrape, so whichever worker answers reports the totals.
+
+Files of workers that have exited are kept, so counters never go backwards
+while gunicorn recycles workers; the nonce, drawn when a process first
+flushes, keeps a new worker that reuses a dead worker's pid from
+overwriting its file. Empty METRICS_DIR on each deploy.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+
+from flask import g, request
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+CALLBACK_LAG_BUCKETS = (1, 2.5, 5, 10, 15, 20, 30, 45, 60, 120, 300)
+
+HISTOGRAMS = {
+    "http_request_duration_seconds": ("Request latency by endpoint", LATENCY_BUCKETS),
+    "http_request_sql_seconds": ("Time spent in SQL per request", SQL_BUCKETS),
+    "mpesa_request_duration_seconds": ("Daraja call latency by operation", LATENCY_BUCKETS),
+    "mpesa_callback_lag_seconds": ("Time from STK push to its callback arriving", CALLBACK_LAG_BUCKETS),
+    "mpesa_callback_processing_delay_seconds": ("Time from callback arrival to being applied", LATENCY_BUCKETS),
+}
+
+COUNTERS = {
+    "http_requests_total": "Requests by endpoint, method and status code",
+    "http_request_sql_statements_total": "SQL statements run by endpoint",
+    "mpesa_requests_total": "Daraja calls by operation and outcome",
+    "mpesa_breaker_events_total": "Daraja circuit breaker transitions and refused calls by operation",
+}
+
+
+class Registry:
+    """In-process counters and histograms, keyed by (name, labels)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        bounds = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [[0] * (len(bounds) + 1), 0.0, 0]
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    hist[0][i] += 1
+                    break
+            else:
+                hist[0][-1] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def dump(self):
+        with self._lock:
+            return {
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+                "histograms": [
+                    [n, list(l), list(h[0]), h[1], h[2]] for (n, l), h in self.histograms.items()
+                ],
+            }
+
+
+registry = Registry()
+
+
+def labels(**values):
+    """Label set in a hashable, stable order"""
+    return tuple(sorted((k, str(v)) for k, v in values.items()))
+
+
+def observe_mpesa(operation, seconds, outcome):
+    """
+    Records one Daraja call
+
+    Args:
+        operation (str): "token", "stkpush" or "stkquery"
+        seconds (float): Wall time including retries
+        outcome (str): HTTP status code, or the exception name
+    """
+    registry.observe("mpesa_request_duration_seconds", labels(operation=operation), seconds)
+    registry.inc("mpesa_requests_total", labels(operation=operation, outcome=outcome))
+
+
+def observe_callback(lag_seconds=None, delay_seconds=None):
+    if lag_seconds is not None:
+        registry.observe("mpesa_callback_lag_seconds", (), max(lag_seconds, 0.0))
+    if delay_seconds is not None:
+        registry.observe("mpesa_callback_processing_delay_seconds", (), max(delay_seconds, 0.0))
+
+
+def observe_breaker(operation, event):
+    """Counts a circuit breaker event ("opened", "half_open", "closed" or "rejected")"""
+    registry.inc("mpesa_breaker_events_total", labels(operation=operation, event=event))
+
+
+class MetricsExporter:
+    """
+    Flushes this worker's registry to the shared directory
+
+    Args:
+        directory (str): Directory shared by all workers
+        flush_interval (float): Seconds between flushes
+    """
+
+    def __init__(self, directory, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+
+    def path(self):
+        """Returns this process's file, named afresh after a fork"""
+        pid = os.getpid()
+        with self._lock:
+            if self._file is None or self._file[0] != pid:
+                self._file = (pid, os.path.join(self.directory, f"worker-{pid}-{uuid.uuid4().hex[:12]}.json"))
+            return self._file[1]
+
+    def start(self):
+        """Starts the flush thread once per process (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            threading.Thread(target=self._run, name="metrics-flush", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def flush(self):
+        path = self.path()
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(registry.dump(), f)
+        os.replace(tmp, path)
+
+    def collect(self):
+        """
+        Merges the files of every worker, this one flushed first
+
+        Returns:
+            tuple: (counters, histograms) dicts keyed by (name, labels)
+        """
+        self.flush()
+        counters, histograms = {}, {}
+        for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for name, label_pairs, value in data["counters"]:
+                key = (name, tuple(tuple(p) for p in label_pairs))
+                counters[key] = counters.get(key, 0) + value
+            for name, label_pairs, buckets, total, count in data["histograms"]:
+                if name not in HISTOGRAMS:
+                    continue
+                key = (name, tuple(tuple(p) for p in label_pairs))
+                merged = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+                if len(merged[0]) != len(buckets):
+                    continue
+                merged[0] = [a + b for a, b in zip(merged[0], buckets)]
+                merged[1] += total
+                merged[2] += count
+        return counters, histograms
+
+    def render(self):
+        """Returns the merged metrics in Prometheus text format"""
+        counters, histograms = self.collect()
+        lines = []
+
+        for name, help_text in COUNTERS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (metric, label_set), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(label_set)} {value}")
+
+        for name, (help_text, bounds) in HISTOGRAMS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, label_set), (buckets, total, count) in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip((*bounds, "+Inf"), buckets):
+                    cumulative += bucket
+                    le = format_labels(label_set + (("le", str(bound)),))
+                    lines.append(f"{name}_bucket{le} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(label_set)} {total}")
+                lines.append(f"{name}_count{format_labels(label_set)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(label_set):
+    if not label_set:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in label_set
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def init_metrics(app):
+    """Times every request of the app into the shared registry"""
+    exporter = MetricsExporter(app.config["METRICS_DIR"], app.config["METRICS_FLUSH_INTERVAL"])
+    app.extensions["metrics"] = exporter
+
+    @app.before_request
+    def start_request_timer():
+        exporter.start()
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get("request_started")
+        if started is None:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        registry.observe(
+            "http_request_duration_seconds",
+            labels(endpoint=endpoint, method=request.method),
+            time.perf_counter() - started,
+        )
+        registry.inc(
+            "http_requests_total",
+            labels(endpoint=endpoint, method=request.method, status=response.status_code),
+        )
+        collector = g.get("query_collector")
+        if collector is not None:
+            registry.observe(
+                "http_request_sql_seconds", labels(endpoint=endpoint), collector.total_time
+            )
+            registry.inc(
+                "http_request_sql_statements_total", labels(endpoint=endpoint), collector.count
+            )
+        return response
@@ -0,0 +1,336 @@
+"""
+services/mpesa_client.py - Pooled HTTP client for the Daraja (M-Pesa) API
+
+All outbound calls to Safaricom go through one requests.Session per worker
+process, so TCP/TLS connections are kept alive and reused between requests
+instead of being set up for every STK push and status query.
+
+Each operation has its own (connect, read) timeout. Idempotent operations
+(token and STK query) are retried with jittered exponential backoff; STK
+push is only retried when the connection could not be established, since a
+request that reached Safaricom may already have prompted the customer.
+
+Each operation also has a circuit breaker (services/circuit_breaker.py), and
+calls made inside time_budget() share one deadline: timeouts are cut to
+the time left and retries stop when it runs out. Both surface as
+MpesaUnavailable, which endpoints answer with a retryable 503.
+
+requests is imported on first use, so workers that never talk to Daraja do
+not pay for loading it; its errors surface as MpesaRequestError.
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.metrics import observe_breaker, observe_mpesa
+
+# Operations that are safe to resend after a timeout or 5xx response
+IDEMPOTENT_OPERATIONS = {"token", "stkquery"}
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# STK query answers HTTP 500 with this code while the customer has not responded
+STK_PENDING_ERROR_CODE = "500.001.1001"
+
+
+# Monotonic deadline shared by every Daraja call in the current request
+_deadline = ContextVar("mpesa_deadline", default=None)
+
+
+class MpesaRequestError(Exception):
+    """Raised when a Daraja call failed at the HTTP level"""
+
+
+class MpesaUnavailable(MpesaRequestError):
+    """
+    Raised without calling Daraja: its breaker is open or the time budget ran out
+
+    Attributes:
+        retry_after (float): Seconds the caller should wait before retrying
+    """
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@contextmanager
+def time_budget(seconds):
+    """
+    Limits all Daraja calls made inside the block to `seconds` in total
+
+    A nested budget can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget():
+    """Seconds left in the current time budget, or None without one"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_server_failure(response):
+    """True for 429/5xx answers, except STK query's "still being processed" 500"""
+    if response.status_code not in RETRY_STATUS_CODES:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return not (isinstance(body, dict) and body.get("errorCode") == STK_PENDING_ERROR_CODE)
+
+
+def parse_timeout(value, default):
+    """
+    Parses a "connect,read" timeout setting
+
+    Args:
+        value (str|tuple|None): e.g. "3.05,10" or (3.05, 10)
+        default (tuple): Used when value is empty
+
+    Returns:
+        tuple: (connect_timeout, read_timeout) in seconds
+    """
+    if not value:
+        return default
+    if isinstance(value, (tuple, list)):
+        return float(value[0]), float(value[1])
+    parts = [float(p) for p in str(value).split(",")]
+    return (parts[0], parts[-1])
+
+
+class MpesaClient:
+    """
+    Shared Daraja API client
+
+    Args:
+        base_url (str): e.g. https://sandbox.safaricom.co.ke
+        timeouts (dict): operation -> (connect, read) timeout
+        pool_connections (int): Number of host pools kept by the adapter
+        pool_maxsize (int): Connections kept alive per host
+        max_retries (int): Extra attempts for retryable failures
+        backoff (float): Base backoff in seconds (doubled per attempt)
+        breakers (dict): operation -> CircuitBreaker
+    """
+
+    def __init__(self, base_url, timeouts, pool_connections=4, pool_maxsize=10,
+                 max_retries=2, backoff=0.2, breakers=None):
+        self.base_url = base_url.rstrip("/")
+        self.timeouts = timeouts
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breakers = breakers or {}
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        """Returns this process's session, rebuilding it after a fork"""
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._build_session()
+                    self._pid = pid
+        return self._session
+
+    def _build_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=0,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({"Content-Type": "application/json"})
+        return session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+    def url(self, path):
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def request(self, operation, method, path, **kwargs):
+        """
+        Sends a request for the given Daraja operation
+
+        Args:
+            operation (str): "token", "stkpush" or "stkquery"
+            method (str): HTTP method
+            path (str): Path relative to the base URL
+
+        Returns:
+            requests.Response
+
+        Raises:
+            MpesaUnavailable: When the breaker is open or the budget ran out
+            MpesaRequestError: When all attempts failed
+        """
+        import requests
+
+        kwargs.setdefault("timeout", self.timeouts.get(operation, (3.05, 30)))
+        breaker = self.breakers.get(operation)
+        if breaker is not None:
+            try:
+                breaker.before_call()
+            except CircuitOpenError as e:
+                raise MpesaUnavailable(str(e), e.retry_after) from e
+
+        started = time.perf_counter()
+        try:
+            response = self._send(operation, method, path, **kwargs)
+        except MpesaUnavailable:
+            if breaker is not None:
+                breaker.abandon()
+            raise
+        except requests.exceptions.RequestException as e:
+            elapsed = time.perf_counter() - started
+            observe_mpesa(operation, elapsed, type(e).__name__)
+            if breaker is not None:
+                breaker.record(True, elapsed)
+            remaining = remaining_budget()
+            if isinstance(e, requests.exceptions.Timeout) and remaining is not None and remaining < 0.05:
+                # Timed out because the budget cut the timeout short
+                raise MpesaUnavailable(f"{operation} request exceeded the time budget") from e
+            raise MpesaRequestError(f"{operation} request failed: {e}") from e
+        elapsed = time.perf_counter() - started
+        observe_mpesa(operation, elapsed, response.status_code)
+        if breaker is not None:
+            breaker.record(is_server_failure(response), elapsed)
+        return response
+
+    def check_available(self, operation):
+        """
+        Raises MpesaUnavailable if the operation's breaker would refuse a call
+        """
+        breaker = self.breakers.get(operation)
+        if breaker is None:
+            return
+        try:
+            breaker.check()
+        except CircuitOpenError as e:
+            raise MpesaUnavailable(str(e), e.retry_after) from e
+
+    def breaker_stats(self):
+        """Returns each operation's breaker state and counters"""
+        return {operation: breaker.stats() for operation, breaker in self.breakers.items()}
+
+    def _send(self, operation, method, path, **kwargs):
+        import requests
+
+        idempotent = operation in IDEMPOTENT_OPERATIONS
+        url = self.url(path)
+        timeout = kwargs.pop("timeout")
+
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(
+                    method, url, timeout=self._budgeted(operation, timeout), **kwargs
+                )
+            except requests.exceptions.ConnectTimeout:
+                # Nothing reached Safaricom, so any operation can be retried
+                if attempt >= self.max_retries or not self._can_retry(attempt):
+                    raise
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if not idempotent or attempt >= self.max_retries or not self._can_retry(attempt):
+                    raise
+            else:
+                if (idempotent and is_server_failure(response)
+                        and attempt < self.max_retries and self._can_retry(attempt)):
+                    response.close()
+                else:
+                    return response
+
+            attempt += 1
+            self._sleep(attempt)
+
+    def _budgeted(self, operation, timeout):
+        """Cuts a (connect, read) timeout to the time left in the budget"""
+        remaining = remaining_budget()
+        if remaining is None:
+            return timeout
+        if remaining <= 0:
+            raise MpesaUnavailable(f"{operation} request skipped: time budget exhausted")
+        return (min(timeout[0], remaining), min(timeout[1], remaining))
+
+    def _can_retry(self, attempt):
+        # Not worth retrying if the backoff alone would use up the budget
+        remaining = remaining_budget()
+        return remaining is None or remaining > self.backoff * (2 ** attempt)
+
+    def _sleep(self, attempt):
+        # Full jitter: spreads retries from many workers over the window
+        time.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+
+    # ------------------------------------------------------------------
+    # Daraja operations
+    # ------------------------------------------------------------------
+
+    def generate_token(self, path, consumer_key, consumer_secret):
+        return self.request("token", "GET", path, auth=(consumer_key, consumer_secret))
+
+    def stk_push(self, path, access_token, payload):
+        return self.request(
+            "stkpush", "POST", path, json=payload,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+
+    def stk_query(self, path, access_token, payload):
+        return self.request(
+            "stkquery", "POST", path, json=payload,
+            headers={"Authorization": f"Bearer {access_token}"},
+        )
+
+
+def client_from_config(config):
+    """Builds an MpesaClient from the app's MPESA_* settings"""
+    return MpesaClient(
+        config["MPESA_BASE_URL"],
+        timeouts={
+            "token": parse_timeout(config.get("MPESA_TIMEOUT_TOKEN"), (3.05, 10)),
+            "stkpush": parse_timeout(config.get("MPESA_TIMEOUT_STKPUSH"), (3.05, 15)),
+            "stkquery": parse_timeout(config.get("MPESA_TIMEOUT_STKQUERY"), (3.05, 10)),
+        },
+        pool_connections=config.get("MPESA_POOL_CONNECTIONS", 4),
+        pool_maxsize=config.get("MPESA_POOL_MAXSIZE", 10),
+        max_retries=config.get("MPESA_MAX_RETRIES", 2),
+        backoff=config.get("MPESA_RETRY_BACKOFF", 0.2),
+        breakers={
+            operation: CircuitBreaker(
+                operation,
+                window=config.get("MPESA_BREAKER_WINDOW", 20),
+                min_calls=config.get("MPESA_BREAKER_MIN_CALLS", 10),
+                failure_rate=config.get("MPESA_BREAKER_FAILURE_RATE", 0.5),
+                slow_call_seconds=config.get("MPESA_BREAKER_SLOW_CALL", 5.0),
+                slow_call_rate=config.get("MPESA_BREAKER_SLOW_RATE", 0.5),
+                open_seconds=config.get("MPESA_BREAKER_OPEN_SECONDS", 30.0),
+                on_event=observe_breaker,
+            )
+            for operation in ("token", "stkpush", "stkquery")
+        },
+    )
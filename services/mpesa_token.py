@@ -0,0 +1,217 @@
+"""
+services/mpesa_token.py - Cached M-Pesa OAuth token manager
+
+Safaricom access tokens are valid for an hour (``expires_in`` seconds), so
+fetching a new one for every STK push or status query is wasted work. The
+TokenManager keeps the token in memory until shortly before it expires:
+
+- Concurrent callers that find the cache empty share a single refresh
+  (single-flight) instead of each calling /oauth/v1/generate.
+- Once the token enters its refresh-ahead window it is still served, and a
+  background thread fetches the replacement before it actually expires.
+- An optional SQLiteTokenStore lets every gunicorn worker on the host reuse
+  one token instead of each worker holding its own.
+"""
+
+import sqlite3
+import threading
+import time
+
+
+class TokenError(Exception):
+    """Raised when a token could not be obtained from M-Pesa"""
+
+
+class SQLiteTokenStore:
+    """
+    Shares a token between processes through a small SQLite file
+
+    Args:
+        path (str): Path to the SQLite file used as the shared cache
+        key (str): Cache key, normally derived from the consumer key
+    """
+
+    def __init__(self, path, key="default"):
+        self.path = path
+        self.key = key
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mpesa_tokens ("
+                " cache_key TEXT PRIMARY KEY,"
+                " access_token TEXT NOT NULL,"
+                " expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def load(self):
+        """
+        Returns:
+            tuple: (access_token, expires_at) or None if nothing is stored
+        """
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT access_token, expires_at FROM mpesa_tokens WHERE cache_key = ?",
+                    (self.key,),
+                ).fetchone()
+        except sqlite3.Error:
+            return None
+        return (row[0], row[1]) if row else None
+
+    def save(self, access_token, expires_at):
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO mpesa_tokens (cache_key, access_token, expires_at)"
+                    " VALUES (?, ?, ?)"
+                    " ON CONFLICT(cache_key) DO UPDATE SET"
+                    " access_token = excluded.access_token,"
+                    " expires_at = excluded.expires_at",
+                    (self.key, access_token, expires_at),
+                )
+        except sqlite3.Error:
+            pass
+
+
+class TokenManager:
+    """
+    Caches an M-Pesa access token and refreshes it before it expires
+
+    Args:
+        fetcher (callable): Returns (access_token, expires_in_seconds);
+            raises TokenError on failure
+        expiry_margin (int): Seconds before expiry at which a token is
+            considered unusable
+        refresh_ahead (int): Seconds before expiry (on top of the margin)
+            at which a background refresh is started
+        store (SQLiteTokenStore): Optional cross-process token store
+    """
+
+    def __init__(self, fetcher, expiry_margin=60, refresh_ahead=300, store=None):
+        self.fetcher = fetcher
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = refresh_ahead
+        self.store = store
+
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        # Guards _refreshing only, so cache hits never wait on self._lock
+        # while a background refresh holds it through the HTTP fetch
+        self._refreshing_lock = threading.Lock()
+        self._refreshing = False
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "background_refreshes": 0,
+            "shared_hits": 0,
+            "failures": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def get_token(self):
+        """
+        Returns a valid access token, fetching one only when necessary
+
+        Returns:
+            str: Access token
+
+        Raises:
+            TokenError: If no cached token is usable and the fetch failed
+        """
+        now = time.time()
+        token, expires_at = self._token, self._expires_at
+
+        if token and now < expires_at - self.expiry_margin:
+            self._count("hits")
+            if now >= expires_at - self.expiry_margin - self.refresh_ahead:
+                self._refresh_in_background()
+            return token
+
+        self._count("misses")
+        with self._lock:
+            # Another thread may have refreshed while we were waiting
+            if self._token and time.time() < self._expires_at - self.expiry_margin:
+                return self._token
+            return self._refresh_locked()
+
+    def has_token(self):
+        """Returns True when get_token() would be served from the cache"""
+        return bool(self._token) and time.time() < self._expires_at - self.expiry_margin
+
+    def invalidate(self):
+        """Drops the cached token, e.g. after M-Pesa rejects it as expired"""
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+    def stats(self):
+        """Returns a snapshot of the cache counters"""
+        with self._stats_lock:
+            snapshot = dict(self._stats)
+        snapshot["cached"] = bool(self._token)
+        snapshot["expires_in"] = max(0, int(self._expires_at - time.time())) if self._token else 0
+        return snapshot
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _usable(self, expires_at):
+        return time.time() < expires_at - self.expiry_margin - self.refresh_ahead
+
+    def _refresh_locked(self, force=False):
+        """Fetches a new token; caller must hold self._lock"""
+        if self.store and not force:
+            shared = self.store.load()
+            if shared and self._usable(shared[1]):
+                self._token, self._expires_at = shared
+                self._count("shared_hits")
+                return self._token
+
+        try:
+            token, expires_in = self.fetcher()
+        except TokenError:
+            self._count("failures")
+            raise
+
+        self._token = token
+        self._expires_at = time.time() + int(expires_in)
+        self._count("refreshes")
+        if self.store:
+            self.store.save(self._token, self._expires_at)
+        return token
+
+    def _refresh_in_background(self):
+        with self._refreshing_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                with self._lock:
+                    # Skip if someone already replaced the token
+                    if self._usable(self._expires_at):
+                        return
+                    self._refresh_locked()
+                    self._count("background_refreshes")
+            except TokenError:
+                pass
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="mpesa-token-refresh", daemon=True).start()
@@ -0,0 +1,166 @@
+"""
+services/orders.py - Server-side order pricing and creation
+
+Orders are always priced from the menu, never from amounts sent by the
+client. Amounts are computed in Decimal and the order plus all of its items
+are written in one transaction, with the items in a single executemany
+INSERT.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from sqlalchemy import insert
+
+from models import db
+from models.menu import MenuItem
+from models.order import Order, OrderItem
+
+CENTS = Decimal("0.01")
+
+
+class OrderError(Exception):
+    """Raised when an order cannot be priced or created"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def to_money(value):
+    """Converts a price (float, str or Decimal) to a 2dp Decimal"""
+    return Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def build_price_index(menu_items):
+    """
+    Builds the price lookup used by price_lines from MenuItem rows
+
+    Returns:
+        dict: menu_item_id -> {"name", "price", "is_available"}
+    """
+    return {
+        item.id: {
+            "name": item.name,
+            "price": to_money(item.price),
+            "is_available": bool(item.is_available),
+        }
+        for item in menu_items
+    }
+
+
+def normalize_lines(items):
+    """
+    Validates requested items and merges repeated menu items
+
+    Args:
+        items (list): dicts with menu_item_id and quantity, or
+            (menu_item_id, quantity) pairs
+
+    Returns:
+        dict: menu_item_id -> quantity, in request order
+    """
+    if not items:
+        raise OrderError("Order must contain at least one item")
+
+    lines = {}
+    for item in items:
+        if isinstance(item, dict):
+            menu_item_id, quantity = item.get("menu_item_id"), item.get("quantity", 1)
+        else:
+            menu_item_id, quantity = item
+        try:
+            menu_item_id, quantity = int(menu_item_id), int(quantity)
+        except (TypeError, ValueError):
+            raise OrderError("Invalid menu_item_id or quantity")
+        if quantity < 1:
+            raise OrderError("Quantity must be at least 1")
+        lines[menu_item_id] = lines.get(menu_item_id, 0) + quantity
+    return lines
+
+
+def price_lines(lines, price_index):
+    """
+    Prices order lines from the menu
+
+    Args:
+        lines (dict): menu_item_id -> quantity
+        price_index (dict): Output of build_price_index
+
+    Returns:
+        tuple: (list of item dicts, Decimal total)
+
+    Raises:
+        OrderError: If an item does not exist or is unavailable
+    """
+    priced = []
+    total = Decimal("0.00")
+    for menu_item_id, quantity in lines.items():
+        entry = price_index.get(menu_item_id)
+        if entry is None:
+            raise OrderError(f"Menu item {menu_item_id} not found", 404)
+        if not entry["is_available"]:
+            raise OrderError(f"{entry['name']} is currently unavailable", 409)
+        subtotal = entry["price"] * quantity
+        priced.append({
+            "menu_item_id": menu_item_id,
+            "quantity": quantity,
+            "unit_price": entry["price"],
+            "subtotal": subtotal,
+        })
+        total += subtotal
+    return priced, total
+
+
+def fetch_price_index(menu_item_ids):
+    """Loads prices for the given menu items with a single IN query"""
+    rows = (
+        db.session.query(MenuItem.id, MenuItem.name, MenuItem.price, MenuItem.is_available)
+        .filter(MenuItem.id.in_(list(menu_item_ids)))
+        .all()
+    )
+    return build_price_index(rows)
+
+
+def insert_order(user_id, priced_items, total, customer_phone, delivery_address=None):
+    """
+    Adds an order and its items to the current transaction
+
+    Does not commit, so callers can include other changes (e.g. clearing
+    the cart) in the same transaction.
+
+    Returns:
+        Order: The flushed order (its id is set)
+    """
+    order = Order(
+        user_id=user_id,
+        total_amount=total,
+        customer_phone=customer_phone,
+        delivery_address=delivery_address,
+        status="pending",
+        payment_status="pending",
+    )
+    db.session.add(order)
+    db.session.flush()
+
+    insert_order_items(order.id, priced_items)
+    return order
+
+
+def insert_order_items(order_id, priced_items):
+    """Inserts all items of an order with one executemany INSERT"""
+    db.session.execute(
+        insert(OrderItem),
+        [dict(item, order_id=order_id) for item in priced_items],
+    )
+
+
+def price_order_request(items):
+    """
+    Validates and prices the items of an order request from the database
+
+    Returns:
+        tuple: (list of item dicts, Decimal total)
+    """
+    lines = normalize_lines(items)
+    return price_lines(lines, fetch_price_index(lines.keys()))
@@ -0,0 +1,228 @@
+"""
+services/passwords.py - Password hashing off the request threads
+
+Hashing a password is deliberately slow CPU work (tens of milliseconds for
+scrypt). Done inline it holds the GIL and the worker, so a burst of logins
+starves menu and payment requests served by the same worker. PasswordHasher
+runs hashes in a small process pool instead and bounds how many may be
+in flight: once max_pending are, further logins and registrations wait up
+to queue_timeout seconds for a slot and then get PasswordHasherBusy (a 503
+with Retry-After) rather than piling up behind each other.
+
+The hash method is werkzeug's method string, e.g. "scrypt:32768:8:1" or
+"pbkdf2:sha256:600000". Hashes made with other parameters still verify;
+needs_rehash() tells login to upgrade them to the current ones.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt:32768:8:1"
+
+# Hashes in flight per hashing process when max_pending is not given
+PENDING_PER_WORKER = 4
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when too many hashes are already queued, or one took too long
+
+    Attributes:
+        retry_after (float): Seconds the client should wait before retrying
+    """
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def hash_method(password_hash):
+    """Returns the method part of a werkzeug hash, e.g. "scrypt:32768:8:1" """
+    return password_hash.split("$", 1)[0] if password_hash else ""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method)
+
+
+def _verify(password_hash, password):
+    return check_password_hash(password_hash, password)
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a bounded process pool
+
+    Args:
+        method (str): werkzeug hash method for new hashes
+        workers (int): Hashing processes; 0 hashes inline on the caller's thread
+        max_pending (int): Hashes queued or running at once; defaults to
+            PENDING_PER_WORKER per hashing process
+        timeout (float): Seconds a caller waits for its hash
+        queue_timeout (float): Seconds a caller waits for one of the
+            max_pending slots before getting PasswordHasherBusy
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=1, max_pending=None, timeout=10.0, queue_timeout=2.0):
+        # Expand "pbkdf2" or "scrypt" to the full parameter string werkzeug
+        # stores, so needs_rehash compares like with like
+        self.method = hash_method(generate_password_hash("", method))
+        self.workers = workers
+        self.max_pending = max_pending or PENDING_PER_WORKER * max(1, workers)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._pending = 0
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._pool = None
+        self._pid = None
+        self._stats = {"hashed": 0, "verified": 0, "rejected": 0, "timed_out": 0}
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+
+    def hash(self, password, purpose="registration"):
+        """
+        Returns a new hash of the password with the current method
+
+        Args:
+            purpose (str): What the hash is for, named in PasswordHasherBusy
+
+        Raises:
+            PasswordHasherBusy: If the pool is saturated or the hash timed out
+        """
+        result = self._run(purpose, _hash, password, self.method)
+        self._count("hashed")
+        return result
+
+    def verify(self, password_hash, password, purpose="login"):
+        """
+        Checks a password against a stored hash of any supported method
+
+        Args:
+            purpose (str): What the check is for, named in PasswordHasherBusy
+
+        Raises:
+            PasswordHasherBusy: If the pool is saturated or the check timed out
+        """
+        result = self._run(purpose, _verify, password_hash, password)
+        self._count("verified")
+        return result
+
+    def hash_many(self, passwords):
+        """
+        Hashes a batch of passwords in parallel across the pool
+
+        Meant for bulk imports: the batch is not counted against
+        max_pending and is not subject to the timeout.
+
+        Returns:
+            list: Hashes in the order of `passwords`
+        """
+        if self.workers <= 0:
+            hashes = [_hash(password, self.method) for password in passwords]
+        else:
+            chunksize = max(1, len(passwords) // (self.workers * 4))
+            hashes = list(self._executor().map(
+                _hash, passwords, [self.method] * len(passwords), chunksize=chunksize
+            ))
+        with self._lock:
+            self._stats["hashed"] += len(hashes)
+        return hashes
+
+    def needs_rehash(self, password_hash):
+        """Whether a stored hash was made with other parameters than the current ones"""
+        return hash_method(password_hash) != self.method
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "pending": self._pending,
+                "waiting": self._waiting,
+                "max_pending": self.max_pending,
+                "workers": self.workers,
+                "method": self.method,
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pid == os.getpid():
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+
+    def _run(self, purpose, fn, *args):
+        self._acquire_slot(purpose)
+        try:
+            if self.workers <= 0:
+                return fn(*args)
+            pool = self._executor()
+            try:
+                future = pool.submit(fn, *args)
+                return future.result(timeout=self.timeout)
+            except TimeoutError:
+                future.cancel()
+                self._count("timed_out")
+                raise PasswordHasherBusy(f"The {purpose} took too long, please retry")
+            except BrokenProcessPool:
+                # A hashing process died (e.g. killed for memory); start a new pool next time
+                self._discard_pool(pool)
+                raise PasswordHasherBusy("Password hashing is restarting, please retry")
+        finally:
+            with self._slot_freed:
+                self._pending -= 1
+                self._slot_freed.notify()
+
+    def _acquire_slot(self, purpose):
+        """Waits up to queue_timeout for fewer than max_pending hashes in flight"""
+        with self._slot_freed:
+            deadline = time.monotonic() + self.queue_timeout
+            self._waiting += 1
+            try:
+                while self._pending >= self.max_pending:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["rejected"] += 1
+                        raise PasswordHasherBusy(f"Too many {purpose} requests in progress, please retry")
+                    self._slot_freed.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._pending += 1
+
+    def _executor(self):
+        """
+        Returns this process's pool, creating it on first use
+
+        Keyed by pid so a worker forked from a preloaded master starts its
+        own pool. Pool processes are spawned rather than forked so they
+        don't inherit the worker's threads and connections.
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
@@ -0,0 +1,145 @@
+"""
+services/payment_events.py - Push-style payment status notifications
+
+mpesa_callback records each STK result in the payment_events table and then
+wakes any request in the same worker that is waiting on it. Waiters in other
+workers notice the row on their next periodic check of the (indexed) table,
+so every worker sees the result without anyone calling Safaricom.
+
+Only when no result has arrived by a configurable deadline does the waiter
+fall back to querying the STK status API.
+"""
+
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from models.payment import PaymentEvent
+
+
+class PaymentNotifier:
+    """Wakes threads waiting for payment results in this worker process"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._version = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def notify(self):
+        with self._cond:
+            self._version += 1
+            self._cond.notify_all()
+
+    def wait(self, seen_version, timeout):
+        """
+        Blocks until a notification newer than seen_version or timeout
+
+        Returns:
+            int: The latest notification version
+        """
+        with self._cond:
+            if self._version == seen_version:
+                self._cond.wait(timeout)
+            return self._version
+
+
+notifier = PaymentNotifier()
+
+
+def get_payment_result(checkout_request_id):
+    """
+    Returns the recorded result for a checkout request, or None
+
+    Reads straight from the database so results committed by other
+    workers are visible.
+    """
+    event = PaymentEvent.query.filter_by(checkout_request_id=checkout_request_id).first()
+    result = event.to_dict() if event else None
+    # Release the connection while the caller waits
+    db.session.close()
+    return result
+
+
+def publish_payment_result(checkout_request_id, result_code, result_desc=None,
+                           receipt_number=None, source="callback"):
+    """
+    Records an STK push result and wakes local waiters
+
+    Commits on its own so it can be called after the caller's transaction.
+    A result that is already recorded is updated, except that a callback
+    result is never replaced by one obtained from a status query.
+    """
+    event = PaymentEvent(
+        checkout_request_id=checkout_request_id,
+        result_code=int(result_code),
+        result_desc=result_desc,
+        mpesa_receipt_number=receipt_number,
+        source=source,
+    )
+    try:
+        db.session.add(event)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        existing = PaymentEvent.query.filter_by(checkout_request_id=checkout_request_id).first()
+        if existing and not (existing.source == "callback" and source != "callback"):
+            existing.result_code = int(result_code)
+            existing.result_desc = result_desc
+            existing.mpesa_receipt_number = receipt_number or existing.mpesa_receipt_number
+            existing.source = source
+            db.session.commit()
+
+    notifier.notify()
+
+
+def watch_payment(checkout_request_id, timeout, poll_interval=1.0, heartbeat=15.0,
+                  fallback=None, fallback_at=None, fallback_interval=10.0):
+    """
+    Waits for the result of an STK push
+
+    Yields None as a heartbeat while waiting and the result dict once it is
+    known, then stops. Stops without a result when the timeout expires.
+
+    Args:
+        checkout_request_id (str): CheckoutRequestID returned by STK push
+        timeout (float): Maximum seconds to wait
+        poll_interval (float): Seconds between database checks, which pick
+            up results recorded by other workers
+        heartbeat (float): Seconds between heartbeat yields
+        fallback (callable): Returns a result dict or None; used once the
+            callback is overdue
+        fallback_at (float): Epoch time after which fallback may be called
+        fallback_interval (float): Minimum seconds between fallback calls
+    """
+    deadline = time.time() + timeout
+    next_heartbeat = time.time() + heartbeat
+    next_fallback = fallback_at
+    version = notifier.version
+
+    while True:
+        result = get_payment_result(checkout_request_id)
+        if result:
+            yield result
+            return
+
+        now = time.time()
+        if fallback and next_fallback is not None and now >= next_fallback:
+            next_fallback = now + fallback_interval
+            result = fallback()
+            if result:
+                yield result
+                return
+
+        now = time.time()
+        if now >= deadline:
+            return
+        if now >= next_heartbeat:
+            next_heartbeat = now + heartbeat
+            yield None
+
+        version = notifier.wait(version, min(poll_interval, deadline - now))
@@ -0,0 +1,43 @@
+"""
+services/phone_numbers.py - Kenyan phone number normalization
+
+Phone numbers are stored, looked up and sent to M-Pesa in the canonical
+254XXXXXXXXX form, so "0712 345 678", "+254712345678" and "712345678" are
+the same account and hit the same row of the users.contacts unique index.
+"""
+
+import re
+
+CANONICAL_PHONE = re.compile(r"254[17]\d{8}")
+
+
+def format_phone_number(phone_number):
+    """
+    Formats phone numbers to M-Pesa compatible format (254XXXXXXXXX)
+    
+    Args:
+        phone_number (str): Raw phone number input
+        
+    Returns:
+        str: Formatted phone number
+    """
+    # Remove any non-digit characters
+    phone_number = "".join(filter(str.isdigit, phone_number))
+    
+    # Handle different input formats:
+    if phone_number.startswith("254") and len(phone_number) == 12:
+        return phone_number  # Already correct format (also "+254...", whose "+" was stripped)
+    elif phone_number.startswith("0") and len(phone_number) == 10:
+        # Convert 07... or 01... to 2547... or 2541...
+        return "254" + phone_number[1:]
+    elif phone_number.startswith(("7", "1")) and len(phone_number) == 9:
+        # Convert 7... or 1... to 2547... or 2541...
+        return "254" + phone_number
+    
+    # If none of the above, return as is (will fail validation)
+    return phone_number
+
+
+def is_valid_phone_number(phone_number):
+    """Whether a formatted number is a canonical Safaricom/Airtel mobile number"""
+    return bool(CANONICAL_PHONE.fullmatch(phone_number))
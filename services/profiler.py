@@ -0,0 +1,225 @@
+"""
+services/profiler.py - On-demand stack-sampling profiler for live workers
+
+A profiled request gets a sampler thread that records the request thread's
+Python stack every PROFILE_INTERVAL seconds (wall clock, so time blocked on
+Daraja or the database shows up too). When the request ends the samples are
+written to PROFILE_DIR in collapsed-stack format, the input of flamegraph.pl
+and speedscope, and the oldest files beyond PROFILE_KEEP are deleted.
+While the request holds the GIL the sampler only runs every
+sys.getswitchinterval() (5 ms), so very short requests may record nothing.
+
+A request is profiled when it carries "X-Profile: <PROFILER_TOKEN>" (or
+?__profile=<PROFILER_TOKEN>), or at random with PROFILE_SAMPLE_RATE. With
+no token and a zero rate the hooks are not registered at all. Requests that
+recorded no samples are not stored.
+
+Under the gevent worker class every request shares one OS thread, so there
+is no per-request stack to sample: the profiler stays off and logs a warning.
+"""
+
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+PROFILE_NAME = re.compile(r"^[\w.-]+\.collapsed$")
+# Names written by ProfileStore.save: started_ms-pid-METHOD-endpoint-durationms
+PROFILE_FIELDS = re.compile(
+    r"^(?P<started>\d+)-(?P<pid>\d+)-(?P<method>[A-Z]+)-(?P<endpoint>[\w.-]+)-(?P<duration>\d+)ms\.collapsed$"
+)
+
+
+class StackSampler:
+    """
+    Samples one thread's stack from a background thread
+
+    Args:
+        thread_id (int): threading.get_ident() of the thread to sample
+        interval (float): Seconds between samples
+    """
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+                    .replace(";", ":")
+                )
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """
+    Rotating directory of collapsed-stack profiles
+
+    Args:
+        directory (str): Where profiles are written
+        keep (int): Number of most recent profiles kept
+    """
+
+    def __init__(self, directory, keep=50):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, method, endpoint, duration, collapsed):
+        """Writes one profile and returns its file name"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = "{}-{}-{}-{}-{}ms.collapsed".format(
+            int(time.time() * 1000), os.getpid(), method,
+            _SLUG.sub("_", endpoint).strip("_") or "root", int(duration * 1000),
+        )
+        tmp = os.path.join(self.directory, f".{name}.tmp")
+        with open(tmp, "w") as f:
+            f.write(collapsed)
+        os.replace(tmp, os.path.join(self.directory, name))
+        self.rotate()
+        return name
+
+    def rotate(self):
+        for name in [p["name"] for p in self.list()][self.keep:]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def list(self):
+        """
+        Other files in the directory, including *.collapsed files not named
+        by save(), are skipped.
+
+        Returns:
+            list[dict]: Stored profiles, newest first
+        """
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        profiles = []
+        for name in names:
+            match = PROFILE_FIELDS.match(name)
+            if not match:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            profiles.append({
+                "name": name,
+                "started_at": int(match["started"]) / 1000,
+                "pid": int(match["pid"]),
+                "method": match["method"],
+                "endpoint": match["endpoint"],
+                "duration_ms": int(match["duration"]),
+                "size": size,
+            })
+        return sorted(profiles, key=lambda p: p["started_at"], reverse=True)
+
+    def path(self, name):
+        """Returns the path of a stored profile, or None for unknown names"""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+def token_matches(supplied, expected):
+    return bool(expected) and bool(supplied) and hmac.compare_digest(supplied, expected)
+
+
+def gevent_patched():
+    """True when gevent has monkey-patched threading (gevent worker class)"""
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("threading")
+
+
+def init_profiler(app):
+    """Registers the profiling hooks when profiling is enabled"""
+    store = ProfileStore(app.config["PROFILE_DIR"], app.config["PROFILE_KEEP"])
+    app.extensions["profile_store"] = store
+
+    token = app.config["PROFILER_TOKEN"]
+    rate = app.config["PROFILE_SAMPLE_RATE"]
+    if not token and rate <= 0:
+        return
+    if gevent_patched():
+        app.logger.warning("Profiling is not supported under gevent workers; PROFILER_TOKEN is ignored")
+        return
+
+    @app.before_request
+    def start_profile():
+        requested = token_matches(
+            request.headers.get("X-Profile") or request.args.get("__profile"), token
+        )
+        if not requested and not (rate > 0 and random.random() < rate):
+            return
+        sampler = StackSampler(threading.get_ident(), app.config["PROFILE_INTERVAL"])
+        g.profile = (sampler, time.perf_counter(), requested)
+        sampler.start()
+
+    @app.after_request
+    def tag_profile(response):
+        profile = g.get("profile")
+        if profile is not None and profile[2]:
+            # Stop here so the caller learns which profile to download
+            name = finish_profile(store)
+            if name:
+                response.headers["X-Profile-Id"] = name
+        return response
+
+    @app.teardown_request
+    def stop_profile(exc):
+        if g.get("profile") is not None:
+            finish_profile(store)
+
+
+def finish_profile(store):
+    """
+    Stops the request's sampler (once) and stores its profile
+
+    Returns:
+        str: The profile's name, or None if nothing was sampled or saving failed
+    """
+    sampler, started, requested = g.pop("profile")
+    sampler.stop()
+    if not sampler.stacks:
+        return None
+    try:
+        return store.save(
+            request.method,
+            request.url_rule.rule if request.url_rule else request.path,
+            time.perf_counter() - started,
+            sampler.collapsed(),
+        )
+    except OSError:
+        return None
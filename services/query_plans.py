@@ -0,0 +1,291 @@
+"""
+services/query_plans.py - Query plan audit for the hot route queries
+
+Drives the routes (and the background jobs behind them: callback inbox,
+reconciler, sales rollups, exports, user import) against a scratch SQLite
+database, records every statement they issue with collect_queries(), then
+runs EXPLAIN QUERY PLAN on each against the configured database and reports
+any full scan of the large tables. Because the statements are captured from
+the code itself, a route that changes its query is audited as it now is.
+Run it in CI after migrations:
+
+    flask --app app check-query-plans
+
+Only SQLite plans are inspected; on other databases the planner's choice
+depends on table statistics, so a plan check on an empty database would not
+mean much.
+"""
+
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from flask import request
+
+from models import db
+from models.category import Category
+from models.menu import MenuItem
+from models.order import Order
+from models.payment import Payment, PushRequest
+from models.user import User
+from services.query_stats import collect_queries
+
+# Tables that grow with every order and must never be scanned
+GUARDED_TABLES = ("orders", "order_items", "payments", "push_requests", "users")
+
+# Statements worth explaining; transaction control and PRAGMAs are skipped
+EXPLAINED = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH")
+
+SCRATCH_ADMIN_TOKEN = "query-plans"
+
+
+def scratch_app(workdir):
+    """Builds an app on an empty, migrated SQLite database under workdir"""
+    import migrations
+    from app import create_app
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{workdir}/plans.db",
+        "SECRET_KEY": "query-plans",
+        "SESSION_COOKIE_SECURE": False,
+        "CATALOG_VERSION_PATH": f"{workdir}/catalog.version",
+        "METRICS_DIR": f"{workdir}/metrics",
+        "PROFILE_DIR": f"{workdir}/profiles",
+        "PROFILER_TOKEN": None,
+        "PROFILE_SAMPLE_RATE": 0,
+        "ADMIN_TOKEN": SCRATCH_ADMIN_TOKEN,
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+        "PASSWORD_HASH_WORKERS": 0,
+        # The inbox is drained in the foreground, and payment events must
+        # answer from the database without asking Safaricom
+        "MPESA_CALLBACK_WORKERS": 0,
+        "MPESA_EVENTS_MAX_WAIT": 0,
+        "MPESA_STATUS_QUERY_AFTER": 86400,
+    })
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+    return app
+
+
+def seed(app):
+    """Adds a menu, a user and two pending M-Pesa payments; returns the user's id"""
+    from werkzeug.security import generate_password_hash
+
+    with app.app_context():
+        category = Category(name="Mains")
+        db.session.add(category)
+        db.session.flush()
+        db.session.add_all(MenuItem(name=f"Item {i}", price=100 + i * 50, category_id=category.id) for i in range(4))
+        user = User(fullname="Plan Check", contacts="254712345678", email="plans@example.com",
+                    password_hash=generate_password_hash("password", "pbkdf2:sha256:1"))
+        db.session.add(user)
+        db.session.flush()
+        for i in range(2):
+            order = Order(user_id=user.id, total_amount=100, status="pending", payment_status="pending",
+                          customer_phone="254712345678")
+            db.session.add(order)
+            db.session.flush()
+            payment = Payment(order_id=order.id, amount=100, status="pending", phone_number="254712345678",
+                              payment_method="mpesa")
+            db.session.add(payment)
+            db.session.flush()
+            db.session.add(PushRequest(payments_id=payment.id, checkout_request_id=f"ws_CO_plans_{i}"))
+        db.session.commit()
+        return user.id
+
+
+def stk_callback(checkout_request_id, result_code=0):
+    return {"Body": {"stkCallback": {
+        "MerchantRequestID": "plans",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "The service request is processed successfully.",
+        "CallbackMetadata": {"Item": [
+            {"Name": "Amount", "Value": 100},
+            {"Name": "MpesaReceiptNumber", "Value": f"QK{checkout_request_id[-1]}"},
+        ]},
+    }}}
+
+
+def exercise(app, user_id, step):
+    """Runs each route and background job once, each inside step(description)"""
+    from routes.payments import find_in_flight_push
+    from services.accounts import import_users
+    from services.callback_inbox import drain
+    from services.idempotency import purge_expired
+    from services.passwords import PasswordHasher
+    from services.reconciliation import apply_query_results, stale_pending_payments
+    from services.sales_rollup import rebuild
+
+    anonymous = app.test_client()
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    admin = {"Authorization": f"Bearer {SCRATCH_ADMIN_TOKEN}"}
+    today = date.today()
+    day_range = f"from={today - timedelta(days=30)}&to={today}"
+
+    with step("POST /api/register"):
+        anonymous.post("/api/register", json={
+            "fullname": "New User", "email": "new@example.com", "contact": "0798765432", "password": "password",
+        })
+    with step("POST /api/login"):
+        anonymous.post("/api/login", json={"contact": "0712345678", "password": "password"})
+    for path in ("/api/check-session", "/api/user", "/api/categories", "/api/menu", "/api/menu/category/1",
+                 "/api/menu/1"):
+        with step(f"GET {path}"):
+            client.get(path)
+
+    with step("POST /api/cart/items"):
+        client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 2})
+    with step("PUT /api/cart/items/<id>"):
+        client.put("/api/cart/items/1", json={"quantity": 3})
+    with step("DELETE /api/cart/items/<id>"):
+        client.delete("/api/cart/items/1")
+    with step("PUT /api/cart"):
+        client.put("/api/cart", json={"items": [{"menu_item_id": 1, "quantity": 1}, {"menu_item_id": 2, "quantity": 1}]})
+    with step("GET /api/cart"):
+        client.get("/api/cart")
+    checkout = {"customer_phone": "0712345678", "delivery_address": "Moi Avenue"}
+    with step("POST /api/cart/checkout"):
+        client.post("/api/cart/checkout", json=checkout, headers={"Idempotency-Key": "plans-checkout"})
+    with step("POST /api/cart/checkout (replayed key)"):
+        client.post("/api/cart/checkout", json=checkout, headers={"Idempotency-Key": "plans-checkout"})
+    with step("DELETE /api/cart"):
+        client.delete("/api/cart")
+
+    new_order = {"customer_phone": "0712345678", "items": [{"menu_item_id": 3, "quantity": 1}]}
+    with step("POST /api/orders"):
+        order_id = client.post(
+            "/api/orders", json=new_order, headers={"Idempotency-Key": "plans-order"}
+        ).get_json()["order_id"]
+    with step("POST /api/orders (replayed key)"):
+        client.post("/api/orders", json=new_order, headers={"Idempotency-Key": "plans-order"})
+    with step("GET /api/orders"):
+        cursor = client.get("/api/orders?limit=1").headers.get("X-Next-Cursor")
+    with step("GET /api/orders (next page)"):
+        client.get(f"/api/orders?limit=1&cursor={cursor}")
+    with step("GET /api/orders (filtered)"):
+        client.get(f"/api/orders?status=pending&payment_status=pending&{day_range}&fields=id,status")
+    with step("GET /api/orders/<id>"):
+        client.get(f"/api/orders/{order_id}")
+    with step("PUT /api/orders/<id>"):
+        client.put(f"/api/orders/{order_id}", json={"items": [{"menu_item_id": 4, "quantity": 2}]})
+    with step("PUT /api/orders/<id>/status"):
+        client.put(f"/api/orders/{order_id}/status", json={"status": "cancelled"})
+    with step("DELETE /api/orders/<id>"):
+        client.delete(f"/api/orders/{order_id}")
+
+    with step("make_payment: in-flight push"), app.test_request_context():
+        find_in_flight_push(1)
+    with step("POST /api/mpesa-callback"):
+        anonymous.post("/api/mpesa-callback", json=stk_callback("ws_CO_plans_0"))
+    with step("callback inbox: drain"), app.app_context():
+        drain()
+    with step("GET /api/payments/<id>/events"):
+        client.get("/api/payments/ws_CO_plans_0/events")
+    with step("reconciler: stale pending payments"), app.app_context():
+        stale_pending_payments(0, 50, after=0)
+        db.session.rollback()
+    with step("reconciler: apply"), app.app_context():
+        apply_query_results({"ws_CO_plans_1": stk_callback("ws_CO_plans_1", 1032)["Body"]["stkCallback"]})
+
+    for group_by in ("day", "hour", "item", "category"):
+        with step(f"GET /api/admin/analytics/sales?group_by={group_by}"):
+            anonymous.get(f"/api/admin/analytics/sales?{day_range}&group_by={group_by}", headers=admin)
+    for dataset in ("orders", "order_items", "payments", "order_status_history"):
+        with step(f"GET /api/admin/exports/{dataset}"):
+            anonymous.get(f"/api/admin/exports/{dataset}?{day_range}", headers=admin).get_data()
+    with step("GET /api/admin/exports/payments (status)"):
+        anonymous.get("/api/admin/exports/payments?status=completed", headers=admin).get_data()
+
+    with step("rebuild-sales-rollups"), app.app_context():
+        rebuild(today - timedelta(days=1), today)
+    with step("import-users"), app.app_context():
+        hasher = PasswordHasher("pbkdf2:sha256:1", workers=0)
+        import_users([
+            {"fullname": "Imported", "email": "imported@example.com", "contact": "0711000000", "password": "password"},
+            {"fullname": "Taken", "email": "plans@example.com", "contact": "0711000001", "password": "password"},
+        ], hasher)
+    with step("idempotency keys: purge expired"), app.app_context():
+        purge_expired()
+
+
+def capture_route_queries():
+    """
+    Runs the routes against a scratch database and records their statements
+
+    Returns:
+        list: (description, statement, parameters) per distinct statement,
+            described by the route or job that issued it
+    """
+    captured = []
+
+    @contextmanager
+    def step(description):
+        with collect_queries() as collector:
+            yield
+        seen = set()
+        for statement, parameters in zip(collector.statements, collector.parameters):
+            if statement in seen or not statement.lstrip().upper().startswith(EXPLAINED):
+                continue
+            seen.add(statement)
+            # executemany: the first row's parameters stand for the rest
+            if isinstance(parameters, list):
+                parameters = parameters[0] if parameters else ()
+            captured.append((description, statement, parameters))
+
+    workdir = tempfile.mkdtemp(prefix="query-plans-")
+    try:
+        app = scratch_app(workdir)
+        failed = []
+
+        @app.after_request
+        def note_failure(response):
+            # A request rejected early would skip the queries it is meant to cover
+            if response.status_code >= 400:
+                failed.append(f"{request.method} {request.full_path.rstrip('?')}: HTTP {response.status_code}")
+            return response
+
+        exercise(app, seed(app), step)
+        if failed:
+            raise RuntimeError("Query plan scenario requests failed: " + ", ".join(failed))
+        with app.app_context():
+            db.engine.dispose()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return captured
+
+
+def full_scans(plan_rows):
+    """Returns the plan details that scan a guarded table"""
+    scans = []
+    for row in plan_rows:
+        detail = row[-1]
+        words = detail.split()
+        if len(words) >= 2 and words[0] == "SCAN" and words[1] in GUARDED_TABLES:
+            scans.append(detail)
+    return scans
+
+
+def check_query_plans(engine=None):
+    """
+    Explains every statement the routes issue
+
+    Returns:
+        list: (description, statement, plan details, full scans) per statement
+    """
+    engine = engine or db.engine
+    if engine.dialect.name != "sqlite":
+        raise RuntimeError("Query plan checks only support SQLite")
+
+    results = []
+    queries = capture_route_queries()
+    with engine.connect() as connection:
+        for description, statement, parameters in queries:
+            plan = connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters or ()).fetchall()
+            results.append((description, statement, [row[-1] for row in plan], full_scans(plan)))
+    return results
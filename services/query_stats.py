@@ -0,0 +1,211 @@
+"""
+services/query_stats.py - Per-request SQL statement counting and N+1 detection
+
+Hooks SQLAlchemy's before/after_cursor_execute events and attributes every
+statement to the QueryCollectors active in the current context:
+
+- Each Flask request gets a collector. With SQL_DEBUG_HEADERS on (default
+  in debug mode) responses carry X-SQL-Queries, X-SQL-Time-Ms and
+  X-SQL-Repeated headers. A statement shape repeated N_PLUS_ONE_THRESHOLD
+  times in one request is logged as a likely N+1.
+- query_budget() wraps any block and raises QueryBudgetExceeded when it
+  issues more statements than allowed. It works as a test helper and backs
+  check_query_budgets(), which replays the QUERY_BUDGETS endpoints for a
+  real user (flask check-query-budgets in CI):
+
+      with query_budget(2):
+          client.get("/api/orders")
+"""
+
+import contextvars
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_active = contextvars.ContextVar("query_collectors", default=())
+_installed = threading.Lock()
+_listening = False
+
+# Collapses expanded IN lists and literals so repeated statements that differ
+# only in their parameters share a shape
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|:\w+|\$\d+)\s*,?)+\)")
+_NUMBER = re.compile(r"\b\d+\b")
+
+
+def statement_shape(statement):
+    shape = _IN_LIST.sub("(?)", statement)
+    return _NUMBER.sub("N", " ".join(shape.split()))
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block issues more SQL statements than its budget"""
+
+
+class QueryCollector:
+    """
+    Accumulates the statements executed while it is active
+
+    statements holds the SQL text and parameters the (driver-level)
+    parameters of each, in order.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.shapes = Counter()
+        self.statements = []
+        self.parameters = []
+
+    def record(self, statement, elapsed, parameters=None):
+        self.count += 1
+        self.total_time += elapsed
+        self.shapes[statement_shape(statement)] += 1
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def most_repeated(self):
+        """
+        Returns:
+            tuple: (shape, count) of the most repeated statement, or (None, 0)
+        """
+        if not self.shapes:
+            return None, 0
+        return self.shapes.most_common(1)[0]
+
+
+@contextmanager
+def collect_queries():
+    """Collects the statements run inside the block (in this context)"""
+    collector = QueryCollector()
+    token = _active.set(_active.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _active.reset(token)
+
+
+@contextmanager
+def query_budget(max_queries):
+    """
+    Fails the block if it runs more than max_queries statements
+
+    Raises:
+        QueryBudgetExceeded: Listing the statements that were run
+    """
+    with collect_queries() as collector:
+        yield collector
+    if collector.count > max_queries:
+        statements = "\n".join(f"  {s}" for s in collector.statements)
+        raise QueryBudgetExceeded(
+            f"{collector.count} queries run, budget is {max_queries}:\n{statements}"
+        )
+
+
+def expect_repeated_queries():
+    """Marks the current request as polling by design (no N+1 warning)"""
+    g.query_repeats_expected = True
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collectors = _active.get()
+    if not collectors:
+        return
+    starts = conn.info.get("query_start")
+    elapsed = time.perf_counter() - starts.pop() if starts else 0.0
+    for collector in collectors:
+        collector.record(statement, elapsed, parameters)
+
+
+def _listen():
+    global _listening
+    with _installed:
+        if not _listening:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _listening = True
+
+
+def init_query_stats(app):
+    """Tracks SQL statements per request for the given app"""
+    _listen()
+    app.config.setdefault("SQL_DEBUG_HEADERS", app.debug)
+    app.config.setdefault("N_PLUS_ONE_THRESHOLD", 5)
+
+    @app.before_request
+    def start_query_stats():
+        g.query_collector = QueryCollector()
+        g.query_collector_token = _active.set(_active.get() + (g.query_collector,))
+
+    @app.after_request
+    def report_query_stats(response):
+        collector = g.get("query_collector")
+        if collector is None:
+            return response
+
+        shape, repeats = collector.most_repeated()
+        if repeats >= app.config["N_PLUS_ONE_THRESHOLD"] and not g.get("query_repeats_expected"):
+            app.logger.warning(
+                "Possible N+1 in %s %s: %d x %s", request.method, request.path, repeats, shape
+            )
+        if app.config["SQL_DEBUG_HEADERS"]:
+            response.headers["X-SQL-Queries"] = str(collector.count)
+            response.headers["X-SQL-Time-Ms"] = f"{collector.total_time * 1000:.2f}"
+            response.headers["X-SQL-Repeated"] = str(repeats)
+        return response
+
+    @app.teardown_request
+    def stop_query_stats(exc):
+        token = g.pop("query_collector_token", None)
+        if token is not None:
+            try:
+                _active.reset(token)
+            except ValueError:
+                # Streaming responses tear down in a different context
+                pass
+
+
+
+# Statements allowed per endpoint once the catalog and user caches are warm.
+# Each budget must hold regardless of how many rows the user has.
+QUERY_BUDGETS = {
+    "/api/check-session": 0,
+    "/api/user": 0,
+    "/api/menu": 0,
+    "/api/categories": 0,
+    "/api/cart": 1,
+    "/api/orders": 2,
+    "/api/orders?limit=100": 2,
+}
+
+
+def check_query_budgets(app, user_id, budgets=None):
+    """
+    Requests each budgeted endpoint as user_id and measures its statements
+
+    Every endpoint is requested once to warm per-worker caches, then again
+    under collect_queries().
+
+    Returns:
+        list[tuple]: (path, status_code, queries, budget) per endpoint
+    """
+    results = []
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    for path, budget in (budgets or QUERY_BUDGETS).items():
+        client.get(path)
+        with collect_queries() as collector:
+            response = client.get(path)
+        results.append((path, response.status_code, collector.count, budget))
+    return results
@@ -0,0 +1,270 @@
+"""
+services/reconciliation.py - Resolves payments whose callback never arrived
+
+A payment stays "pending" until its STK callback is applied. When Safaricom
+never delivers the callback, nothing else moves it on once the customer's
+browser stops polling. The reconciler finds pending payments older than
+min_age seconds (through the payments (status, id) index),
+asks Safaricom for each push's result with STK queries made concurrently
+by a bounded thread pool under a rate limit, and applies the answers in
+one transaction per batch with apply_stk_result, exactly as mpesa_callback
+would. Pushes the customer has not answered yet are left for the next run.
+
+    flask --app app reconcile-payments --min-age 300 --dry-run
+    flask --app app reconcile-payments --every 60
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from models import db
+from models.order import Order
+from models.payment import Payment, PushRequest, PaymentEvent
+from services.callback_inbox import apply_stk_result
+from services.mpesa_client import MpesaRequestError, MpesaUnavailable, STK_PENDING_ERROR_CODE
+from services.payment_events import notifier
+from services.sql import insert_ignore, utcnow
+
+
+class RateLimiter:
+    """
+    Spaces calls evenly at no more than `rate` per second across threads
+
+    Args:
+        rate (float): Calls per second; 0 or less disables the limit
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ReconcileStats:
+    """Counters for one reconciliation run"""
+
+    FIELDS = ("scanned", "queried", "completed", "failed", "still_pending",
+              "already_resolved", "errors")
+
+    def __init__(self):
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self.started = time.perf_counter()
+        self.stopped_early = None
+
+    def add(self, name, value=1):
+        self.counts[name] += value
+
+    def as_dict(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            **self.counts,
+            "seconds": round(elapsed, 3),
+            "queries_per_second": round(self.counts["queried"] / elapsed, 1) if elapsed else 0.0,
+            "stopped_early": self.stopped_early,
+        }
+
+
+def stale_pending_payments(min_age, limit, after=None):
+    """
+    Returns pending payments older than min_age seconds, oldest first
+
+    Pages by id rather than created_at: ids follow creation order, and
+    SQLite compares stored timestamps as text, so a created_at cursor
+    does not round-trip.
+
+    Args:
+        min_age (float): Seconds since the payment was created
+        limit (int): Maximum rows returned
+        after (int): Id of the last payment of the previous page
+
+    Returns:
+        list: (payment_id, checkout_request_id) tuples
+    """
+    query = (
+        db.session.query(Payment.id, PushRequest.checkout_request_id)
+        .join(PushRequest, PushRequest.payments_id == Payment.id)
+        .filter(Payment.status == "pending", Payment.created_at < utcnow() - timedelta(seconds=min_age))
+    )
+    if after is not None:
+        query = query.filter(Payment.id > after)
+    return query.order_by(Payment.id).limit(limit).all()
+
+
+def apply_query_results(results, stats=None, dry_run=False):
+    """
+    Applies STK query results in a single transaction, like mpesa_callback
+
+    The payments and orders are locked first, so a concurrent apply of the
+    same result waits and then skips it rather than applying it twice. A
+    PaymentEvent is recorded for each result applied.
+
+    Args:
+        results (dict): checkout_request_id -> STK query body (a dict with a
+            ResultCode), None while the customer has not answered, or the
+            error that prevented the query
+        stats (ReconcileStats): Counts the outcomes; a new one if None
+        dry_run (bool): Roll back instead of committing
+
+    Returns:
+        ReconcileStats: stats
+    """
+    stats = stats or ReconcileStats()
+    resolved = {cid: data for cid, data in results.items() if isinstance(data, dict)}
+    for data in results.values():
+        if data is None:
+            stats.add("still_pending")
+        elif isinstance(data, Exception):
+            stats.add("errors")
+    if not resolved:
+        return stats
+
+    targets = (
+        db.session.query(PushRequest.checkout_request_id, Payment, Order)
+        .join(Payment, PushRequest.payments_id == Payment.id)
+        .join(Order, Order.id == Payment.order_id)
+        .filter(PushRequest.checkout_request_id.in_(list(resolved)))
+        .with_for_update()
+    )
+    events = []
+    now = utcnow()
+    for checkout_request_id, payment, order in targets:
+        data = resolved[checkout_request_id]
+        if not apply_stk_result(payment, order, data["ResultCode"], data.get("ResultDesc"), []):
+            # The callback was applied while we were querying
+            stats.add("already_resolved")
+            continue
+        stats.add("completed" if int(data["ResultCode"]) == 0 else "failed")
+        events.append({
+            "checkout_request_id": checkout_request_id,
+            "result_code": int(data["ResultCode"]),
+            "result_desc": data.get("ResultDesc"),
+            "source": "query",
+            "created_at": now,
+        })
+
+    if dry_run:
+        db.session.rollback()
+        return stats
+    if events:
+        # A result recorded from a callback is never replaced
+        insert_ignore(PaymentEvent, events, ["checkout_request_id"])
+    db.session.commit()
+    if events:
+        notifier.notify()
+    return stats
+
+
+class Reconciler:
+    """
+    Queries Safaricom for stale pending payments and applies the results
+
+    Args:
+        app (Flask): App whose context the query threads run in
+        query (callable): query(checkout_request_id, access_token) ->
+            requests.Response for an STK query; needs an app context
+        get_token (callable): Returns an access token or None; needs an
+            app context
+        workers (int): Concurrent STK queries
+        rate (float): Maximum STK queries per second (0 for no limit)
+        batch_size (int): Payments queried and applied per transaction
+        min_age (float): Only payments older than this many seconds
+    """
+
+    def __init__(self, app, query, get_token, workers=4, rate=5.0, batch_size=50, min_age=300):
+        self.app = app
+        self.query = query
+        self.get_token = get_token
+        self.workers = workers
+        self.rate = rate
+        self.batch_size = batch_size
+        self.min_age = min_age
+
+    def run(self, limit=None, dry_run=False):
+        """
+        Reconciles every stale pending payment once
+
+        Must be called inside an app context.
+
+        Args:
+            limit (int): Stop after this many payments
+            dry_run (bool): Query Safaricom but roll back instead of applying
+
+        Returns:
+            dict: ReconcileStats.as_dict()
+        """
+        stats = ReconcileStats()
+        limiter = RateLimiter(self.rate)
+        after = None
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="reconcile") as pool:
+            while limit is None or stats.counts["scanned"] < limit:
+                size = self.batch_size if limit is None else min(self.batch_size, limit - stats.counts["scanned"])
+                rows = stale_pending_payments(self.min_age, size, after)
+                # Don't hold the connection while Safaricom answers
+                db.session.rollback()
+                if not rows:
+                    break
+                after = rows[-1][0]
+                stats.add("scanned", len(rows))
+
+                try:
+                    access_token = self.get_token()
+                except MpesaUnavailable as e:
+                    stats.stopped_early = str(e)
+                    break
+                if not access_token:
+                    stats.stopped_early = "Failed to get M-Pesa access token"
+                    break
+
+                def query(checkout_request_id):
+                    limiter.acquire()
+                    with self.app.app_context():
+                        return checkout_request_id, self._query_result(checkout_request_id, access_token)
+
+                results = dict(pool.map(query, [row[1] for row in rows]))
+                stats.add("queried", len(results))
+                unavailable = [r for r in results.values() if isinstance(r, MpesaUnavailable)]
+                self.apply(results, stats, dry_run)
+                if unavailable:
+                    stats.stopped_early = str(unavailable[0])
+                    break
+                if len(rows) < size:
+                    break
+        return stats.as_dict()
+
+    def _query_result(self, checkout_request_id, access_token):
+        """
+        Returns:
+            dict | None | Exception: The STK query body when it carries a
+            ResultCode, None while the customer has not answered, or the
+            error that prevented the query
+        """
+        try:
+            data = self.query(checkout_request_id, access_token).json()
+        except MpesaUnavailable as e:
+            return e
+        except (MpesaRequestError, ValueError) as e:
+            return MpesaRequestError(str(e))
+        if not isinstance(data, dict):
+            return MpesaRequestError("Unexpected STK query response")
+        if "ResultCode" in data:
+            return data
+        if data.get("errorCode") == STK_PENDING_ERROR_CODE:
+            return None
+        return MpesaRequestError(data.get("errorMessage") or "STK query failed")
+
+    def apply(self, results, stats, dry_run=False):
+        """Applies one batch of query results in a single transaction"""
+        apply_query_results(results, stats, dry_run)
+
@@ -0,0 +1,314 @@
+"""
+services/sales_rollup.py - Incrementally maintained sales rollups
+
+Two tables summarize the order history so reports never scan orders or
+order_items:
+
+- sales_daily_items: per day, menu item and order status, the number of
+  orders containing the item, the quantity sold and its revenue
+- sales_hourly: per hour and order status, the number of orders and their
+  totals
+
+Orders are bucketed by their created_at (UTC) and counted under their
+current status; pending orders are not counted. When an order's status
+changes, its contribution moves from the old status to the new one, so a
+confirmed order that is later cancelled leaves revenue again.
+
+Callers record each change in the transaction that makes it:
+
+    old_status = order.status
+    order.status = "confirmed"
+    record_status_change(order, old_status)
+
+The changes are applied at commit, as one INSERT ... ON CONFLICT DO UPDATE
+per table for the whole transaction (a callback batch confirming fifty
+orders costs one order_items query and two upserts). A rollback discards
+them. rebuild() recomputes a date range from the orders themselves.
+"""
+
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+from models.order import Order, OrderItem
+from models.sales import SalesDailyItem, SalesHourly
+from services.sql import as_datetime, upsert, utcnow
+
+# Orders in these statuses are not counted
+UNTRACKED_STATUSES = ("pending",)
+
+# Statuses whose orders count as sales
+REVENUE_STATUSES = ("confirmed", "completed")
+
+# order_items are looked up for at most this many orders per query
+ITEM_QUERY_CHUNK = 500
+
+DAILY_KEY = ["day", "menu_item_id", "status"]
+HOURLY_KEY = ["hour", "status"]
+
+
+def is_tracked(status):
+    return bool(status) and status not in UNTRACKED_STATUSES
+
+
+def hour_of(created_at):
+    return (created_at or utcnow()).replace(minute=0, second=0, microsecond=0)
+
+
+class RollupDelta:
+    """Changes to the rollup rows, keyed by their primary keys"""
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0, Decimal(0)])
+        self.hourly = defaultdict(lambda: [0, Decimal(0)])
+
+    def add_order(self, created_at, status, total_amount, items, sign=1):
+        """
+        Adds (sign=1) or removes (sign=-1) one order's contribution
+
+        Args:
+            created_at (datetime): Order creation time, which picks the buckets
+            status (str): Status the order is counted under
+            total_amount (Decimal): Order total
+            items (iterable): (menu_item_id, quantity, subtotal) per menu item
+        """
+        hour = hour_of(created_at)
+        hourly = self.hourly[(hour, status)]
+        hourly[0] += sign
+        hourly[1] += sign * Decimal(total_amount or 0)
+        for menu_item_id, quantity, subtotal in items:
+            daily = self.daily[(hour.date(), menu_item_id, status)]
+            daily[0] += sign
+            daily[1] += sign * int(quantity or 0)
+            daily[2] += sign * Decimal(subtotal or 0)
+
+    def daily_rows(self):
+        return [
+            {"day": day, "menu_item_id": item, "status": status,
+             "orders": orders, "quantity": quantity, "revenue": revenue}
+            for (day, item, status), (orders, quantity, revenue) in self.daily.items()
+            if orders or quantity or revenue
+        ]
+
+    def hourly_rows(self):
+        return [
+            {"hour": hour, "status": status, "orders": orders, "revenue": revenue}
+            for (hour, status), (orders, revenue) in self.hourly.items()
+            if orders or revenue
+        ]
+
+    def apply(self):
+        """Adds the changes to the rollup tables in the current transaction"""
+        daily, hourly = self.daily_rows(), self.hourly_rows()
+        if daily:
+            upsert(SalesDailyItem, daily, DAILY_KEY, {
+                name: (lambda excluded, name=name: SalesDailyItem.__table__.c[name] + excluded[name])
+                for name in ("orders", "quantity", "revenue")
+            })
+        if hourly:
+            upsert(SalesHourly, hourly, HOURLY_KEY, {
+                name: (lambda excluded, name=name: SalesHourly.__table__.c[name] + excluded[name])
+                for name in ("orders", "revenue")
+            })
+
+    def replace(self):
+        """Writes the rows as they are, overwriting existing ones (used by rebuild)"""
+        daily, hourly = self.daily_rows(), self.hourly_rows()
+        if daily:
+            upsert(SalesDailyItem, daily, DAILY_KEY, ["orders", "quantity", "revenue"])
+        if hourly:
+            upsert(SalesHourly, hourly, HOURLY_KEY, ["orders", "revenue"])
+
+
+def order_items_by_order(order_ids):
+    """
+    Returns:
+        dict: order id -> list of (menu_item_id, quantity, subtotal)
+    """
+    items = defaultdict(list)
+    order_ids = list(order_ids)
+    for start in range(0, len(order_ids), ITEM_QUERY_CHUNK):
+        rows = db.session.query(
+            OrderItem.order_id, OrderItem.menu_item_id,
+            db.func.sum(OrderItem.quantity), db.func.sum(OrderItem.subtotal),
+        ).filter(
+            OrderItem.order_id.in_(order_ids[start:start + ITEM_QUERY_CHUNK])
+        ).group_by(OrderItem.order_id, OrderItem.menu_item_id)
+        for order_id, menu_item_id, quantity, subtotal in rows:
+            items[order_id].append((menu_item_id, quantity, subtotal))
+    return items
+
+
+# ------------------------------------------------------------------
+# Recording changes
+# ------------------------------------------------------------------
+
+class PendingChanges:
+    """
+    Rollup changes recorded in one transaction
+
+    Attributes:
+        delta (RollupDelta): Contributions already resolved
+        added (dict): (order id, status) -> Order to count at commit
+        removed (dict): (order id, status) -> Order to stop counting at commit
+    """
+
+    def __init__(self):
+        self.delta = RollupDelta()
+        self.added = {}
+        self.removed = {}
+
+    def resolve(self):
+        """Reads the items of the orders added or removed and folds them into delta"""
+        orders = {**self.added, **self.removed}
+        if orders:
+            items = order_items_by_order({order.id for order in orders.values()})
+            for changes, sign in ((self.added, 1), (self.removed, -1)):
+                for (order_id, status), order in changes.items():
+                    self.delta.add_order(order.created_at, status, order.total_amount, items.get(order_id, []), sign)
+        self.added, self.removed = {}, {}
+        return self.delta
+
+
+def pending_changes(session=None):
+    """Returns the rollup changes recorded in the session's current transaction"""
+    session = session or db.session
+    pending = session.info.get("sales_rollup")
+    if pending is None:
+        pending = session.info["sales_rollup"] = PendingChanges()
+    return pending
+
+
+def record_order_added(order):
+    """
+    Counts an order under its current status
+
+    Its items are read when the transaction commits.
+    """
+    if not is_tracked(order.status):
+        return
+    pending = pending_changes()
+    key = (order.id, order.status)
+    if pending.removed.pop(key, None) is None:
+        pending.added[key] = order
+
+
+def record_order_removed(order):
+    """
+    Stops counting an order under its current status
+
+    Call before changing the order's items or deleting it; the items are
+    read straight away.
+    """
+    if not is_tracked(order.status):
+        return
+    pending = pending_changes()
+    if pending.added.pop((order.id, order.status), None) is not None:
+        # Counted earlier in this transaction, not applied yet
+        return
+    items = order_items_by_order([order.id]).get(order.id, [])
+    pending.delta.add_order(order.created_at, order.status, order.total_amount, items, sign=-1)
+
+
+def record_status_change(order, old_status):
+    """
+    Moves an order's contribution from old_status to its current status
+
+    Call after setting order.status, in the same transaction; does nothing
+    if the status did not change.
+    """
+    if old_status == order.status:
+        return
+    if is_tracked(old_status):
+        pending = pending_changes()
+        key = (order.id, old_status)
+        if pending.added.pop(key, None) is None:
+            # The items are unchanged, so they are read at commit with the additions
+            pending.removed[key] = order
+    record_order_added(order)
+
+
+@event.listens_for(Session, "before_commit")
+def _apply_on_commit(session):
+    pending = session.info.pop("sales_rollup", None)
+    if pending is not None:
+        pending.resolve().apply()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_on_rollback(session):
+    session.info.pop("sales_rollup", None)
+
+
+# ------------------------------------------------------------------
+# Rebuild
+# ------------------------------------------------------------------
+
+def rebuild(start=None, end=None, days_per_batch=7, on_batch=None):
+    """
+    Recomputes the rollups of orders created from start to end, inclusive
+
+    Works through the range days_per_batch days at a time, one transaction
+    per batch: the batch's rollup rows are deleted and rewritten from its
+    orders, so the rollups stay usable, and exact, while it runs.
+
+    Args:
+        start (date): First day; defaults to the oldest order's
+        end (date): Last day; defaults to the newest order's
+        days_per_batch (int): Days per transaction
+        on_batch (callable): Called with (first day, last day, orders) after each batch
+
+    Returns:
+        int: Orders counted
+    """
+    if start is None or end is None:
+        oldest, newest = db.session.query(db.func.min(Order.created_at), db.func.max(Order.created_at)).one()
+        db.session.rollback()
+        if oldest is None:
+            return 0
+        start = start or as_datetime(oldest).date()
+        end = end or as_datetime(newest).date()
+
+    counted = 0
+    day = start
+    while day <= end:
+        last = min(day + timedelta(days=days_per_batch - 1), end)
+        lower = datetime.combine(day, time.min)
+        upper = datetime.combine(last + timedelta(days=1), time.min)
+
+        db.session.query(SalesDailyItem).filter(
+            SalesDailyItem.day >= day, SalesDailyItem.day <= last
+        ).delete(synchronize_session=False)
+        db.session.query(SalesHourly).filter(
+            SalesHourly.hour >= lower, SalesHourly.hour < upper
+        ).delete(synchronize_session=False)
+
+        # SQLite compares stored timestamps as text, and "... 00:00:00" sorts
+        # before "... 00:00:00.000000": widen the range by a second and
+        # filter exactly below
+        orders = [
+            row for row in db.session.query(
+                Order.id, Order.created_at, Order.status, Order.total_amount
+            ).filter(
+                Order.created_at >= lower - timedelta(seconds=1),
+                Order.created_at < upper,
+                Order.status.notin_(UNTRACKED_STATUSES),
+            )
+            if lower <= as_datetime(row.created_at) < upper
+        ]
+        delta = RollupDelta()
+        items = order_items_by_order(row.id for row in orders)
+        for row in orders:
+            delta.add_order(as_datetime(row.created_at), row.status, row.total_amount, items.get(row.id, []))
+        delta.replace()
+        db.session.commit()
+
+        counted += len(orders)
+        if on_batch is not None:
+            on_batch(day, last, len(orders))
+        day = last + timedelta(days=1)
+    return counted
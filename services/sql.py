@@ -0,0 +1,97 @@
+"""
+services/sql.py - Small SQL helpers shared by the services
+
+Wraps the dialect-specific "INSERT ... ON CONFLICT" statements so callers can
+do single-statement inserts/upserts on both SQLite and PostgreSQL.
+"""
+
+from datetime import datetime, timezone
+
+from sqlalchemy import String, type_coerce
+
+from models import db
+
+
+def utcnow():
+    """Naive UTC timestamp, matching what the database's now() stores"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def as_datetime(value):
+    """Returns a timestamp column value as a datetime, parsing SQLite text if needed"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+def timestamp_param(value):
+    """
+    Binds a datetime for comparison with a func.now()-stamped column
+
+    SQLite stores those timestamps as "YYYY-MM-DD HH:MM:SS" text but binds a
+    datetime as "YYYY-MM-DD HH:MM:SS.000000", which sorts after the stored
+    value of the same second. On SQLite the value is bound as text in the
+    stored format instead (with microseconds only when it has any); other
+    databases compare real timestamps and get the datetime unchanged.
+    """
+    if db.session.get_bind().dialect.name == "sqlite":
+        return type_coerce(str(value), String)
+    return value
+
+
+def _insert_for_dialect():
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"ON CONFLICT is not supported for {dialect}")
+    return insert
+
+
+def insert_ignore(model, rows, conflict_columns):
+    """
+    Inserts rows, silently skipping those that hit a unique constraint
+
+    Args:
+        model: SQLAlchemy model class
+        rows (list[dict] | dict): Column values to insert
+        conflict_columns (list[str] | None): Columns of the unique
+            constraint, or None to skip rows hitting any unique constraint
+
+    Returns:
+        int: Number of rows actually inserted
+    """
+    insert = _insert_for_dialect()
+    stmt = insert(model.__table__).values(rows).on_conflict_do_nothing(
+        index_elements=conflict_columns
+    )
+    return db.session.execute(stmt).rowcount
+
+
+def upsert(model, rows, conflict_columns, update_columns):
+    """
+    Inserts rows or updates the given columns of rows that already exist
+
+    Args:
+        model: SQLAlchemy model class
+        rows (list[dict] | dict): Column values to insert
+        conflict_columns (list[str]): Columns of the unique constraint
+        update_columns (list[str]|dict): Columns to overwrite from the
+            inserted values, or a mapping of column -> SQL expression
+            (which may reference the statement's ``excluded`` row via the
+            callable form ``lambda excluded: ...``)
+
+    Returns:
+        int: Number of rows inserted or updated
+    """
+    insert = _insert_for_dialect()
+    stmt = insert(model.__table__).values(rows)
+    if isinstance(update_columns, dict):
+        set_ = {
+            name: value(stmt.excluded) if callable(value) else value
+            for name, value in update_columns.items()
+        }
+    else:
+        set_ = {name: stmt.excluded[name] for name in update_columns}
+    stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_=set_)
+    return db.session.execute(stmt).rowcount
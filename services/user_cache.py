@@ -0,0 +1,124 @@
+"""
+services/user_cache.py - Per-worker cache of logged-in users' public profiles
+
+The SPA calls /api/check-session on every page load, and /api/user returns
+the same profile. UserCache keeps each user's public profile (id, name,
+email, contact; never the password hash) in an LRU of max_size entries, so
+those requests need no database query.
+
+SQLAlchemy session events drop a user's entry in every cache of this
+process as soon as a transaction that wrote that User commits (profile or
+password changes, logins). Other workers pick up the change when their
+entry expires after ttl seconds.
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models.user import User
+
+_caches = weakref.WeakSet()
+
+
+def invalidate_users(user_ids):
+    """Drops the given users from every cache in this process"""
+    for cache in list(_caches):
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+# ------------------------------------------------------------------
+# Session events: invalidate users whose rows were written
+# ------------------------------------------------------------------
+
+@event.listens_for(Session, "after_flush")
+def _track_user_flush(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User) and obj.id is not None:
+            session.info.setdefault("users_dirty", set()).add(obj.id)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _track_user_bulk(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and mapper.class_ is User:
+            # Bulk statements don't say which rows they touched
+            orm_execute_state.session.info["users_dirty_all"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_on_commit(session):
+    if session.info.pop("users_dirty_all", False):
+        session.info.pop("users_dirty", None)
+        for cache in list(_caches):
+            cache.clear()
+        return
+    user_ids = session.info.pop("users_dirty", None)
+    if user_ids:
+        invalidate_users(user_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _reset_on_rollback(session):
+    session.info.pop("users_dirty", None)
+    session.info.pop("users_dirty_all", None)
+
+
+class UserCache:
+    """
+    LRU cache of public user profiles with a time-to-live
+
+    Args:
+        max_size (int): Profiles kept; 0 disables the cache
+        ttl (float): Seconds a profile is served before it is reloaded
+    """
+
+    def __init__(self, max_size=1024, ttl=60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        _caches.add(self)
+
+    def get(self, user_id):
+        """Returns the cached profile, or None on a miss"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[user_id]
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, user_id, profile):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "size": len(self._entries), "max_size": self.max_size}
@@ -0,0 +1,89 @@
+"""
+tests/conftest.py - Shared fixtures
+
+Each test gets an app on its own SQLite file, migrated like production,
+with a small menu and one user, and a test client logged in as that user.
+
+    def test_cart(budgeted):
+        with budgeted(1) as client:
+            client.get("/api/cart")
+"""
+
+from contextlib import contextmanager
+
+import pytest
+
+from app import create_app
+from models import db
+from services.query_stats import query_budget
+
+
+@pytest.fixture
+def app(tmp_path):
+    import migrations
+    from models.category import Category
+    from models.menu import MenuItem
+    from models.user import User
+
+    app = create_app({
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "test.db"),
+        "SECRET_KEY": "test",
+        "SESSION_COOKIE_SECURE": False,
+        "CATALOG_VERSION_PATH": str(tmp_path / "catalog.version"),
+        "METRICS_DIR": str(tmp_path / "metrics"),
+        "PROFILE_DIR": str(tmp_path / "profiles"),
+        "ADMIN_TOKEN": "admin",
+        "METRICS_TOKEN": None,
+        "METRICS_PUBLIC": False,
+        "PASSWORD_HASH_METHOD": "pbkdf2:sha256:1",
+        "PASSWORD_HASH_WORKERS": 0,
+        "MPESA_CALLBACK_WORKERS": 0,
+    })
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+        categories = [Category(name="Mains"), Category(name="Drinks")]
+        db.session.add_all(categories)
+        db.session.flush()
+        db.session.add_all(
+            MenuItem(name=f"Item {i}", price=100 + i * 50, category_id=categories[i % 2].id)
+            for i in range(4)
+        )
+        db.session.add(User(fullname="Test User", contacts="254712345678", email="test@example.com",
+                            password_hash="-"))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+@pytest.fixture
+def user_id(app):
+    from models.user import User
+
+    with app.app_context():
+        return User.query.filter_by(email="test@example.com").one().id
+
+
+@pytest.fixture
+def client(app, user_id):
+    """Test client logged in as the fixture user"""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    return client
+
+
+@pytest.fixture
+def budgeted(client):
+    """
+    Returns a context manager that yields the logged-in client and fails the
+    test if the block runs more than max_queries SQL statements
+    """
+    @contextmanager
+    def budgeted(max_queries):
+        with query_budget(max_queries):
+            yield client
+
+    return budgeted
@@ -0,0 +1,46 @@
+import pytest
+
+from models.user import User
+
+
+def registration(**fields):
+    return {"fullname": "New User", "email": "new@example.com", "contact": "0798765432",
+            "password": "password", **fields}
+
+
+@pytest.mark.parametrize("contact", ["0798765432", "0798 765 432", "+254798765432", "798765432", "254798765432"])
+def test_register_stores_the_canonical_phone(app, contact):
+    response = app.test_client().post("/api/register", json=registration(contact=contact))
+    assert response.status_code == 201
+    assert response.get_json()["user"]["contact"] == "254798765432"
+    with app.app_context():
+        assert User.query.filter_by(email="new@example.com").one().contacts == "254798765432"
+
+
+@pytest.mark.parametrize("contact", ["12345", "0698765432", "25479876543"])
+def test_register_rejects_invalid_phones(app, contact):
+    response = app.test_client().post("/api/register", json=registration(contact=contact))
+    assert response.status_code == 400
+    assert response.get_json()["field"] == "contact"
+
+
+@pytest.mark.parametrize("fields, field, message", [
+    ({"email": "test@example.com"}, "email", "Email already registered"),
+    ({"contact": "0712 345 678"}, "contact", "Phone number already registered"),
+    ({"contact": "+254712345678"}, "contact", "Phone number already registered"),
+])
+def test_register_duplicate_answers_409(app, fields, field, message):
+    response = app.test_client().post("/api/register", json=registration(**fields))
+    assert response.status_code == 409
+    assert response.get_json() == {"success": False, "message": message, "field": field}
+    with app.app_context():
+        assert User.query.count() == 1
+
+
+def test_login_accepts_any_format_of_the_registered_phone(app):
+    client = app.test_client()
+    assert client.post("/api/register", json=registration()).status_code == 201
+    for contact in ("0798765432", "+254 798 765 432", "798765432"):
+        response = client.post("/api/login", json={"contact": contact, "password": "password"})
+        assert response.status_code == 200, contact
+    assert client.post("/api/login", json={"contact": "0798765432", "password": "wrong"}).status_code == 401
@@ -0,0 +1,102 @@
+import json
+from datetime import timedelta
+
+import pytest
+
+from models import db
+from models.order import Order
+from models.payment import CallbackInbox, Payment, PaymentEvent, PushRequest
+from services.callback_inbox import UNMATCHED_RETRIES, drain, parse_callback, store_callback
+from services.sql import utcnow
+
+
+def callback(checkout_request_id, result_code=0, receipt="QK1"):
+    body = {"Body": {"stkCallback": {
+        "MerchantRequestID": "m1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": result_code,
+        "ResultDesc": "ok" if result_code == 0 else "Request cancelled by user",
+    }}}
+    if result_code == 0:
+        body["Body"]["stkCallback"]["CallbackMetadata"] = {"Item": [{"Name": "MpesaReceiptNumber", "Value": receipt}]}
+    return body
+
+
+def receive(body):
+    """Stores a callback like mpesa_callback does; returns whether it was new"""
+    return store_callback(parse_callback(body), json.dumps(body))
+
+
+@pytest.fixture
+def order_id(app, client):
+    return client.post("/api/orders", json={
+        "customer_phone": "0712345678", "items": [{"menu_item_id": 1, "quantity": 1}],
+    }).get_json()["order_id"]
+
+
+def push(order_id, checkout_request_id="ws_CO_1"):
+    payment = Payment(order_id=order_id, amount=100, status="pending", phone_number="254712345678",
+                      payment_method="mpesa")
+    db.session.add(payment)
+    db.session.flush()
+    db.session.add(PushRequest(payments_id=payment.id, checkout_request_id=checkout_request_id))
+    db.session.commit()
+
+
+def test_replayed_callback_is_stored_and_applied_once(app, order_id):
+    with app.app_context():
+        push(order_id)
+        assert receive(callback("ws_CO_1")) is True
+        assert receive(callback("ws_CO_1")) is False
+        assert drain() == 1
+        assert CallbackInbox.query.count() == 1
+
+        order = db.session.get(Order, order_id)
+        assert (order.status, order.payment_status, order.mpesa_transaction_id) == ("confirmed", "completed", "QK1")
+        history = len(order.status_history)
+        # Replaying the processed row changes nothing
+        CallbackInbox.query.update({"status": "pending"})
+        db.session.commit()
+        assert drain() == 1
+        assert len(db.session.get(Order, order_id).status_history) == history
+        assert Payment.query.one().status == "completed"
+
+
+def test_contradicting_callbacks_publish_the_applied_result(app, order_id):
+    with app.app_context():
+        push(order_id)
+        receive(callback("ws_CO_1", 0))
+        receive(callback("ws_CO_1", 1032))
+        drain()
+        assert Payment.query.one().status == "completed"
+        event = PaymentEvent.query.filter_by(checkout_request_id="ws_CO_1").one()
+        assert (event.result_code, event.mpesa_receipt_number) == (0, "QK1")
+
+
+def test_callback_before_its_push_is_retried(app, order_id):
+    with app.app_context():
+        receive(callback("ws_CO_1"))
+        drain()
+        row = CallbackInbox.query.one()
+        assert row.status == "pending" and row.next_attempt_at > utcnow()
+        # Not claimed again before its retry time
+        assert drain() == 0
+
+        push(order_id)
+        row = CallbackInbox.query.one()
+        row.next_attempt_at = utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        assert drain() == 1
+        assert CallbackInbox.query.one().status == "processed"
+        assert Payment.query.one().status == "completed"
+
+
+def test_unmatched_after_bounded_retries(app):
+    with app.app_context():
+        receive(callback("ws_CO_missing"))
+        for _ in range(UNMATCHED_RETRIES + 1):
+            CallbackInbox.query.update({"next_attempt_at": None})
+            db.session.commit()
+            drain()
+        row = CallbackInbox.query.one()
+        assert (row.status, row.attempts) == ("unmatched", UNMATCHED_RETRIES + 1)
@@ -0,0 +1,69 @@
+from models import db
+from models.cart import CartItem
+from models.order import OrderItem
+
+
+def quantities(response):
+    return {item["menu_item_id"]: item["quantity"] for item in response.get_json()["items"]}
+
+
+def test_adding_an_item_twice_updates_one_row(app, client, user_id):
+    client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 2})
+    response = client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 3})
+    assert response.status_code == 201
+    assert quantities(response) == {1: 5}
+    assert response.get_json()["total"] == 500.0
+    with app.app_context():
+        assert CartItem.query.filter_by(user_id=user_id).count() == 1
+
+
+def test_quantities_are_capped_at_99(client):
+    client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 60})
+    assert quantities(client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 60})) == {1: 99}
+
+    assert client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 100}).status_code == 400
+    assert client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 0}).status_code == 400
+    assert client.put("/api/cart/items/1", json={"quantity": 100}).status_code == 400
+    assert quantities(client.put("/api/cart/items/1", json={"quantity": 4})) == {1: 4}
+    assert quantities(client.put("/api/cart/items/1", json={"quantity": 0})) == {}
+
+    response = client.put("/api/cart", json={"items": [
+        {"menu_item_id": 2, "quantity": 60}, {"menu_item_id": 2, "quantity": 60}, {"menu_item_id": 3, "quantity": 0},
+    ]})
+    assert quantities(response) == {2: 99}
+
+
+def test_replace_cart_rejects_malformed_items(client):
+    client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 2})
+    for body in ({"items": "1"}, {"items": [1]}, {"items": [{"quantity": 1}]},
+                 {"items": [{"menu_item_id": 1, "quantity": -1}]}):
+        assert client.put("/api/cart", json=body).status_code == 400, body
+    assert quantities(client.get("/api/cart")) == {1: 2}
+
+
+def test_unknown_items_are_rejected(client):
+    assert client.post("/api/cart/items", json={"menu_item_id": 404}).status_code == 404
+    assert client.put("/api/cart/items/404", json={"quantity": 1}).status_code == 404
+
+
+def test_checkout_prices_from_the_menu_and_empties_the_cart(app, client, user_id):
+    client.put("/api/cart", json={"items": [{"menu_item_id": 1, "quantity": 2}, {"menu_item_id": 4, "quantity": 1}]})
+    response = client.post("/api/cart/checkout", json={"customer_phone": "0712345678"})
+    assert response.status_code == 201
+    assert response.get_json()["total_amount"] == 450.0
+
+    order_id = response.get_json()["order_id"]
+    assert client.get(f"/api/orders/{order_id}").get_json()["order"]["status"] == "pending"
+    with app.app_context():
+        lines = {(item.menu_item_id, item.quantity, float(item.unit_price))
+                 for item in db.session.query(OrderItem).filter_by(order_id=order_id)}
+        assert lines == {(1, 2, 100.0), (4, 1, 250.0)}
+        assert CartItem.query.filter_by(user_id=user_id).count() == 0
+
+    assert client.post("/api/cart/checkout", json={"customer_phone": "0712345678"}).status_code == 400
+
+
+def test_checkout_requires_a_phone_and_keeps_the_cart(client):
+    client.post("/api/cart/items", json={"menu_item_id": 1, "quantity": 1})
+    assert client.post("/api/cart/checkout", json={}).status_code == 400
+    assert quantities(client.get("/api/cart")) == {1: 1}
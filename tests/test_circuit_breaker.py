@@ -0,0 +1,87 @@
+import os
+
+import pytest
+import requests
+
+from routes.payments import get_mpesa_client
+from services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from services.mpesa_client import MpesaClient, MpesaRequestError, MpesaUnavailable
+
+
+class DownSession:
+    """Stands in for requests.Session while Daraja refuses connections"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        raise requests.exceptions.ConnectionError("connection refused")
+
+
+def trip(breaker):
+    for _ in range(breaker.min_calls):
+        breaker.before_call()
+        breaker.record(True, 0.01)
+
+
+def test_failures_open_the_breaker_until_a_probe_succeeds(monkeypatch):
+    breaker = CircuitBreaker("stkpush", window=4, min_calls=4, failure_rate=0.5, open_seconds=30)
+    for failed in (False, True, False):
+        breaker.before_call()
+        breaker.record(failed, 0.01)
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.record(True, 0.01)
+    assert breaker.state == OPEN
+
+    with pytest.raises(CircuitOpenError) as refused:
+        breaker.before_call()
+    assert 29 <= refused.value.retry_after <= 30
+
+    opened_at = breaker._opened_at
+    monkeypatch.setattr("services.circuit_breaker.time.monotonic", lambda: opened_at + 31)
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    # Only one probe at a time while half-open
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record(False, 0.01)
+    assert breaker.state == CLOSED
+    assert breaker.stats()["trips"] == 1
+
+
+def test_slow_calls_open_the_breaker():
+    breaker = CircuitBreaker("stkquery", window=4, min_calls=4, slow_call_seconds=1.0, slow_call_rate=0.5)
+    for seconds in (0.1, 2.0, 0.1, 2.0):
+        breaker.before_call()
+        breaker.record(False, seconds)
+    assert breaker.state == OPEN
+
+
+def test_open_breaker_refuses_without_calling_daraja():
+    breaker = CircuitBreaker("stkquery", window=4, min_calls=4)
+    client = MpesaClient("https://daraja.test", {}, max_retries=0, breakers={"stkquery": breaker})
+    session = client._session = DownSession()
+    client._pid = os.getpid()
+
+    for _ in range(4):
+        with pytest.raises(MpesaRequestError):
+            client.request("stkquery", "POST", "/query")
+    assert breaker.state == OPEN
+    with pytest.raises(MpesaUnavailable) as refused:
+        client.request("stkquery", "POST", "/query")
+    assert refused.value.retry_after > 0
+    assert session.calls == 4
+
+
+def test_make_payment_answers_503_with_retry_after(app, client):
+    with app.app_context():
+        breaker = get_mpesa_client(app).breakers["stkpush"]
+    trip(breaker)
+
+    response = client.post("/api/make-payment", json={"phone": "0712345678", "order_id": 1})
+    assert response.status_code == 503
+    body = response.get_json()
+    assert body["success"] is False
+    assert 1 <= int(response.headers["Retry-After"]) == body["retry_after"] <= breaker.open_seconds
@@ -0,0 +1,75 @@
+from datetime import timedelta
+
+from models import db
+from models.idempotency import IdempotencyKey
+from models.order import Order
+from services.sql import utcnow
+
+ORDER = {"customer_phone": "0712345678", "items": [{"menu_item_id": 1, "quantity": 2}]}
+
+
+def post_order(client, body=ORDER, key="order-1"):
+    return client.post("/api/orders", json=body, headers={"Idempotency-Key": key})
+
+
+def order_count(app):
+    with app.app_context():
+        return Order.query.count()
+
+
+def test_replay_returns_the_stored_response(app, client):
+    first = post_order(client)
+    assert first.status_code == 201
+    assert "Idempotent-Replayed" not in first.headers
+
+    replay = post_order(client)
+    assert replay.status_code == 201
+    assert replay.headers["Idempotent-Replayed"] == "true"
+    assert replay.get_json() == first.get_json()
+    assert order_count(app) == 1
+
+    assert post_order(client, key="order-2").get_json()["order_id"] != first.get_json()["order_id"]
+    assert order_count(app) == 2
+
+
+def test_same_key_with_a_different_body_is_rejected(app, client):
+    post_order(client)
+    response = post_order(client, {**ORDER, "items": [{"menu_item_id": 2, "quantity": 1}]})
+    assert response.status_code == 422
+    assert "Idempotent-Replayed" not in response.headers
+    assert order_count(app) == 1
+
+
+def test_key_still_in_progress_answers_409(app, client, user_id):
+    from services import idempotency
+
+    with app.test_request_context("/api/orders", method="POST", json=ORDER):
+        fingerprint = idempotency.request_fingerprint()
+    with app.app_context():
+        now = utcnow()
+        db.session.add(IdempotencyKey(user_id=user_id, endpoint="create_order", key="order-1",
+                                      request_hash=fingerprint, status="in_progress",
+                                      created_at=now, expires_at=now + timedelta(hours=1)))
+        db.session.commit()
+
+    response = post_order(client)
+    assert response.status_code == 409
+    assert response.headers["Retry-After"] == "1"
+    assert order_count(app) == 0
+
+    # A claim older than the lock timeout belongs to a request that died
+    with app.app_context():
+        IdempotencyKey.query.update({"created_at": now - timedelta(hours=1)})
+        db.session.commit()
+    assert post_order(client).status_code == 201
+    assert order_count(app) == 1
+
+
+def test_client_errors_are_replayed_and_keyless_requests_always_run(app, client):
+    invalid = {**ORDER, "items": [{"menu_item_id": 404, "quantity": 1}]}
+    assert 400 <= post_order(client, invalid).status_code < 500
+    assert post_order(client, invalid).headers["Idempotent-Replayed"] == "true"
+
+    assert client.post("/api/orders", json=ORDER).status_code == 201
+    assert client.post("/api/orders", json=ORDER).status_code == 201
+    assert order_count(app) == 2
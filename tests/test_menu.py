@@ -0,0 +1,54 @@
+from models import db
+from models.menu import MenuItem
+from routes.menu import get_catalog_cache
+
+
+def test_if_none_match_returns_304_without_a_query(budgeted, client):
+    response = client.get("/api/menu")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "no-cache"
+    etag = response.headers["ETag"]
+
+    with budgeted(0) as client:
+        response = client.get("/api/menu", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.get_data() == b""
+
+
+def test_menu_change_invalidates_the_cached_body(app, client):
+    etag = client.get("/api/menu").headers["ETag"]
+
+    with app.app_context():
+        db.session.get(MenuItem, 1).price = 999
+        db.session.commit()
+    response = client.get("/api/menu", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert {item["id"]: item["price"] for item in response.get_json()}[1] == 999
+
+    etag = response.headers["ETag"]
+    with app.app_context():
+        MenuItem.query.filter_by(id=2).update({"is_available": False})
+        db.session.commit()
+    response = client.get("/api/menu", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert 2 not in {item["id"] for item in response.get_json()}
+
+
+def test_rolled_back_change_keeps_the_cache(app, client):
+    client.get("/api/menu")
+    with app.app_context():
+        cache = get_catalog_cache()
+        db.session.get(MenuItem, 1).price = 999
+        db.session.flush()
+        db.session.rollback()
+    misses = cache.misses
+    client.get("/api/menu")
+    assert cache.misses == misses
+
+
+def test_unknown_ids_are_not_cached(app, client):
+    assert client.get("/api/menu/404").status_code == 404
+    with app.app_context():
+        assert "menu:item:404" not in get_catalog_cache()._entries
@@ -0,0 +1,32 @@
+import pytest
+
+
+@pytest.mark.parametrize("config, headers, status", [
+    ({}, {}, 404),
+    ({"METRICS_PUBLIC": True}, {}, 200),
+    ({"METRICS_TOKEN": "scrape"}, {}, 401),
+    ({"METRICS_TOKEN": "scrape", "METRICS_PUBLIC": True}, {"Authorization": "Bearer wrong"}, 401),
+    ({"METRICS_TOKEN": "scrape"}, {"Authorization": "Bearer scrape"}, 200),
+])
+def test_metrics_access(app, config, headers, status):
+    app.config.update(config)
+    response = app.test_client().get("/metrics", headers=headers)
+    assert response.status_code == status
+
+
+def test_reused_pid_does_not_overwrite_a_dead_workers_file(tmp_path):
+    import json
+
+    from services.metrics import MetricsExporter
+
+    # A worker that exited, whose pid this process (a new exporter) now has
+    dead = MetricsExporter(str(tmp_path))
+    dead.flush()
+    with open(dead.path(), "w") as f:
+        json.dump({"counters": [["http_requests_total", [["endpoint", "/dead"]], 7]], "histograms": []}, f)
+
+    exporter = MetricsExporter(str(tmp_path))
+    exporter.flush()
+    assert exporter.path() == exporter.path() != dead.path()
+    counters, histograms = exporter.collect()
+    assert counters[("http_requests_total", (("endpoint", "/dead"),))] == 7
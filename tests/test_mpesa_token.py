@@ -0,0 +1,31 @@
+import threading
+import time
+
+from services.mpesa_token import TokenManager
+
+
+def test_hits_do_not_wait_for_background_refresh():
+    release = threading.Event()
+    fetches = []
+
+    def slow_fetcher():
+        fetches.append(time.time())
+        release.wait(5)
+        return "new-token", 3600
+
+    manager = TokenManager(slow_fetcher, expiry_margin=60, refresh_ahead=300)
+    # Inside the refresh-ahead window but still usable
+    manager._token, manager._expires_at = "old-token", time.time() + 200
+
+    started = time.perf_counter()
+    tokens = [manager.get_token() for _ in range(20)]
+    elapsed = time.perf_counter() - started
+
+    assert tokens == ["old-token"] * 20
+    assert elapsed < 0.5
+    release.set()
+    deadline = time.time() + 5
+    while manager.stats()["background_refreshes"] == 0 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(fetches) == 1
+    assert manager.get_token() == "new-token"
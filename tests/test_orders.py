@@ -0,0 +1,61 @@
+import pytest
+from sqlalchemy import text
+
+from models import db
+
+
+@pytest.fixture
+def order_ids(app, client):
+    ids = []
+    for i in range(7):
+        response = client.post("/api/orders", json={
+            "customer_phone": "0712345678", "items": [{"menu_item_id": 1 + i % 4, "quantity": 1}],
+        })
+        ids.append(response.get_json()["order_id"])
+    return ids
+
+
+def stamp(app, created_at, ids):
+    with app.app_context():
+        db.session.execute(
+            text("UPDATE orders SET created_at = :created_at WHERE id IN (%s)" % ",".join(map(str, ids))),
+            {"created_at": created_at},
+        )
+        db.session.commit()
+
+
+def test_cursor_walks_same_second_orders_once(app, client, order_ids):
+    stamp(app, "2025-01-01 12:00:00", order_ids)
+    seen, cursor = [], None
+    for _ in range(len(order_ids)):
+        response = client.get("/api/orders?limit=2&fields=id" + (f"&cursor={cursor}" if cursor else ""))
+        assert response.status_code == 200
+        seen += [order["id"] for order in response.get_json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(order_ids, reverse=True)
+
+
+def test_date_range_includes_midnight_of_first_day_only(app, client, order_ids):
+    stamp(app, "2025-01-01 00:00:00", order_ids[:2])
+    stamp(app, "2025-01-02 00:00:00", order_ids[2:])
+    response = client.get("/api/orders?from=2025-01-01&to=2025-01-01&fields=id")
+    assert sorted(order["id"] for order in response.get_json()) == order_ids[:2]
+
+
+def test_customer_can_only_cancel_unpaid_orders(app, client, order_ids):
+    from models.order import Order
+
+    assert client.put(f"/api/orders/{order_ids[0]}/status", json={"status": "confirmed"}).status_code == 400
+    sales = client.get("/api/admin/analytics/sales", headers={"Authorization": "Bearer admin"}).get_json()
+    assert sales["totals"]["orders"] == 0
+
+    response = client.put(f"/api/orders/{order_ids[0]}/status", json={"status": "cancelled"})
+    assert response.get_json()["order"]["status"] == "cancelled"
+
+    with app.app_context():
+        order = db.session.get(Order, order_ids[1])
+        order.status, order.payment_status = "confirmed", "completed"
+        db.session.commit()
+    assert client.put(f"/api/orders/{order_ids[1]}/status", json={"status": "cancelled"}).status_code == 409
@@ -0,0 +1,38 @@
+import pytest
+
+from services.query_stats import QUERY_BUDGETS, QueryBudgetExceeded
+
+
+@pytest.fixture
+def orders(client):
+    """More orders than one page, each with two lines, and a filled cart"""
+    for i in range(25):
+        response = client.post("/api/orders", json={
+            "customer_phone": "0712345678",
+            "items": [{"menu_item_id": 1 + i % 4, "quantity": 1}, {"menu_item_id": 1 + (i + 1) % 4, "quantity": 2}],
+        })
+        assert response.status_code == 201, response.get_json()
+    for menu_item_id in range(1, 5):
+        assert client.post("/api/cart/items", json={"menu_item_id": menu_item_id, "quantity": 2}).status_code == 201
+
+
+@pytest.mark.parametrize("path", list(QUERY_BUDGETS))
+def test_endpoint_within_budget(budgeted, client, orders, path):
+    # The first request warms the per-worker catalog and user caches
+    assert client.get(path).status_code == 200
+    with budgeted(QUERY_BUDGETS[path]) as warm_client:
+        response = warm_client.get(path)
+    assert response.status_code == 200
+
+
+def test_orders_budget_counts_items_once(budgeted, orders):
+    with budgeted(QUERY_BUDGETS["/api/orders?limit=100"]) as client:
+        response = client.get("/api/orders?limit=100")
+    assert len(response.get_json()) == 25
+    assert all(len(order["items"]) == 2 for order in response.get_json())
+
+
+def test_budget_exceeded_lists_statements(budgeted, orders):
+    with pytest.raises(QueryBudgetExceeded, match="cart_items"):
+        with budgeted(0) as client:
+            client.get("/api/cart")
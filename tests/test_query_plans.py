@@ -0,0 +1,25 @@
+from sqlalchemy import text
+
+from models import db
+from services.query_plans import check_query_plans
+
+
+def scans_by_route(app):
+    with app.app_context():
+        return {description: scans for description, statement, plan, scans in check_query_plans() if scans}
+
+
+def test_route_statements_do_not_scan_guarded_tables(app):
+    with app.app_context():
+        descriptions = {description for description, statement, plan, scans in check_query_plans()}
+    assert {"GET /api/orders", "POST /api/cart/checkout", "callback inbox: drain", "reconciler: apply"} <= descriptions
+    assert scans_by_route(app) == {}
+
+
+def test_missing_index_is_reported(app):
+    with app.app_context():
+        db.session.execute(text("DROP INDEX ix_orders_user_id_created_at_id"))
+        db.session.commit()
+    scans = scans_by_route(app)
+    assert "GET /api/orders" in scans
+    assert all(detail.startswith("SCAN orders") for detail in scans["GET /api/orders"])